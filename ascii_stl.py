@@ -0,0 +1,150 @@
+import io
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# Size of the blocks an ASCII STL file is read in
+ASCII_CHUNK_SIZE = 1 << 22
+
+# The words in each facet of an ASCII STL file by position, the rest of the tokens are numbers (the normal is first)
+FACET_TOKENS = 21
+FACET_WORDS = ((0, b'facet'), (1, b'normal'), (5, b'outer'), (6, b'loop'), (7, b'vertex'), (11, b'vertex'),
+               (15, b'vertex'), (19, b'endloop'), (20, b'endfacet'))
+NUMBER_COLUMNS = [2, 3, 4, 8, 9, 10, 12, 13, 14, 16, 17, 18]
+
+# The same characters bytes.split() splits on
+WHITESPACE = np.zeros(256, bool)
+WHITESPACE[list(b' \t\n\r\x0b\x0c')] = True
+
+
+def read_ascii_facets(file: io.BufferedReader, solid_name: bytes,
+                      chunk_size: int = ASCII_CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """
+    Reads the facets of an ASCII STL file a block at a time, after the solid line has already been read. Checks the
+    same format as stl_to_raw.read_ascii_stl: every facet must be "facet normal x y z outer loop", three "vertex x y z",
+    "endloop endfacet", and the file must finish with "endsolid <solid_name>".
+    :param file: a ASCII STL file
+    :param solid_name: the name of the solid from the solid line
+    :param chunk_size: the number of bytes to read at a time
+    :return: an iterator of (N,3,3) float32 arrays of the vertices of each triangle
+    """
+    buffer = b''
+    at_end = False
+    while True:
+        if not at_end:
+            block = file.read(chunk_size)
+            at_end = not block
+            buffer = buffer + block if buffer else block
+
+        # Only the tokens that are followed by whitespace are complete
+        complete = len(buffer) if at_end else last_whitespace(buffer) + 1
+        data = np.frombuffer(buffer, np.uint8, complete)
+        starts, ends = token_bounds(data)
+
+        # Convert all of the facets that have the correct words
+        num_facets = count_facets(data, starts, ends)
+        if num_facets:
+            yield parse_facets(data, starts, ends, num_facets)
+
+        # Whatever is left is either the end of the solid, part of a facet, or wrong
+        pos = num_facets * FACET_TOKENS
+        tokens = [buffer[start:end] for start, end in zip(starts[pos:pos + FACET_TOKENS], ends[pos:pos + FACET_TOKENS])]
+        buffer = buffer[starts[pos]:] if tokens else buffer[complete:]
+        if len(tokens) >= 2 and tokens[0] == b'endsolid':
+            if tokens[1] != solid_name:
+                raise Exception(f"Incorrect word in stl: {tokens[1]}")
+            return
+        elif tokens and tokens[0] not in (b'facet', b'endsolid'):
+            raise Exception('Stl file has an incorrect format')
+        elif len(tokens) == FACET_TOKENS:
+            wrong = next(tokens[column] for column, word in FACET_WORDS if tokens[column] != word)
+            raise Exception(f"Incorrect word in stl: {wrong}")
+
+        if at_end:
+            raise Exception('STL file too short')
+
+
+def last_whitespace(buffer: bytes) -> int:
+    """
+    Finds the last whitespace character in a byte string
+    :param buffer: a byte string
+    :return: the index of the last whitespace character or -1
+    """
+    return max(buffer.rfind(char) for char in (b' ', b'\n', b'\r', b'\t', b'\x0b', b'\x0c'))
+
+
+def token_bounds(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the whitespace separated tokens in an array of bytes
+    :param data: an array of bytes
+    :return: arrays of the start and end (exclusive) of each token
+    """
+    # 1 where a token starts (whitespace to not) and -1 where it ends, the ends of the data count as whitespace
+    change = np.diff(WHITESPACE[data].view(np.int8), prepend=np.int8(1), append=np.int8(1))
+    return np.flatnonzero(change == -1), np.flatnonzero(change == 1)
+
+
+def count_facets(data: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> int:
+    """
+    Counts the number of complete facets that have the correct words at the start of the tokens
+    :param data: an array of bytes
+    :param starts: the start of each token in data
+    :param ends: the end of each token in data
+    :return: the number of facets
+    """
+    num_facets = len(starts) // FACET_TOKENS
+    starts = starts[:num_facets * FACET_TOKENS].reshape(-1, FACET_TOKENS)
+    lengths = ends[:num_facets * FACET_TOKENS].reshape(-1, FACET_TOKENS) - starts
+
+    # Compare the first 8 bytes of each token (all of the words fit) as a single number
+    correct = np.ones(num_facets, bool)
+    window = np.arange(8)
+    for column, word in FACET_WORDS:
+        correct &= lengths[:, column] == len(word)
+        chars = data[np.minimum(starts[:, column, None] + window, len(data) - 1)]
+        chars[:, len(word):] = 0
+        correct &= chars.view('<u8').ravel() == int.from_bytes(word.ljust(8, b'\0'), 'little')
+
+    return num_facets if correct.all() else int(np.argmin(correct))
+
+
+def parse_facets(data: np.ndarray, starts: np.ndarray, ends: np.ndarray, num_facets: int) -> np.ndarray:
+    """
+    Converts the numbers of the facets at the start of the tokens
+    :param data: an array of bytes
+    :param starts: the start of each token in data
+    :param ends: the end of each token in data
+    :param num_facets: the number of facets, they must all have the correct words
+    :return: a (num_facets,3,3) array of the vertices of each triangle
+    """
+    starts = starts[:num_facets * FACET_TOKENS].reshape(-1, FACET_TOKENS)
+    ends = ends[:num_facets * FACET_TOKENS].reshape(-1, FACET_TOKENS)
+
+    # Blank out the words so only the numbers are left and numpy can convert them all in one go
+    text = data[starts[0, 0]:ends[-1, -1]].copy()
+    for column, word in FACET_WORDS:
+        text[(starts[:, column] - starts[0, 0])[:, None] + np.arange(len(word))] = ord(' ')
+    try:
+        numbers = np.fromstring(text.tobytes(), sep=' ')
+    except ValueError:
+        numbers = None
+
+    # Anything numpy doesn't read the same way as the tokens (like "1_000") goes through float() one at a time
+    if numbers is None or len(numbers) != num_facets * len(NUMBER_COLUMNS):
+        numbers = np.array([parse_number(data[start:end].tobytes())
+                            for start, end in zip(starts[:, NUMBER_COLUMNS].ravel(), ends[:, NUMBER_COLUMNS].ravel())])
+
+    # The normals are read (so they are checked) but thrown away
+    return numbers.reshape(num_facets, len(NUMBER_COLUMNS))[:, 3:].astype(np.float32).reshape(num_facets, 3, 3)
+
+
+def parse_number(token: bytes) -> float:
+    """
+    Converts a single token to a float
+    :param token: the token
+    :return: the float
+    """
+    try:
+        return float(token)
+    except ValueError:
+        raise Exception(f"Incorrect number in STL: {token}")
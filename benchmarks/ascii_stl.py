@@ -0,0 +1,71 @@
+"""
+Compares the speed of the Tokenizer based ASCII STL reader with the block based one.
+
+    python benchmarks/ascii_stl.py [--megabytes N] [--skip-reference]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stl_to_raw  # noqa: E402
+
+FACET = (b'facet normal %e %e %e\n  outer loop\n    vertex %e %e %e\n    vertex %e %e %e\n    vertex %e %e %e\n'
+         b'  endloop\nendfacet\n')
+
+
+def make_ascii_stl(path: str, megabytes: int):
+    """
+    Writes a random ASCII STL file of about the given size where each vertex is shared by a few triangles
+    """
+    num_tris = megabytes * 2**20 // len(FACET % ((0.0,) * 12))
+    rng = np.random.default_rng(0)
+    points = rng.random((num_tris // 2 + 3, 3))
+    with open(path, 'wb') as f:
+        f.write(b'solid bench\n')
+        for start in range(0, num_tris, 100_000):
+            count = min(100_000, num_tris - start)
+            facets = np.zeros((count, 4, 3))
+            facets[:, 1:] = points[rng.integers(0, len(points), (count, 3))]
+            f.write(b''.join(FACET % tuple(facet) for facet in facets.reshape(count, 12)))
+        f.write(b'endsolid bench\n')
+    return num_tris
+
+
+def time_reader(path: str, reader):
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        header, header_pos, _ = stl_to_raw.process_header(file)
+        result = reader(file, header, header_pos)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megabytes', type=int, default=50)
+    parser.add_argument('--skip-reference', action='store_true', help="don't run the Tokenizer based reader")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.stl')
+        num_tris = make_ascii_stl(path, args.megabytes)
+        print(f'{num_tris} triangles, {os.path.getsize(path) / 2**20:.1f} MiB')
+
+        fast_time, (vertices, indices) = time_reader(path, stl_to_raw.read_ascii_stl_np)
+        print(f'     blocks: {fast_time:7.2f}s  {os.path.getsize(path) / 2**20 / fast_time:7.1f} MiB/s')
+
+        if not args.skip_reference:
+            ref_time, result = time_reader(path, stl_to_raw.read_ascii_stl)
+            ref_vertices, ref_indices = stl_to_raw.ibo_to_arrays(*result)
+            print(f'  tokenizer: {ref_time:7.2f}s  {os.path.getsize(path) / 2**20 / ref_time:7.1f} MiB/s  '
+                  f'({ref_time / fast_time:.1f}x slower)')
+            if len(ref_vertices) != len(vertices) or not np.array_equal(ref_indices, indices):
+                print('  WARNING: results differ')
+
+
+if __name__ == '__main__':
+    main()
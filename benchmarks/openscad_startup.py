@@ -0,0 +1,62 @@
+"""
+Compares rendering the models in tests/openscad_files with a cold OpenSCAD process for each render to rendering them
+with warm_pool.WarmPool, where OpenSCAD has already started when the render is given to it.
+
+    python benchmarks/openscad_startup.py [--repeat N] [--openscad openscad-nightly]
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scheduler import run_process  # noqa: E402
+from scad.warm_pool import WarmPool  # noqa: E402
+
+MODELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'openscad_files')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--openscad', default='openscad-nightly')
+    parser.add_argument('--pause', type=float, default=2, help='seconds to give a slot to warm up between renders')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parameters = os.path.join(tmp, 'parameters.json')
+        with open(parameters, 'w') as f:
+            json.dump({'parameterSets': {'default': {}}, 'fileFormatVersion': '1'}, f)
+        output = os.path.join(tmp, 'output.stl')
+        pool = WarmPool(1, [args.openscad], os.path.join(tmp, 'slots'))
+
+        print(f'{"model":>20}  {"cold (s)":>9}  {"warm (s)":>9}')
+        try:
+            for model in sorted(glob.glob(os.path.join(MODELS, '*.scad'))):
+                cold = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    run_process([args.openscad, '--enable=customizer', '-o', output, '-p', parameters,
+                                 '-P', 'default', model]).check_returncode()
+                    cold.append(time.perf_counter() - start)
+
+                warm = []
+                pool.render(output, model, parameters, 'default')  # starts the first slot
+                for _ in range(args.repeat):
+                    time.sleep(args.pause)
+                    start = time.perf_counter()
+                    pool.render(output, model, parameters, 'default')
+                    warm.append(time.perf_counter() - start)
+                print(f'{os.path.basename(model):>20}  {statistics.median(cold):9.3f}  {statistics.median(warm):9.3f}')
+        finally:
+            pool.close()
+        if pool.broken:
+            print(f'{args.openscad} exits when its input is a named pipe, every render was cold')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares peak memory (max RSS) of the ways stl_to_raw can read a binary STL file. Each reader is run in its own process
+since max RSS can only go up.
+
+    python benchmarks/stl_memory.py [--triangles N] [--reference]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stl_to_raw  # noqa: E402
+
+
+def make_binary_stl(path: str, num_tris: int):
+    """
+    Writes a random binary STL file where each vertex is shared by about 6 triangles like a typical mesh
+    """
+    rng = np.random.default_rng(0)
+    points = rng.random((num_tris // 2 + 3, 3), np.float32)
+    triangles = np.zeros(num_tris, stl_to_raw.BINARY_TRIANGLE_DTYPE)
+    triangles['v'] = points[rng.integers(0, len(points), (num_tris, 3))]
+    with open(path, 'wb') as f:
+        f.write(b'benchmark'.ljust(stl_to_raw.BINARY_HEADER_SIZE, b'\0'))
+        f.write(np.uint32(num_tris).astype('<u4').tobytes())
+        f.write(triangles.tobytes())
+
+
+def run_reader(mode: str, path: str):
+    """
+    Runs one reader and prints the time, peak RSS, and output size (called in a child process)
+    """
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        _, header_pos, _ = stl_to_raw.process_header(file)
+        if mode == 'reference':
+            vertices, indices = stl_to_raw.ibo_to_arrays(*stl_to_raw.read_binary_stl(file, header_pos))
+        elif mode == 'buffered':
+            vertices, indices = stl_to_raw.read_binary_stl_np(file, header_pos)
+        else:
+            vertices, indices = stl_to_raw.read_binary_stl_mmap(file)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    print(f'{elapsed} {peak} {vertices.nbytes + indices.nbytes}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--triangles', type=int, default=2_000_000)
+    parser.add_argument('--reference', action='store_true', help='also run the slow dict-based reader')
+    parser.add_argument('--run', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_reader(*args.run)
+        return
+
+    modes = (['reference'] if args.reference else []) + ['buffered', 'mmap']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.stl')
+        make_binary_stl(path, args.triangles)
+        input_size = os.path.getsize(path)
+
+        # Baseline RSS of the interpreter with numpy loaded
+        baseline = subprocess.run([sys.executable, '-c', 'import resource, sys, numpy; '
+                                   'print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'],
+                                  capture_output=True, text=True, check=True)
+        baseline = int(baseline.stdout) * (1 if sys.platform == 'darwin' else 1024)
+
+        print(f'{args.triangles} triangles, input {input_size / 2**20:.1f} MiB, '
+              f'interpreter baseline {baseline / 2**20:.1f} MiB')
+        for mode in modes:
+            result = subprocess.run([sys.executable, __file__, '--run', mode, path],
+                                    capture_output=True, text=True, check=True)
+            elapsed, peak, output = result.stdout.split()
+            peak, output = int(peak), int(output)
+            print(f'{mode:>10}: {float(elapsed):7.2f}s  peak RSS {peak / 2**20:8.1f} MiB  '
+                  f'(+{(peak - baseline) / 2**20:.1f} MiB, output {output / 2**20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
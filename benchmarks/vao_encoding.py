@@ -0,0 +1,74 @@
+"""
+Compares the size and encode/decode speed of the vao encodings on a torus mesh.
+
+    python benchmarks/vao_encoding.py [--triangles N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import vao  # noqa: E402
+
+ENCODINGS = {
+    'plain (current)': {},
+    'zlib': {'compression': 'zlib'},
+    'quantized': {'quantize': True},
+    'quantized+delta': {'quantize': True, 'delta_indices': True},
+    'quantized+delta+zlib': {'quantize': True, 'delta_indices': True, 'compression': 'zlib'},
+    'quantized+delta+lzma': {'quantize': True, 'delta_indices': True, 'compression': 'lzma'},
+}
+
+
+def make_torus(num_tris: int) -> (np.ndarray, np.ndarray):
+    """
+    Makes a torus with about the given number of triangles, with the vertices and indices in grid order like a
+    tessellator gives them
+    """
+    n = max(int(np.sqrt(num_tris / 2)), 3)
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, n, endpoint=False), np.linspace(0, 2 * np.pi, n, endpoint=False))
+    vertices = np.stack(((30 + 10 * np.cos(v)) * np.cos(u), (30 + 10 * np.cos(v)) * np.sin(u), 10 * np.sin(v)), -1)
+
+    i, j = np.meshgrid(np.arange(n), np.arange(n))
+    a, b = j * n + i, j * n + (i + 1) % n
+    c, d = ((j + 1) % n) * n + i, ((j + 1) % n) * n + (i + 1) % n
+    indices = np.stack((a, b, d, a, d, c), -1)
+    return vertices.reshape(-1, 3).astype(np.float32), indices.ravel()
+
+
+def best_time(func, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--triangles', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    vertices, indices = make_torus(args.triangles)
+    num_tris = len(indices) // 3
+    raw_size = vertices.nbytes + len(indices) * 4
+    print(f'{num_tris} triangles, {len(vertices)} vertices')
+    print(f'{"encoding":>22}  {"bytes/tri":>9}  {"encode MiB/s":>12}  {"decode MiB/s":>12}  {"max error":>9}')
+
+    for name, options in ENCODINGS.items():
+        data = vao.encode_vao(vertices, indices, **options)
+        encode = best_time(lambda: vao.encode_vao(vertices, indices, **options))
+        decode = best_time(lambda: vao.decode_vao(data))
+        _, decoded_vertices, decoded_indices = vao.decode_vao(data)
+        assert np.array_equal(decoded_indices, indices)
+        error = np.abs(decoded_vertices - vertices).max()
+        print(f'{name:>22}  {len(data) / num_tris:9.2f}  {raw_size / 2**20 / encode:12.1f}  '
+              f'{raw_size / 2**20 / decode:12.1f}  {error:9.2g}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import numpy as np
+
+
+def dedup_vertices(points: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Removes duplicate vertices from an array of points, numbering the unique vertices in the order they are first seen
+    (the same numbering stl_to_raw.add_vertex_to_ibo gives). Vertices are compared by the raw bits of their float32
+    coordinates so no Python objects are made for them.
+    :param points: an (N,3) array of vertices, one for each corner of each triangle (a (T,3,3) array of triangles works
+                   too)
+    :return: an (M,3) float32 array of unique vertices and an array of N indices into it
+    """
+    points = np.asarray(points, np.float32)
+    n = points.size // 3
+    if n == 0:
+        return np.empty((0, 3), np.float32), np.empty(0, np.uint32)
+
+    first, indices = dedup_keys(vertex_bits(points))
+    return points[np.unravel_index(first, points.shape[:-1])], indices
+
+
+def dedup_keys(keys: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Finds the unique rows of an array of keys, numbering them in the order they are first seen
+    :param keys: an (N,K) array of uint32 (or any other integer type)
+    :return: an array of the row each unique key is first seen at (in order) and an array of N indices
+    """
+    n = len(keys)
+    if n == 0:
+        return np.empty(0, np.intp), np.empty(0, np.uint32)
+
+    # Stable sort so the first entry of each run of equal keys is the one seen first
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    del keys
+    starts = np.empty(n, bool)
+    starts[0] = True
+    np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1, out=starts[1:])
+    del sorted_keys
+    group = np.cumsum(starts, dtype=np.uint32)
+    group -= 1
+
+    # Renumber the groups by where they first appear
+    first = order[starts]
+    del starts
+    first_order = np.argsort(first, kind='stable')
+    rank = np.empty(len(first), np.uint32)
+    rank[first_order] = np.arange(len(first), dtype=np.uint32)
+
+    indices = np.empty(n, np.uint32)
+    indices[order] = rank[group]
+    return first[first_order], indices
+
+
+def vertex_bits(points: np.ndarray) -> np.ndarray:
+    """
+    Gets the raw bits of the float32 coordinates of vertices, used to compare vertices
+    :param points: an (N,3) array of vertices (or any shape ending in 3)
+    :return: an (N,3) uint32 array
+    """
+    # Adding zero turns -0.0 into 0.0 so they are merged like they are in a dict
+    bits = np.empty((points.size // 3, 3), np.uint32)
+    np.add(points, np.float32(0), out=bits.view(np.float32).reshape(points.shape))
+    return bits
+
+
+def hash_vertex_bits(bits: np.ndarray) -> np.ndarray:
+    """
+    Mixes the bits of each vertex into a single 64-bit hash
+    :param bits: an (N,3) array from vertex_bits
+    :return: an array of N uint64
+    """
+    bits = bits.astype(np.uint64)
+    hashes = bits[:, 0] * np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= bits[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)
+    hashes ^= bits[:, 2] * np.uint64(0x165667B19E3779F9)
+    hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+class VertexTable:
+    """
+    Dedups vertices a chunk at a time, numbering the unique vertices in the order they are first seen across all of the
+    chunks. Only a hash, index, and the bits of each unique vertex are kept.
+
+    The hashes are kept in sorted runs instead of one sorted array, so adding a chunk doesn't copy everything seen so
+    far: each chunk adds a run, and runs are merged when the newer one is as big as the older one (so there are
+    O(log n) runs and each hash is merged O(log n) times). The bits grow by doubling.
+    """
+
+    def __init__(self):
+        self.runs = []  # (sorted hashes, the index of the vertex for each hash), biggest first
+        self._bits = np.empty((0, 3), np.uint32)  # by index, only the first len(self) are used
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def bits(self) -> np.ndarray:
+        return self._bits[:self._count]
+
+    def add(self, points: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Adds a chunk of vertices to the table
+        :param points: an (N,3) array of vertices (a (T,3,3) array of triangles works too)
+        :return: an array of the vertices that weren't seen before (in order) and an array of N indices
+        """
+        vertices, indices = dedup_vertices(points)
+        bits = vertex_bits(vertices)
+        hashes = hash_vertex_bits(bits)
+
+        # Look up the vertices in the chunk, in each run until they are found
+        ids = np.full(len(vertices), -1, np.int64)
+        for run_hashes, run_ids in self.runs:
+            missing = np.flatnonzero(ids < 0)
+            pos = np.searchsorted(run_hashes, hashes[missing])
+            hit = np.flatnonzero(pos < len(run_hashes))
+            hit = hit[run_hashes[pos[hit]] == hashes[missing[hit]]]
+            candidates = run_ids[pos[hit]]
+            same = (self._bits[candidates] == bits[missing[hit]]).all(axis=1)
+            ids[missing[hit[same]]] = candidates[same]
+            for i in hit[~same]:
+                ids[missing[i]] = self.find_collision(run_hashes, run_ids, bits[missing[i]], pos[i])
+
+        # Number the new vertices after all of the existing ones
+        new = np.flatnonzero(ids < 0)
+        ids[new] = np.arange(len(self), len(self) + len(new))
+        self._append_bits(bits[new])
+        if len(new):
+            order = np.argsort(hashes[new], kind='stable')
+            self.runs.append((hashes[new][order], ids[new][order].astype(np.uint32)))
+            while len(self.runs) > 1 and len(self.runs[-2][0]) <= len(self.runs[-1][0]):
+                newer, older = self.runs.pop(), self.runs.pop()
+                merged = np.concatenate((older[0], newer[0]))
+                order = np.argsort(merged, kind='stable')
+                self.runs.append((merged[order], np.concatenate((older[1], newer[1]))[order]))
+
+        return vertices[new], ids.astype(np.uint32)[indices]
+
+    def _append_bits(self, bits: np.ndarray):
+        """
+        Adds the bits of new vertices, doubling the buffer when it is full
+        """
+        end = self._count + len(bits)
+        if end > len(self._bits):
+            grown = np.empty((max(end, 2 * len(self._bits)), 3), np.uint32)
+            grown[:self._count] = self.bits
+            self._bits = grown
+        self._bits[self._count:end] = bits
+        self._count = end
+
+    def find_collision(self, hashes: np.ndarray, ids: np.ndarray, bits: np.ndarray, pos: int) -> int:
+        """
+        Looks through all of the vertices in a run with the same hash for a vertex
+        :param hashes: the sorted hashes of the run
+        :param ids: the index of the vertex for each hash of the run
+        :param bits: the bits of the vertex
+        :param pos: the position of the first vertex with the hash
+        :return: the index of the vertex or -1 if it isn't in the run
+        """
+        hash_ = hashes[pos]
+        while pos < len(hashes) and hashes[pos] == hash_:
+            if (self._bits[ids[pos]] == bits).all():
+                return int(ids[pos])
+            pos += 1
+        return -1
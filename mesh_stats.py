@@ -0,0 +1,61 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Number of triangles handled at a time (so the temporary arrays stay small for huge meshes)
+STATS_CHUNK_TRIANGLES = 1 << 20
+
+MeshStats = namedtuple('MeshStats', ('bbox_min', 'bbox_max', 'surface_area', 'volume', 'num_triangles',
+                                     'num_degenerate'))
+
+
+def mesh_stats(vertices: np.ndarray, indices: np.ndarray) -> MeshStats:
+    """
+    Computes the statistics needed for print-cost estimates of an indexed triangle mesh
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices, 3 for each triangle
+    :return: the axis-aligned bounding box (min and max xyz), the surface area, the signed volume (positive if the
+             triangles are counter-clockwise seen from outside, only meaningful for a closed mesh), the number of
+             triangles, and the number of degenerate (zero area) triangles
+    """
+    vertices = np.asarray(vertices).reshape(-1, 3)
+    triangles = np.asarray(indices).reshape(-1, 3)
+    bbox_min, bbox_max = bounding_box(vertices)
+
+    area = volume = 0.0
+    num_degenerate = 0
+    for start in range(0, len(triangles), STATS_CHUNK_TRIANGLES):
+        chunk = triangles[start:start + STATS_CHUNK_TRIANGLES]
+        v0, v1, v2 = (vertices[chunk[:, i]].astype(np.float64) for i in range(3))
+
+        cross = np.cross(v1 - v0, v2 - v0)
+        double_areas = np.sqrt(np.einsum('ij,ij->i', cross, cross))
+        area += double_areas.sum() / 2
+        num_degenerate += int(np.count_nonzero(double_areas == 0))
+
+        # Sum of the signed volumes of the tetrahedrons made with the origin
+        volume += np.einsum('ij,ij->', v0, np.cross(v1, v2)) / 6
+
+    return MeshStats(bbox_min, bbox_max, float(area), float(volume), len(triangles), num_degenerate)
+
+
+def bounding_box(vertices: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Gets the minimum and maximum of each coordinate
+    :param vertices: an (N,3) array of vertices
+    :return: arrays of the min xyz and max xyz, all zeros if there are no vertices
+    """
+    vertices = np.asarray(vertices).reshape(-1, 3)
+    if len(vertices) == 0:
+        return np.zeros(3), np.zeros(3)
+    return vertices.min(axis=0), vertices.max(axis=0)
+
+
+def extents(vertices: np.ndarray) -> tuple:
+    """
+    Gets the size of the bounding box of the vertices
+    :param vertices: an (N,3) array of vertices
+    :return: the size in x, y, and z
+    """
+    bbox_min, bbox_max = bounding_box(vertices)
+    return tuple((bbox_max - bbox_min).tolist())
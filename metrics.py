@@ -0,0 +1,135 @@
+import contextlib
+import contextvars
+import resource
+import sys
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Iterator, Optional
+
+# What one stage (fetch, scad_json, render, ...) of getting a model took. Times are in seconds and sizes in bytes.
+# cpu_time is the work done in this process and child_cpu_time the work of the processes it ran. max_rss is the peak
+# memory of the largest process it ran, None if it didn't run one or it couldn't be measured.
+StageMetrics = namedtuple('StageMetrics', ('stage', 'wall_time', 'cpu_time', 'child_cpu_time', 'max_rss',
+                                           'output_bytes', 'failed'))
+
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+MAX_RSS_UNITS = 1 if sys.platform == 'darwin' else 1024
+
+_hooks = []
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+
+
+def add_metrics_hook(hook: Callable[[StageMetrics], None]):
+    """
+    Adds a function to call with the metrics of every stage when it finishes, it is called on the thread that ran the
+    stage so it should be quick and must not raise
+    """
+    _hooks.append(hook)
+
+
+def remove_metrics_hook(hook: Callable[[StageMetrics], None]):
+    """
+    Stops calling a function added with add_metrics_hook
+    """
+    _hooks.remove(hook)
+
+
+class Stage:
+    """
+    The measurements of a stage while it runs, see measure
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.child_cpu_time = 0.0
+        self.max_rss = None
+        self.output_bytes = 0
+
+    def add_process(self, usage: resource.struct_rusage, max_rss: bool = True):
+        """
+        Adds the resources used by a process the stage ran
+        :param usage: the resources of the process (from os.wait4)
+        :param max_rss: False if the max RSS isn't just of this process (from resource.getrusage)
+        """
+        self.child_cpu_time += usage.ru_utime + usage.ru_stime
+        if max_rss:
+            self.max_rss = max(self.max_rss or 0, usage.ru_maxrss * MAX_RSS_UNITS)
+
+
+@contextlib.contextmanager
+def measure(name: str) -> Iterator[Stage]:
+    """
+    Measures a stage and calls the metrics hooks with the result, even if it fails. Processes run with
+    scheduler.run_process in the stage (on the same thread, or the same task for asyncio) are added to it.
+    :param name: the name of the stage
+    :return: the stage, set its output_bytes
+    """
+    stage = Stage(name)
+    token = _current_stage.set(stage)
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    failed = True
+    try:
+        yield stage
+        failed = False
+    finally:
+        _current_stage.reset(token)
+        metrics = StageMetrics(name, time.perf_counter() - start_wall, time.thread_time() - start_cpu,
+                               stage.child_cpu_time, stage.max_rss, stage.output_bytes, failed)
+        for hook in list(_hooks):
+            hook(metrics)
+
+
+def current_stage() -> Optional[Stage]:
+    """
+    Gets the stage being measured, None if there isn't one
+    """
+    return _current_stage.get()
+
+
+class MetricsRegistry:
+    """
+    A metrics hook that adds up the metrics of each stage and formats them for Prometheus:
+
+        registry = MetricsRegistry()
+        add_metrics_hook(registry)
+        ...
+        registry.text()
+    """
+
+    # The sums kept for each stage, by the name of the metric
+    SUMS = (('seconds', 'wall_time'), ('cpu_seconds', 'cpu_time'), ('child_cpu_seconds', 'child_cpu_time'),
+            ('output_bytes', 'output_bytes'))
+
+    def __init__(self, prefix: str = 'model_customizer_stage'):
+        """
+        :param prefix: the start of the name of every metric
+        """
+        self.prefix = prefix
+        self.totals = {}  # by stage, a dict of runs, failures, the sums, and the largest max_rss
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: StageMetrics):
+        with self._lock:
+            totals = self.totals.setdefault(metrics.stage, dict.fromkeys(
+                ['runs', 'failures', 'max_rss_bytes'] + [name for name, _ in self.SUMS], 0))
+            totals['runs'] += 1
+            totals['failures'] += metrics.failed
+            for name, field in self.SUMS:
+                totals[name] += getattr(metrics, field)
+            totals['max_rss_bytes'] = max(totals['max_rss_bytes'], metrics.max_rss or 0)
+
+    def text(self) -> str:
+        """
+        Formats the totals in the Prometheus text format
+        """
+        with self._lock:
+            totals = {stage: dict(values) for stage, values in self.totals.items()}
+        kinds = [('runs', 'counter'), ('failures', 'counter')] + [(name, 'counter') for name, _ in self.SUMS]
+        lines = []
+        for name, kind in kinds + [('max_rss_bytes', 'gauge')]:
+            metric = f'{self.prefix}_{name}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.extend(f'{metric}{{stage="{stage}"}} {values[name]}' for stage, values in sorted(totals.items()))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+import numpy as np
+
+from dedup import dedup_keys
+
+# Faces meeting at a vertex with normals further apart than this (in degrees) get separate normals (a hard edge)
+DEFAULT_CREASE_ANGLE = 30.0
+
+# Faces that are this close to the crease angle still count as smooth (so flat faces work with a crease angle of 0)
+CREASE_TOLERANCE = 1e-6
+
+# Number of (corner, face around the same vertex) pairs looked at a time
+PAIR_CHUNK = 1 << 22
+
+
+def face_normals(vertices: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Computes the normal of each triangle from the order of its vertices (counter-clockwise is the front), instead of
+    trusting the normals in the STL file
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices, 3 for each triangle
+    :return: a (T,3) float64 array of normals whose lengths are twice the area of the triangle
+    """
+    triangles = np.asarray(indices).reshape(-1, 3)
+    v0, v1, v2 = (np.asarray(vertices, np.float64)[triangles[:, i]] for i in range(3))
+    return np.cross(v1 - v0, v2 - v0)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scales vectors to unit length, zero vectors are left as zero
+    :param vectors: an (N,3) array
+    :return: an (N,3) array
+    """
+    lengths = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, None]
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+
+def crease_normals(vertices: np.ndarray, indices: np.ndarray,
+                   crease_angle: float = DEFAULT_CREASE_ANGLE) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Computes a normal for each corner of each triangle by averaging (weighted by area) the normals of the triangles
+    around that vertex that are within the crease angle of the triangle. Corners at the same position with the same
+    normal are then welded into a single vertex, so smooth areas share vertices and hard edges split them. A crease
+    angle of 0 gives flat shading and 180 smooths everything.
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices, 3 for each triangle
+    :param crease_angle: the largest angle between faces (in degrees) that is still smoothed
+    :return: an (M,3) float32 array of vertices, an (M,3) float32 array of unit normals (zero for corners of degenerate
+             triangles), and an array of indices into them
+    """
+    vertices = np.asarray(vertices).reshape(-1, 3)
+    corner_vertices = np.asarray(indices).ravel()
+    weighted = face_normals(vertices, corner_vertices)
+    unit = normalize(weighted)
+    min_cos = np.cos(np.radians(crease_angle)) - CREASE_TOLERANCE
+
+    # Sort the corners by vertex so all of the corners of a vertex are together
+    order = np.argsort(corner_vertices, kind='stable')
+    sorted_faces = order // 3
+    counts = np.bincount(corner_vertices, minlength=len(vertices))
+    group_starts = np.cumsum(counts) - counts
+    sizes = counts[corner_vertices[order]]
+    firsts = group_starts[corner_vertices[order]]
+
+    # Pair each corner with every face around the same vertex, a chunk of corners at a time
+    sums = np.zeros((len(order), 3))
+    pair_ends = np.cumsum(sizes)
+    total_pairs = pair_ends[-1] if len(order) else 0
+    bounds = np.unique(np.searchsorted(pair_ends, np.arange(PAIR_CHUNK, total_pairs, PAIR_CHUNK)))
+    for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(order)]))):
+        chunk_sizes = sizes[start:stop]
+        pair_i = np.repeat(np.arange(start, stop), chunk_sizes)
+        pair_j = firsts[pair_i] + np.arange(len(pair_i)) - np.repeat(np.cumsum(chunk_sizes) - chunk_sizes, chunk_sizes)
+        face_i, face_j = sorted_faces[pair_i], sorted_faces[pair_j]
+
+        smooth = np.einsum('ij,ij->i', unit[face_i], unit[face_j]) >= min_cos
+        for axis in range(3):
+            sums[start:stop, axis] += np.bincount(pair_i[smooth] - start, weighted[face_j[smooth], axis],
+                                                  stop - start)
+
+    normals = np.empty_like(sums)
+    normals[order] = normalize(sums)
+    normals = normals.astype(np.float32)
+
+    # Weld corners with the same position and normal
+    keys = np.column_stack((corner_vertices.astype(np.uint32), (normals + np.float32(0)).view(np.uint32)))
+    first, new_indices = dedup_keys(keys)
+    return vertices[corner_vertices[first]].astype(np.float32), normals[first], new_indices
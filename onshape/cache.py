@@ -0,0 +1,133 @@
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Optional
+
+from .client import OnShapeClient
+from render_cache import MemoryCache, RenderCache
+
+# Where answers from OnShape are kept between runs and how much room they can take
+METADATA_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'model-customizer', 'onshape')
+METADATA_CACHE_MAX_BYTES = 64 << 20
+
+# Seconds an answer about a workspace is used before asking OnShape if it changed
+WORKSPACE_TTL = 60
+
+
+class MetadataCache(RenderCache):
+    """
+    An on-disk cache of JSON answers from OnShape, with the ones used recently also kept in memory. Answers about a
+    version can never change so they are kept until they are pushed out. Answers about a workspace are used for
+    WORKSPACE_TTL seconds, then OnShape is asked if they changed (with the ETag and Last-Modified of the answer, when it
+    sent them) and they are only downloaded again if they did. Its hits and misses count the answers found in the
+    cache or not, whether they were still good or not.
+    """
+
+    def __init__(self, directory: str = METADATA_CACHE_DIR, max_bytes: int = METADATA_CACHE_MAX_BYTES,
+                 ttl: float = WORKSPACE_TTL, memory_entries: int = 1024):
+        """
+        :param directory: the directory to keep the files in, made if it doesn't exist
+        :param max_bytes: the total size of the files to stay under
+        :param ttl: the seconds to use an answer about a workspace before checking it
+        :param memory_entries: the number of answers to also keep in memory
+        """
+        super().__init__(directory, max_bytes)
+        self.ttl = ttl
+        self.not_modified = 0
+        self._memory = MemoryCache(memory_entries)
+
+    def get_json(self, client: OnShapeClient, path: str, params: dict = None, permanent: bool = False,
+                 parse: Callable[[Any], Any] = None) -> Any:
+        """
+        Gets the JSON of a GET request, from the cache if it is there and still good. Only successful answers are
+        cached, an HTTP error is raised for the others.
+        :param client: the client to make the request with
+        :param path: the API path
+        :param params: the query parameters
+        :param permanent: the answer never changes (it is about a version), so it never has to be checked
+        :param parse: a function the JSON is passed through before it is cached, so it is only done once. It is part of
+                      the key, so the same path can be cached parsed in different ways.
+        :return: the JSON, or what parse returned for it. It is shared, callers shouldn't change it.
+        """
+        key = hashlib.sha256(json.dumps([path, params, parse and parse.__qualname__], sort_keys=True).encode())
+        key = key.hexdigest()
+        entry = self.load(key)
+        if entry is not None and (entry['expires'] is None or entry['expires'] > time.time()):
+            return entry['value']
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = client.request('GET', path, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.not_modified += 1
+        else:
+            response.raise_for_status()
+            if response.status_code // 100 != 2:
+                raise ValueError(f'Unexpected response {response.status_code} for {path}')
+            value = response.json()
+            entry = {'value': parse(value) if parse is not None else value,
+                     'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        entry['expires'] = None if permanent else time.time() + self.ttl
+        self.save(key, entry)
+        return entry['value']
+
+    async def get_json_async(self, client: OnShapeClient, path: str, params: dict = None, permanent: bool = False,
+                             parse: Callable[[Any], Any] = None) -> Any:
+        """
+        The asyncio version of get_json
+        """
+        return await client.run_async(self.get_json, client, path, params, permanent, parse)
+
+    def load(self, key: str) -> Optional[dict]:
+        """
+        Gets an entry from memory or disk (marking the file as recently used) whether it expired or not
+        :return: a dict of the value, when it expires, and the headers to check it with, None if it isn't cached
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        data = self.read(key, '.json')
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            self.hits -= 1
+            self.misses += 1
+            return None
+        self._memory.put(key, entry)
+        return entry
+
+    def save(self, key: str, entry: dict):
+        """
+        Saves an entry in memory and on disk, then removes old files if the cache is too big
+        """
+        self._memory.put(key, entry)
+        with self.new_file('.json') as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(entry, f)
+            self.put(key, tmp, '.json')
+
+    def clear(self):
+        """
+        Forgets all of the answers
+        """
+        self._memory.clear()
+        for entry in self.entries():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_metadata_cache() -> MetadataCache:
+    """
+    Gets the cache of answers from OnShape shared by everything in this process
+    """
+    return MetadataCache()
@@ -0,0 +1,170 @@
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ONSHAPE_URL = 'https://cad.onshape.com'
+
+# The headers of every request
+HEADERS = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
+           'Content-Type': 'application/json'}
+
+# Seconds to wait for a response and the most connections to keep open to OnShape at once
+ONSHAPE_TIMEOUT = 60
+ONSHAPE_MAX_CONNECTIONS = 10
+
+# Responses that are tried again, waiting ONSHAPE_BACKOFF * 2^n seconds before the nth retry (or as long as the
+# Retry-After header says). POSTs are only tried again when they are rate limited.
+ONSHAPE_RETRIES = 5
+ONSHAPE_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POST_RETRY_STATUSES = (429,)
+
+
+class OnShapeRetry(Retry):
+    """
+    Tries GETs again on RETRY_STATUSES, but POSTs only on POST_RETRY_STATUSES: an export that got a server error may
+    have started anyway, and a rate limited one never did
+    """
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method == 'POST':
+            return status_code in POST_RETRY_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class OnShapeClient:
+    """
+    Makes requests to the OnShape API through one requests.Session, so connections are kept open and reused instead
+    of doing a new TCP and TLS handshake for each request. Requests that are rate limited or GETs that get a server
+    error are tried again with exponential backoff. It can be used from many threads at once, and the async methods
+    run the requests on its own threads so the event loop shares the same connections.
+    """
+
+    def __init__(self, access_key: str, secret_key: str, base_url: str = ONSHAPE_URL,
+                 max_connections: int = ONSHAPE_MAX_CONNECTIONS, retries: int = ONSHAPE_RETRIES,
+                 backoff: float = ONSHAPE_BACKOFF, timeout: float = ONSHAPE_TIMEOUT):
+        """
+        :param access_key: the API access key from the OnShape developer portal
+        :param secret_key: the API secret key
+        :param base_url: where the API is, the paths given to the methods are relative to it
+        :param max_connections: the most connections to open to a host at once, more requests wait for one
+        :param retries: the number of times to try a request again
+        :param backoff: the seconds to wait before the first retry, doubling each time
+        :param timeout: the seconds to wait for a response
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_connections, thread_name_prefix='onshape')
+        self.session = requests.Session()
+        self.session.auth = (access_key, secret_key)
+        self.session.headers.update(HEADERS)
+
+        # POSTs aren't in allowed_methods so one whose response was lost isn't sent again, see OnShapeRetry
+        retry = OnShapeRetry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                             allowed_methods=frozenset(('GET',)), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, path: str) -> str:
+        """
+        Makes the full url of an API path like '/api/v5/documents/...' (full urls are left alone)
+        """
+        return urljoin(self.base_url, path)
+
+    def request(self, method: str, path: str, params: dict = None, json: Any = None, headers: dict = None,
+                stream: bool = False, raise_for_status: bool = False) -> requests.Response:
+        """
+        Makes a request, trying it again if it is rate limited or is a GET that gets a server error
+        :param method: 'GET', 'POST', ...
+        :param path: the API path or a full url
+        :param params: the query parameters
+        :param json: the body to send as JSON
+        :param headers: more headers to send, like If-None-Match
+        :param stream: don't read the body yet, so it can be read from response.raw as it comes in (close the response
+                       when done with it)
+        :param raise_for_status: raise an exception if the final response is an HTTP error
+        :return: the response
+        """
+        response = self.session.request(method, self.url(path), params=params, json=json, headers=headers,
+                                        stream=stream, timeout=self.timeout)
+        if raise_for_status:
+            response.raise_for_status()
+        return response
+
+    def get_json(self, path: str, params: dict = None, raise_for_status: bool = False) -> Any:
+        """
+        Makes a GET request, see request
+        :return: the response as JSON
+        """
+        return self.request('GET', path, params=params, raise_for_status=raise_for_status).json()
+
+    def post_json(self, path: str, json: Any, raise_for_status: bool = True) -> Any:
+        """
+        Makes a POST request, see request
+        :return: the response as JSON
+        """
+        return self.request('POST', path, json=json, raise_for_status=raise_for_status).json()
+
+    def get_bytes(self, path: str) -> bytes:
+        """
+        Downloads a file, like the result of an export
+        :return: the body of the response
+        """
+        return self.request('GET', path, raise_for_status=True).content
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Runs func(*args, **kwargs) on one of the client's threads, so requests can be made at the same time without
+        asyncio
+        :return: a future of the result
+        """
+        return self.executor.submit(func, *args, **kwargs)
+
+    async def run_async(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Runs func(*args, **kwargs) on one of the client's threads without blocking the event loop, so asyncio callers
+        share the threads and connections of everything else instead of using the default executor
+        :return: the result
+        """
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    async def get_json_async(self, path: str, params: dict = None, raise_for_status: bool = False) -> Any:
+        """
+        The asyncio version of get_json
+        """
+        return await self.run_async(self.get_json, path, params, raise_for_status)
+
+    async def post_json_async(self, path: str, json: Any, raise_for_status: bool = True) -> Any:
+        """
+        The asyncio version of post_json
+        """
+        return await self.run_async(self.post_json, path, json, raise_for_status)
+
+    async def get_bytes_async(self, path: str) -> bytes:
+        """
+        The asyncio version of get_bytes
+        """
+        return await self.run_async(self.get_bytes, path)
+
+    def close(self):
+        """
+        Closes the connections and stops the threads
+        """
+        self.executor.shutdown()
+        self.session.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_client() -> OnShapeClient:
+    """
+    Gets the OnShape client shared by everything in this process, with the API keys in config.py
+    """
+    from config import ACCESS_KEY, SECRET_KEY  # only needed once OnShape is used
+    return OnShapeClient(ACCESS_KEY, SECRET_KEY)
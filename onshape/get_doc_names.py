@@ -1,32 +1,71 @@
-import requests 
+import asyncio
 import re
 from collections import namedtuple
 
-from config import ACCESS_KEY, SECRET_KEY
+from .client import OnShapeClient, get_client
+from render_cache import MemoryCache
 
 
 OnShapeDocInfo = namedtuple("OnShapeDocInfo", ('did', 'wv', 'wvid', 'eid'))
 
+DOCUMENT_URL = re.compile(r"^https?://cad.onshape.com/documents/([0-9a-f]+)/([wv])/([0-9a-f]+)/e/([0-9a-f]+)")
 
-def get_doc_names(document_url):
+# The names of the documents seen recently by their OnShapeDocInfo. The names of versions are kept until they are
+# pushed out, workspaces can be renamed so theirs are only kept for DOC_NAMES_TTL seconds.
+DOC_NAMES_CACHE = MemoryCache(1024)
+DOC_NAMES_TTL = 60
+
+
+def get_doc_names(document_url, client: OnShapeClient = None, cache: MemoryCache = DOC_NAMES_CACHE):
     """
     Gets the names of the document and "tab" names based on a url. Two calls need to be made, one for the document name
-    and another for the elements. The call to get document name also contains a lot of other useful information, such as 
-    the current user's permissions interacting with the document, document owner name, isMutable, etc.
+    and another for the elements, and they are made at the same time. The call to get document name also contains a
+    lot of other useful information, such as the current user's permissions interacting with the document, document
+    owner name, isMutable, etc.
     :param document_url: the url of the onshape document
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param cache: the cache of names to use, None to always ask OnShape
     :return: the document name information as a list
     """
-
-    # Use the API keys generated from the Onshape developer portal 
-    api_keys = (ACCESS_KEY, SECRET_KEY)
-
-    doc_info_url = get_doc_info_url(get_doc_info(document_url))
-    doc_elements_url = get_doc_elements_url(get_doc_info(document_url))
-
-    doc_name = fetch_document_name(api_keys, doc_info_url)
-    doc_elements = fetch_document_elements(api_keys, doc_elements_url, get_doc_info(document_url))
-
-    return [doc_name] + doc_elements
+    doc_info = get_doc_info(document_url)
+    names = cache.get(doc_info) if cache is not None else None
+    if names is None:
+        if client is None:
+            client = get_client()
+        elements = client.submit(fetch_document_elements, get_doc_elements_url(doc_info), doc_info, client)
+        names = [fetch_document_name(get_doc_info_url(doc_info), client)] + elements.result()
+        cache_doc_names(cache, doc_info, names)
+    return list(names)
+
+
+async def get_doc_names_async(document_url, client: OnShapeClient = None, cache: MemoryCache = DOC_NAMES_CACHE):
+    """
+    The asyncio version of get_doc_names
+    :param document_url: the url of the onshape document
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param cache: the cache of names to use, None to always ask OnShape
+    :return: the document name information as a list
+    """
+    doc_info = get_doc_info(document_url)
+    names = cache.get(doc_info) if cache is not None else None
+    if names is None:
+        if client is None:
+            client = get_client()
+        name_json, elements_json = await asyncio.gather(
+            client.get_json_async(get_doc_info_url(doc_info)),
+            client.get_json_async(get_doc_elements_url(doc_info), params={'elementId': doc_info.eid}))
+        names = [check_document_name(name_json)] + check_document_elements(elements_json)
+        cache_doc_names(cache, doc_info, names)
+    return list(names)
+
+
+def cache_doc_names(cache: MemoryCache, doc_info: OnShapeDocInfo, names: list):
+    """
+    Adds the names of a document to a cache (if there is one), forever for a version and for DOC_NAMES_TTL seconds
+    for a workspace
+    """
+    if cache is not None:
+        cache.put(doc_info, names, None if doc_info.wv == 'v' else DOC_NAMES_TTL)
 
 
 def get_doc_info(document_url: str) -> OnShapeDocInfo:
@@ -34,64 +73,59 @@ def get_doc_info(document_url: str) -> OnShapeDocInfo:
     Builds a special document info url in order to fetch the wanted data from the document through the Onshape API
     :param document_url: the url of the onshape document
     """
-    m = re.match(r"^https?://cad.onshape.com/documents/([0-9a-f]+)/([wv])/([0-9a-f]+)/e/([0-9a-f]+)", document_url)
+    m = DOCUMENT_URL.match(document_url)
     if m is None: raise ValueError('invalid OnShape URL')
     return OnShapeDocInfo(m.group(1), m.group(2), m.group(3), m.group(4))
 
 
 def get_doc_info_url(doc_info: OnShapeDocInfo) -> str:
-    return f'https://cad.onshape.com/api/v5/documents/{doc_info.did}'
+    return f'/api/v5/documents/{doc_info.did}'
 
 def get_doc_elements_url(doc_info: OnShapeDocInfo) -> str:
-    return f'https://cad.onshape.com/api/v5/documents/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/elements'
+    return f'/api/v5/documents/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/elements'
 
-def fetch_document_name(api_keys, api_name_url):
+def fetch_document_name(api_name_url, client: OnShapeClient):
     """
-    Takes an api_url and the api keys and fetches the document information data
-    :param api_keys: the api keys
-    :param api_url: the url that the get call will use
+    Takes an api_url and fetches the document information data
+    :param api_name_url: the url that the get call will use
+    :param client: the client to make the request with
+    :return: the onshape document name as a string
+    """
+    return check_document_name(client.get_json(api_name_url))
+
+
+def check_document_name(json):
+    """
+    Gets the name out of the response to a document request
+    :param json: the response as JSON
     :return: the onshape document name as a string
     """
-    # Optional query parameters can be assigned 
-    params = {}
-
-    # Define the header for the request 
-    headers = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
-            'Content-Type': 'application/json'}
-
-    # Putting everything together to make the API request 
-    response = requests.get(api_name_url, 
-                            params=params, 
-                            auth=api_keys,
-                            headers=headers)
-    json = response.json()
     if 'name' not in json:
         raise ValueError(f'Bad request: {json}')
     
     return json['name']
 
 
-def fetch_document_elements(api_keys, api_elements_url, doc_info):
+def fetch_document_elements(api_elements_url, doc_info, client: OnShapeClient):
     """
-    Takes an api_url and the api keys and fetches the document element information data
-    :param api_keys: the api keys
-    :param api_url: the url that the get call will use
+    Takes an api_url and fetches the document element information data
+    :param api_elements_url: the url that the get call will use
+    :param doc_info: the document the url is for
+    :param client: the client to make the request with
     :return: the onshape document element names as strings in a list
     """
     # Optional query parameters can be assigned 
     params = {'elementId': f'{doc_info.eid}'}
 
-    # Define the header for the request 
-    headers = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
-            'Content-Type': 'application/json'}
+    return check_document_elements(client.get_json(api_elements_url, params=params))
 
-    # Putting everything together to make the API request 
-    response = requests.get(api_elements_url, 
-                            params=params, 
-                            auth=api_keys,
-                            headers=headers)
-    json = response.json()
 
+def check_document_elements(json):
+    """
+    Gets the names out of the response to an elements request
+    :param json: the response as JSON
+    :return: the onshape document element names as strings in a list
+    """
     element_names = []
     for dict in json:
         if 'name' not in dict:
@@ -1,34 +1,341 @@
-import requests 
+import asyncio
+import functools
+import hashlib
+import json
+import os
 import re
+import time
 from collections import namedtuple
-from tempfile import NamedTemporaryFile
+from typing import Any, BinaryIO, Callable, Optional
+from urllib.parse import quote_plus
+
+from .client import OnShapeClient, get_client
+from metrics import measure
+from render_cache import MemoryCache, RenderCache, vao_key
+from scheduler import PRIORITY_EXPORT, AsyncRenderScheduler, RenderScheduler
+from stl_to_raw import read_stl
+from vao import encode_vao
 
 
 OnShapeDocInfo = namedtuple("OnShapeDocInfo", ('did', 'wv', 'wvid', 'eid'))
 
+# The export options, configuration is filled in with the variables of each export and the rest with its tier
+STL_EXPORT_JSON = {
+    "formatName": "STL",
+    "mode": "binary",
+    "scale": "1.0",
+    "units": "millimeter",
+    "grouping": "true",
+    "storeInDocument": "false",
+    "configuration": ""
+}
+
+# How fine the mesh of each tier of export is, previews are coarser so they are quicker to export and download
+STL_EXPORT_TIERS = {
+    'preview': {
+        "resolution": "coarse",
+        "angleTolerance": "0.5235987755982988",
+        "chordTolerance": "0.5",
+        "minFacetWidth": "1.0",
+    },
+    'final': {
+        "resolution": "medium",
+        "angleTolerance": "0.1090830782496456",
+        "chordTolerance": "0.12",
+        "minFacetWidth": "0.254",
+    },
+}
+
+# The most exports to have running on OnShape at once, more wait for one to finish
+ONSHAPE_MAX_EXPORTS = int(os.environ.get('ONSHAPE_MAX_EXPORTS', 4))
+
+# Seconds to wait before checking if an export is done, doubling each time up to EXPORT_MAX_POLL, and the longest an
+# export can take
+EXPORT_POLL = 0.25
+EXPORT_MAX_POLL = 8
+EXPORT_TIMEOUT = 300
+
+# Where exported models are kept between runs and how much room they can take
+EXPORT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'model-customizer', 'onshape-exports')
+EXPORT_CACHE_MAX_BYTES = 1 << 30
+
+# The current microversions of the workspaces seen recently, they are used for MICROVERSION_TTL seconds before asking
+# OnShape again (so a change to a workspace can take that long to show up)
+MICROVERSIONS = MemoryCache(1024)
+MICROVERSION_TTL = 5
+
+
+def get_stl(document_url: str, variables: dict = None, client: OnShapeClient = None,
+            timeout: float = EXPORT_TIMEOUT, tier: str = 'final', cache: RenderCache = None) -> bytes:
+    """
+    Exports the part studio of an onshape document as a binary stl file. Exports are cached by the version (or
+    microversion of the workspace) of the document, the configuration, and the tier, so a configuration that was
+    exported before isn't exported again.
+    :param document_url: the url of the onshape document
+    :param variables: the configuration to export, a dict of parameter ids and values (see encode_configuration)
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param timeout: the seconds the export can take
+    :param tier: 'preview' for a quick, coarse mesh or 'final' (see STL_EXPORT_TIERS), they are cached separately
+    :param cache: the cache to use, defaults to get_export_cache()
+    :return: the contents of the stl file
+    """
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_export_cache()
+    doc_info = resolve_doc_info(get_doc_info(document_url), client)
+    settings = export_settings(variables, tier)
+    key = export_key(doc_info, settings)
+
+    data = cache.read(key, '.stl')
+    if data is None:
+        data = export(doc_info, settings, read_all, client, timeout)
+        write_cached(cache, key, '.stl', data)
+    return data
+
+
+async def get_stl_async(document_url: str, variables: dict = None, client: OnShapeClient = None,
+                        timeout: float = EXPORT_TIMEOUT, tier: str = 'final', cache: RenderCache = None) -> bytes:
+    """
+    The asyncio version of get_stl
+    """
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_export_cache()
+    doc_info = await resolve_doc_info_async(get_doc_info(document_url), client)
+    settings = export_settings(variables, tier)
+    key = export_key(doc_info, settings)
 
-def download_file(url, local_filename):
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192): 
-                f.write(chunk)
-    return local_filename
+    data = cache.read(key, '.stl')
+    if data is None:
+        data = await export_async(doc_info, settings, read_all, client, timeout)
+        write_cached(cache, key, '.stl', data)
+    return data
 
 
-def get_stl(document_url: str, variables: dict = None):
+def get_vao(document_url: str, variables: dict = None, client: OnShapeClient = None, timeout: float = EXPORT_TIMEOUT,
+            tier: str = 'final', cache: RenderCache = None, **options) -> bytes:
     """
-    Generates our JSON format based on a url. Starts by getting the onshape document variables, turning them into json, 
-    and then formatting it correctly for our database.
+    Exports the part studio of an onshape document straight into a vao file, the stl is converted as it is downloaded.
+    The vao files are cached like the stl files of get_stl.
     :param document_url: the url of the onshape document
-    :return: the final json as a string
+    :param variables: the configuration to export, a dict of parameter ids and values (see encode_configuration)
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param timeout: the seconds the export can take
+    :param tier: 'preview' for a quick, coarse mesh or 'final' (see STL_EXPORT_TIERS)
+    :param cache: the cache to use, defaults to get_export_cache()
+    :param options: how to encode the vao file (see vao.write_vao)
+    :return: the contents of the vao file
     """
-    # Use the API keys generated from the Onshape developer portal 
-    stl_url = get_stl_url(get_doc_info(document_url))
-    link = fetch_onshape_document_stl(stl_url)["href"]
-    with NamedTemporaryFile('rb', suffix = '.stl', delete=False) as output_file:
-        print(output_file.name)
-        download_file(link, output_file.name)
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_export_cache()
+    doc_info = resolve_doc_info(get_doc_info(document_url), client)
+    settings = export_settings(variables, tier)
+    key = vao_key(export_key(doc_info, settings), options)
+
+    data = cache.read(key, '.vao')
+    if data is None:
+        data = encode_vao(*export(doc_info, settings, read_stl, client, timeout), **options)
+        write_cached(cache, key, '.vao', data)
+    return data
+
+
+async def get_vao_async(document_url: str, variables: dict = None, client: OnShapeClient = None,
+                        timeout: float = EXPORT_TIMEOUT, tier: str = 'final', cache: RenderCache = None,
+                        **options) -> bytes:
+    """
+    The asyncio version of get_vao
+    """
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_export_cache()
+    doc_info = await resolve_doc_info_async(get_doc_info(document_url), client)
+    settings = export_settings(variables, tier)
+    key = vao_key(export_key(doc_info, settings), options)
+
+    data = cache.read(key, '.vao')
+    if data is None:
+        vertices, indices = await export_async(doc_info, settings, read_stl, client, timeout)
+        data = await asyncio.to_thread(encode_vao, vertices, indices, **options)
+        write_cached(cache, key, '.vao', data)
+    return data
+
+
+def export(doc_info: OnShapeDocInfo, settings: dict, read: Callable[[BinaryIO], Any], client: OnShapeClient,
+           timeout: float = EXPORT_TIMEOUT) -> Any:
+    """
+    Exports the part studio of an onshape document as an stl file. OnShape does the export in the background, it is
+    checked with backoff until it is done and then the stl is passed to read as it is downloaded. At most
+    ONSHAPE_MAX_EXPORTS exports run at once and the same export asked for again while it runs is only done once.
+    :param doc_info: the document to export (see resolve_doc_info)
+    :param settings: the export options (see export_settings)
+    :param read: a function that reads the stl from a file object, like stl_to_raw.read_stl
+    :param client: the client to make the requests with
+    :param timeout: the seconds the export can take
+    :return: what read returns
+    """
+    return get_export_scheduler().submit(run_export, doc_info, settings, read, client, timeout,
+                                         key=(export_key(doc_info, settings), read, client),
+                                         priority=PRIORITY_EXPORT).result()
+
+
+async def export_async(doc_info: OnShapeDocInfo, settings: dict, read: Callable[[BinaryIO], Any],
+                       client: OnShapeClient, timeout: float = EXPORT_TIMEOUT) -> Any:
+    """
+    The asyncio version of export, waiting for the export doesn't take up a thread
+    """
+    return await get_async_export_scheduler().run(run_export_async, doc_info, settings, read, client, timeout,
+                                                  key=(export_key(doc_info, settings), read, client),
+                                                  priority=PRIORITY_EXPORT)
+
+
+def run_export(doc_info: OnShapeDocInfo, settings: dict, read: Callable[[BinaryIO], Any], client: OnShapeClient,
+               timeout: float) -> Any:
+    """
+    Starts an export, waits for it, and reads the stl (see export)
+    """
+    with measure('onshape_export'):
+        deadline = time.monotonic() + timeout
+        translation = client.post_json(get_stl_url(doc_info), settings)
+        poll = EXPORT_POLL
+        while check_translation(translation) is None:
+            if time.monotonic() + poll > deadline:
+                raise TimeoutError(f'OnShape export took more than {timeout} seconds')
+            time.sleep(poll)
+            poll = min(poll * 2, EXPORT_MAX_POLL)
+            translation = client.get_json(get_translation_url(translation['id']), raise_for_status=True)
+        return download(client, get_download_url(doc_info, check_translation(translation)), read)
+
+
+async def run_export_async(doc_info: OnShapeDocInfo, settings: dict, read: Callable[[BinaryIO], Any],
+                           client: OnShapeClient, timeout: float) -> Any:
+    """
+    The asyncio version of run_export
+    """
+    with measure('onshape_export'):
+        deadline = time.monotonic() + timeout
+        translation = await client.post_json_async(get_stl_url(doc_info), settings)
+        poll = EXPORT_POLL
+        while check_translation(translation) is None:
+            if time.monotonic() + poll > deadline:
+                raise TimeoutError(f'OnShape export took more than {timeout} seconds')
+            await asyncio.sleep(poll)
+            poll = min(poll * 2, EXPORT_MAX_POLL)
+            translation = await client.get_json_async(get_translation_url(translation['id']), raise_for_status=True)
+        return await client.run_async(download, client, get_download_url(doc_info, check_translation(translation)),
+                                      read)
+
+
+def resolve_doc_info(doc_info: OnShapeDocInfo, client: OnShapeClient) -> OnShapeDocInfo:
+    """
+    Pins a workspace to its current microversion, so an export is of exactly what its cache key says. Versions never
+    change so they are left alone.
+    :param doc_info: the document from get_doc_info
+    :param client: the client to make the request with
+    :return: the document with 'm' and the microversion in place of 'w' and the workspace
+    """
+    if doc_info.wv != 'w':
+        return doc_info
+    microversion = MICROVERSIONS.get(doc_info)
+    if microversion is None:
+        microversion = client.get_json(get_microversion_url(doc_info), raise_for_status=True)['microversion']
+        MICROVERSIONS.put(doc_info, microversion, MICROVERSION_TTL)
+    return doc_info._replace(wv='m', wvid=microversion)
+
+
+async def resolve_doc_info_async(doc_info: OnShapeDocInfo, client: OnShapeClient) -> OnShapeDocInfo:
+    """
+    The asyncio version of resolve_doc_info
+    """
+    if doc_info.wv != 'w':
+        return doc_info
+    microversion = MICROVERSIONS.get(doc_info)
+    if microversion is None:
+        response = await client.get_json_async(get_microversion_url(doc_info), raise_for_status=True)
+        microversion = response['microversion']
+        MICROVERSIONS.put(doc_info, microversion, MICROVERSION_TTL)
+    return doc_info._replace(wv='m', wvid=microversion)
+
+
+def export_settings(variables: Optional[dict], tier: str) -> dict:
+    """
+    Makes the options of an export
+    :param variables: the configuration to export (see encode_configuration)
+    :param tier: a key of STL_EXPORT_TIERS
+    :return: the JSON to start the export with
+    """
+    if tier not in STL_EXPORT_TIERS:
+        raise ValueError(f'unknown export tier: {tier}')
+    return dict(STL_EXPORT_JSON, **STL_EXPORT_TIERS[tier], configuration=encode_configuration(variables))
+
+
+def export_key(doc_info: OnShapeDocInfo, settings: dict) -> str:
+    """
+    Makes the cache key of an export, which is the same for the same document version, element, configuration, and
+    export options
+    :param doc_info: the document from resolve_doc_info
+    :param settings: the export options from export_settings
+    :return: a hex string
+    """
+    return hashlib.sha256(json.dumps([doc_info, settings], sort_keys=True).encode()).hexdigest()
+
+
+def write_cached(cache: RenderCache, key: str, suffix: str, data: bytes):
+    """
+    Adds the contents of a file to the cache
+    """
+    with cache.new_file(suffix) as tmp:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        cache.put(key, tmp, suffix)
+
+
+def check_translation(translation: dict):
+    """
+    Checks the state of an export
+    :param translation: the response to starting or checking an export
+    :return: the id of the stl file once it is done, None while it is running
+    """
+    state = translation.get('requestState')
+    if state == 'DONE':
+        return translation['resultExternalDataIds'][0]
+    if state == 'ACTIVE':
+        return None
+    raise ValueError(f'OnShape export failed: {translation.get("failureReason", translation)}')
+
+
+def download(client: OnShapeClient, path: str, read: Callable[[BinaryIO], Any]) -> Any:
+    """
+    Downloads the result of an export, passing it to read as it comes in
+    :return: what read returns
+    """
+    with measure('onshape_download') as stage, client.request('GET', path, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        result = read(response.raw)
+        stage.output_bytes = response.raw.tell()
+        return result
+
+
+def read_all(file: BinaryIO) -> bytes:
+    return file.read()
+
+
+def encode_configuration(variables: dict) -> str:
+    """
+    Makes the configuration OnShape takes from a dict of configuration parameter ids and values, like
+    'hollow=true;size=10+mm'. Booleans are made lowercase, quantities need their units (like '10 mm').
+    :param variables: the parameter ids and values, None for the default configuration
+    :return: the configuration as a string, empty for the default configuration
+    """
+    if not variables:
+        return ''
+    values = {name: str(value).lower() if isinstance(value, bool) else str(value) for name, value in variables.items()}
+    return ';'.join(f'{quote_plus(str(name))}={quote_plus(value)}' for name, value in sorted(values.items()))
 
 
 def get_doc_info(document_url: str) -> OnShapeDocInfo:
@@ -42,42 +349,37 @@ def get_doc_info(document_url: str) -> OnShapeDocInfo:
 
 
 def get_stl_url(doc_info: OnShapeDocInfo) -> str:
-    return f'https://cad.onshape.com/api/documents/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/export'
+    return f'/api/v5/partstudios/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/translations'
+
+def get_microversion_url(doc_info: OnShapeDocInfo) -> str:
+    return f'/api/v5/documents/d/{doc_info.did}/w/{doc_info.wvid}/currentmicroversion'
 
+def get_translation_url(translation_id: str) -> str:
+    return f'/api/v5/translations/{translation_id}'
 
-def fetch_onshape_document_stl(api_url):
+def get_download_url(doc_info: OnShapeDocInfo, file_id: str) -> str:
+    return f'/api/v5/documents/d/{doc_info.did}/externaldata/{file_id}'
+
+
+@functools.lru_cache(maxsize=None)
+def get_export_scheduler() -> RenderScheduler:
     """
-    Takes an api_url and the api keys and fetches the variable document data
-    :param api_url: the url that variables will be taken from
-    :param api_keys: the api keys
-    :return: the onshape document variables as a JSON
+    Gets the scheduler of exports shared by everything in this process, running ONSHAPE_MAX_EXPORTS at once
     """
+    return RenderScheduler(ONSHAPE_MAX_EXPORTS)
 
-    # Define the header for the request 
-    headers = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
-            'Content-Type': 'application/json'}
 
-    json = {
-    "format": "STL",
-    "destinationName": "output",
-    "mode": "binary",
-    "scale": "1.0",
-    "resolution": "medium",
-    "units": "millimeter",
-    "grouping": "true",
-    "angleTolerance": "0.1090830782496456",
-    "chordTolerance": "0.12",
-    "minFacetWidth": "0.254",
-    "triggerAutoDownload": "true",
-    "storeInDocument": "false",
-    "linkDocumentId": "3c26b3daca62374f0e255d71",
-    "linkDocumentWorkspaceId": "ce9955d5aaf2d5b4f25592e8",
-    "configuration": ""
-}
+@functools.lru_cache(maxsize=None)
+def get_async_export_scheduler() -> AsyncRenderScheduler:
+    """
+    Gets the asyncio scheduler of exports shared by everything in this process, running ONSHAPE_MAX_EXPORTS at once
+    """
+    return AsyncRenderScheduler(ONSHAPE_MAX_EXPORTS)
+
 
-    # Putting everything together to make the API request 
-    response = requests.post(api_url, 
-                            json = json,
-                            headers=headers)
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+@functools.lru_cache(maxsize=None)
+def get_export_cache() -> RenderCache:
+    """
+    Gets the cache of exports shared by everything in this process (in EXPORT_CACHE_DIR)
+    """
+    return RenderCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES)
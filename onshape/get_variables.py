@@ -1,11 +1,11 @@
-import requests 
+import copy
 import json
 import re
 import math
 from collections import namedtuple
 
-
-from ..config import ACCESS_KEY, SECRET_KEY
+from .cache import MetadataCache, get_metadata_cache
+from .client import OnShapeClient, get_client
 
 
 OnShapeDocInfo = namedtuple("OnShapeDocInfo", ('did', 'wv', 'wvid', 'eid'))
@@ -19,31 +19,53 @@ INC_AT_END = re.compile(rf"\[\s*({FLOAT})\s*\]\s*$")
 LEN_AT_END = re.compile(rf"\[\s*(\d+)\s*\]\s*$")
 
 
-def get_variables(document_url):
+def get_variables(document_url, client: OnShapeClient = None, cache: MetadataCache = None):
     """
     Generates our JSON format based on a url. Starts by getting the onshape document variables, turning them into json, 
-    and then formatting it correctly for our database.
+    and then formatting it correctly for our database. The answers from OnShape and our JSON are cached (see
+    cache.MetadataCache), for good if the url is of a version.
     :param document_url: the url of the onshape document
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param cache: the cache of answers from OnShape, defaults to cache.get_metadata_cache()
     :return: the final json as a string
     """
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_metadata_cache()
+    doc_info = get_doc_info(document_url)
 
+    variable_url = get_variable_url(doc_info)
+    configuration_url = get_configuration_url(doc_info)
 
-    # Use the API keys generated from the Onshape developer portal 
-    api_keys = (ACCESS_KEY, SECRET_KEY)
-
-    variable_url = get_variable_url(get_doc_info(document_url))
-    configuration_url = get_configuration_url(get_doc_info(document_url))
-
-    variable_feature_json = fetch_document_variable_features_json(api_keys, variable_url)
-    configuration_json = fetch_document_configuration_json(api_keys, configuration_url)
+    variable_feature_json = fetch_document_variable_features_json(variable_url, client, cache, doc_info.wv == 'v')
 
     # our_json_features = feature_json_to_our_json(variable_feature_json) 
-    our_json_configurations = configuration_json_to_our_json(configuration_json)
+    # cached after it is turned into our JSON, so that is only done once
+    our_json_configurations = cache.get_json(client, configuration_url, permanent=doc_info.wv == 'v',
+                                             parse=parse_configuration_json)
 
     # our_json_features.append(our_json_configurations)
 
     # return our_json_features
-    return our_json_configurations
+    return copy.deepcopy(our_json_configurations)  # the cached json is shared
+
+async def get_variables_async(document_url, client: OnShapeClient = None, cache: MetadataCache = None):
+    """
+    The asyncio version of get_variables, only the configuration is fetched since that is all get_variables returns
+    :param document_url: the url of the onshape document
+    :param client: the client to make the requests with, defaults to client.get_client()
+    :param cache: the cache of answers from OnShape, defaults to cache.get_metadata_cache()
+    :return: the final json
+    """
+    if client is None:
+        client = get_client()
+    if cache is None:
+        cache = get_metadata_cache()
+    doc_info = get_doc_info(document_url)
+    our_json = await cache.get_json_async(client, get_configuration_url(doc_info), permanent=doc_info.wv == 'v',
+                                          parse=parse_configuration_json)
+    return copy.deepcopy(our_json)
 
 def get_doc_info(document_url: str) -> OnShapeDocInfo:
     """
@@ -56,54 +78,70 @@ def get_doc_info(document_url: str) -> OnShapeDocInfo:
 
 
 def get_variable_url(doc_info: OnShapeDocInfo) -> str:
-    return f'https://cad.onshape.com/api/v5/variables/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/variables'
+    return f'/api/v5/variables/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/variables'
 
 def get_configuration_url(doc_info: OnShapeDocInfo) -> str:
-    return f'https://cad.onshape.com/api/v5/elements/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/configuration'
+    return f'/api/v5/elements/d/{doc_info.did}/{doc_info.wv}/{doc_info.wvid}/e/{doc_info.eid}/configuration'
 
 
-def fetch_document_variable_features_json(api_keys, api_url):
+def fetch_document_variable_features_json(api_url, client: OnShapeClient, cache: MetadataCache = None,
+                                          permanent: bool = False):
     """
-    Takes an api_url and the api keys and fetches the variable document data
+    Takes an api_url and fetches the variable document data
     :param api_url: the url that variables will be taken from
-    :param api_keys: the api keys
+    :param client: the client to make the request with
+    :param cache: the cache of answers from OnShape, None to always ask OnShape
+    :param permanent: the url is of a version, so the answer can be cached for good
     :return: the onshape document variables as a JSON
     """
     # Optional query parameters can be assigned 
     params = {'includeValuesAndReferencedVariables':True}
 
-    # Define the header for the request 
-    headers = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
-            'Content-Type': 'application/json'}
+    if cache is None:
+        return check_variables_json(client.get_json(api_url, params=params))
+    return cache.get_json(client, api_url, params, permanent, parse=check_variables_json)
 
-    # Putting everything together to make the API request 
-    response = requests.get(api_url, 
-                            params=params, 
-                            auth=api_keys, 
-                            headers=headers)
+def fetch_document_configuration_json(api_url, client: OnShapeClient, cache: MetadataCache = None,
+                                      permanent: bool = False):
+    """
+    Takes an api_url and fetches the configuration document data
+    :param api_url: the url that the configuration will be taken from
+    :param client: the client to make the request with
+    :param cache: the cache of answers from OnShape, None to always ask OnShape
+    :param permanent: the url is of a version, so the answer can be cached for good
+    :return: the onshape document configuration parameters as a JSON
+    """
+    if cache is None:
+        return check_configuration_json(client.get_json(api_url))
+    return cache.get_json(client, api_url, permanent=permanent, parse=check_configuration_json)
 
-    return response.json()[0]['variables']
 
-def fetch_document_configuration_json(api_keys, api_url):
+def check_variables_json(json):
     """
-    Takes an api_url and the api keys and fetches the variable document data
-    :param api_url: the url that variables will be taken from
-    :param api_keys: the api keys
-    :return: the onshape document variables as a JSON
+    Gets the variables out of the response to a variables request
+    :param json: the response as JSON
+    :return: the variables as JSON
+    """
+    if not isinstance(json, list) or not json or 'variables' not in json[0]:
+        raise ValueError(f'Bad request: {json}')
+    return json[0]['variables']
+
+
+def parse_configuration_json(json):
+    """
+    Turns the response to a configuration request into our JSON, so it can be cached that way
+    :param json: the response as JSON
+    :return: Our JSON as a list of dicts
+    """
+    return configuration_json_to_our_json(check_configuration_json(json))
+
+
+def check_configuration_json(json):
+    """
+    Gets the configuration parameters out of the response to a configuration request
+    :param json: the response as JSON
+    :return: the configuration parameters as JSON
     """
-    # Optional query parameters can be assigned 
-    params = {}
-
-    # Define the header for the request 
-    headers = {'Accept': 'application/json;charset=UTF-8;qs=0.09',
-            'Content-Type': 'application/json'}
-
-    # Putting everything together to make the API request 
-    response = requests.get(api_url, 
-                            params=params, 
-                            auth=api_keys, 
-                            headers=headers)
-    json = response.json()
     if 'configurationParameters' not in json:
         raise ValueError(f'Bad request: {json}')
     return json['configurationParameters']
@@ -0,0 +1,209 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from tempfile import mkstemp
+from typing import Any, Hashable, Iterator, Optional
+
+# Where rendered models are kept between runs and how much room they can take
+RENDER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'model-customizer', 'renders')
+RENDER_CACHE_MAX_BYTES = 1 << 30
+
+# Files still being written start with this
+TEMP_PREFIX = '.tmp-'
+
+CacheStats = namedtuple('CacheStats', ('hits', 'misses', 'entries', 'size'))
+
+
+def render_key(source_key: str, variables: dict, openscad_version: str) -> str:
+    """
+    Makes the cache key of a render, which is the same for the same model, variables, and OpenSCAD no matter where the
+    model came from or what order the variables are in
+    :param source_key: the key of the scad file and the files it includes (see scad.dependencies.source_key)
+    :param variables: a dict of variable names and values
+    :param openscad_version: the version of OpenSCAD doing the render
+    :return: a hex string
+    """
+    key = hashlib.sha256()
+    for part in (source_key,
+                 json.dumps(variables, sort_keys=True, separators=(',', ':')),
+                 openscad_version):
+        key.update(part.encode())
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+def vao_key(key: str, options: dict) -> str:
+    """
+    Makes the cache key of a vao file from the key of the render and how it is encoded
+    """
+    options = json.dumps(options, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{key}\0{options}'.encode()).hexdigest()
+
+
+class RenderCache:
+    """
+    An on-disk cache of rendered files by key. The least recently used files are removed when the cache gets too big
+    (using the modified time of the files, so it works across processes and restarts).
+    """
+
+    def __init__(self, directory: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        """
+        :param directory: the directory to keep the files in, made if it doesn't exist
+        :param max_bytes: the total size of the files to stay under
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str, suffix: str = '.stl') -> str:
+        """
+        Gets where the file for a key is kept (it may not exist)
+        """
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key: str, suffix: str = '.stl') -> Optional[str]:
+        """
+        Looks up a file and marks it as recently used
+        :param key: the key from render_key
+        :param suffix: the type of file
+        :return: the path of the file or None if it isn't cached
+        """
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def read(self, key: str, suffix: str = '.stl') -> Optional[bytes]:
+        """
+        Looks up a file like get, but gets its contents so it can't be evicted before it is read
+        :return: the contents of the file or None if it isn't cached
+        """
+        path = self.get(key, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:  # evicted between get and open
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data_path: str, suffix: str = '.stl') -> str:
+        """
+        Moves a file into the cache, then removes old files if the cache is too big
+        :param key: the key from render_key
+        :param data_path: the file to move, it must be on the same file system (see new_file)
+        :param suffix: the type of file
+        :return: the path of the file in the cache
+        """
+        path = self.path(key, suffix)
+        os.replace(data_path, path)  # atomic, so other processes never see part of a file
+        self.evict(keep=path)
+        return path
+
+    @contextlib.contextmanager
+    def new_file(self, suffix: str = '.stl') -> Iterator[str]:
+        """
+        Makes a temporary file in the cache directory to render into before it is added with put. The file is removed
+        afterwards if it wasn't added.
+        :return: the path of the file
+        """
+        fd, path = mkstemp(suffix, TEMP_PREFIX, self.directory)  # OpenSCAD needs the suffix to know the file type
+        os.close(fd)
+        try:
+            yield path
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def evict(self, keep: str = None):
+        """
+        Removes the least recently used files until the cache fits in max_bytes
+        :param keep: a file not to remove (the one just added)
+        """
+        entries = self.entries()
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if size <= self.max_bytes:
+                break
+            if entry.path != keep:
+                size -= entry.stat().st_size
+                with contextlib.suppress(FileNotFoundError):  # another process got to it first
+                    os.remove(entry.path)
+
+    def entries(self) -> list:
+        """
+        Gets the files in the cache (not the ones still being written)
+        :return: a list of os.DirEntry
+        """
+        with os.scandir(self.directory) as it:
+            return [entry for entry in it if entry.is_file() and not entry.name.startswith(TEMP_PREFIX)]
+
+    def stats(self) -> CacheStats:
+        """
+        Gets the number of hits and misses of this object and the number and total size of the files in the cache
+        """
+        entries = self.entries()
+        return CacheStats(self.hits, self.misses, len(entries), sum(entry.stat().st_size for entry in entries))
+
+
+class MemoryCache:
+    """
+    A cache in memory that forgets the least recently used values when it gets too big, and can expire each value
+    """
+
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: the number of values to keep
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()  # key to (time it expires or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Looks up a value and marks it as recently used
+        :return: the value or None if it isn't cached or expired
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._values[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._values.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Adds a value (it can't be None), forgetting the least recently used value if there are too many
+        :param ttl: the seconds until it expires, None to never expire
+        """
+        with self._lock:
+            self._values[key] = (None if ttl is None else time.monotonic() + ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        """
+        Forgets all of the values
+        """
+        with self._lock:
+            self._values.clear()
@@ -1 +1 @@
-from .functions import get_variables, get_stl
+from .functions import get_variables, get_stl, get_stls, get_vao
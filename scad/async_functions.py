@@ -0,0 +1,200 @@
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+from tempfile import NamedTemporaryFile
+from typing import Any, AsyncIterator, Dict, List
+from urllib.parse import unquote, urlparse
+
+from .functions import (SCAD_JSON_MEMORY, get_render_cache, get_source_cache, openscad_version, scad_json_to_our_json,
+                        stl_command, write_parameter_file)
+from .dependencies import source_key
+from metrics import measure
+from render_cache import RenderCache, render_key, vao_key
+from scheduler import PRIORITY_EXPORT, PRIORITY_PREVIEW, RENDER_TIMEOUT, AsyncRenderScheduler, run_process_async
+from stl_to_raw import read_stl
+from vao import encode_vao
+
+
+# asyncio versions of the functions in functions.py, so one event loop can serve many customizations at once
+
+
+@contextlib.asynccontextmanager
+async def get_scad_file_async(url_or_path: str) -> AsyncIterator[str]:
+    """
+    Gets the path of a scad file, downloading it first if it is a url (see functions.get_scad_file)
+    """
+    url_parts = urlparse(url_or_path)
+    if url_parts.scheme.startswith('http'):
+        source = await asyncio.to_thread(get_source_cache().fetch_link, url_or_path)
+        try:
+            yield source
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(source)
+    elif url_parts.scheme in ('file', ''):
+        source = unquote(url_parts.path)
+        if not os.path.exists(source):
+            raise Exception("Source file does not exist")
+        yield source
+    else:
+        raise Exception("Unsupported source URL")
+
+
+async def get_variables_async(url: str, cache: RenderCache = None) -> List[Dict[str, Any]]:
+    """
+    Generates our JSON format based on a url (see functions.get_variables)
+    :param url: the url of the scad file
+    :param cache: the cache to keep the scad json in on disk
+    :return: the final json
+    """
+    async with get_scad_file_async(url) as source:
+        scad_json = await scad_to_scad_json_async(source, cache)
+        with measure('parse'):
+            return scad_json_to_our_json(scad_json)
+
+
+async def scad_to_scad_json_async(input_path: str, cache: RenderCache = None) -> dict:
+    """
+    Takes a scad file and returns its customizer json, cached the same way as functions.scad_to_scad_json
+    :param input_path: the scad file
+    :param cache: the cache to keep the json in on disk, defaults to get_render_cache()
+    :return: the output json as a dict
+    """
+    key = await asyncio.to_thread(source_key, input_path)
+
+    scad_json = SCAD_JSON_MEMORY.get(key)
+    if scad_json is None:
+        if cache is None:
+            cache = get_render_cache()
+        data = cache.read(key, '.param')
+        if data is None:
+            data = await get_async_scheduler().run(render_scad_json, input_path, key, cache,
+                                                   key=(cache.directory, key, '.param'), priority=PRIORITY_PREVIEW)
+        scad_json = data.decode()
+        SCAD_JSON_MEMORY.put(key, scad_json)
+    return json.loads(scad_json)
+
+
+async def render_scad_json(input_path: str, key: str, cache: RenderCache) -> bytes:
+    """
+    Runs OpenSCAD to get the customizer json of a scad file into the cache (see functions.render_scad_json)
+    :return: the contents of the json file
+    """
+    with measure('scad_json') as stage, cache.new_file('.param') as tmp:
+        (await run_process_async(['openscad-nightly', input_path, '-o', tmp])).check_returncode()
+        with open(tmp, 'rb') as f:
+            data = f.read()
+        stage.output_bytes = len(data)
+        cache.put(key, tmp, '.param')
+        return data
+
+
+async def get_stl_async(url_or_path: str, variables: dict, cache: RenderCache = None,
+                        priority: int = PRIORITY_EXPORT, timeout: float = RENDER_TIMEOUT) -> bytes:
+    """
+    Creates an stl file with the variables in the dict (see functions.get_stl)
+    :return: the contents of the stl file
+    """
+    return (await get_stls_async(url_or_path, [variables], cache, priority, timeout))[0]
+
+
+async def get_stls_async(url_or_path: str, variable_sets: List[dict], cache: RenderCache = None,
+                         priority: int = PRIORITY_EXPORT, timeout: float = RENDER_TIMEOUT) -> List[bytes]:
+    """
+    Creates an stl file for each of many sets of variables of the same model (see functions.submit_stls). The renders
+    that aren't cached run at the same time, up to the limit of the scheduler.
+    :return: the contents of the stl files, in the same order as the variable sets
+    """
+    if cache is None:
+        cache = get_render_cache()
+    version = await asyncio.to_thread(openscad_version)  # only runs OpenSCAD the first time
+
+    async with get_scad_file_async(url_or_path) as scad_file:
+        source = await asyncio.to_thread(source_key, scad_file)
+        keys = [render_key(source, variables, version) for variables in variable_sets]
+        stls = {}
+        missing = {}  # the first index of each key that isn't cached
+        for index, key in enumerate(keys):
+            if key not in stls and key not in missing:
+                cached = cache.read(key)
+                if cached is not None:
+                    stls[key] = cached
+                else:
+                    missing[key] = index
+        if missing:
+            rendered = await asyncio.gather(*(
+                get_async_scheduler().run(render_stl_async, scad_file, variable_sets[index], key, cache, timeout,
+                                          key=(cache.directory, key), priority=priority)
+                for key, index in missing.items()))
+            stls.update(zip(missing, rendered))
+        return [stls[key] for key in keys]
+
+
+async def render_stl_async(scad_file: str, variables: dict, key: str, cache: RenderCache, timeout: float) -> bytes:
+    """
+    Runs OpenSCAD to render a scad file into the cache (see functions.render_stl). The job makes its own parameter
+    file, since a shared job outlives the caller that started it if that caller is cancelled.
+    :return: the contents of the stl file
+    """
+    with measure('render') as stage, cache.new_file('.stl') as tmp_stl, \
+            NamedTemporaryFile('w', suffix=".json") as tmp_json:
+        write_parameter_file(tmp_json, {'variant0': variables})
+        command = stl_command(scad_file, tmp_json.name, 'variant0', tmp_stl)
+        (await run_process_async(command, timeout)).check_returncode()
+        with open(tmp_stl, 'rb') as f:
+            data = f.read()
+        stage.output_bytes = len(data)
+        cache.put(key, tmp_stl)
+        return data
+
+
+async def get_vao_async(url_or_path: str, variables: dict, cache: RenderCache = None,
+                        priority: int = PRIORITY_PREVIEW, timeout: float = RENDER_TIMEOUT, **options) -> bytes:
+    """
+    Renders a model straight into a vao file without the stl going to disk (see functions.get_vao)
+    :return: the contents of the vao file
+    """
+    if cache is None:
+        cache = get_render_cache()
+    version = await asyncio.to_thread(openscad_version)
+
+    async with get_scad_file_async(url_or_path) as scad_file:
+        key = vao_key(render_key(await asyncio.to_thread(source_key, scad_file), variables, version), options)
+        data = cache.read(key, '.vao')
+        if data is not None:
+            return data
+
+        return await get_async_scheduler().run(render_vao_async, scad_file, variables, key, cache, timeout, options,
+                                               key=(cache.directory, key, '.vao'), priority=priority)
+
+
+async def render_vao_async(scad_file: str, variables: dict, key: str, cache: RenderCache, timeout: float,
+                           options: dict) -> bytes:
+    """
+    Runs OpenSCAD to render a scad file to a vao file in the cache (see functions.render_vao), the stl is kept in
+    memory and converted on another thread. The job makes its own parameter file like render_stl_async.
+    :return: the contents of the vao file
+    """
+    with measure('render_vao') as stage, NamedTemporaryFile('w', suffix=".json") as tmp_json:
+        write_parameter_file(tmp_json, {'variant0': variables})
+        command = stl_command(scad_file, tmp_json.name, 'variant0', '-', 'binstl')
+        result = await run_process_async(command, timeout, capture_output=True)
+        result.check_returncode()
+        data = await asyncio.to_thread(lambda: encode_vao(*read_stl(io.BytesIO(result.stdout)), **options))
+        with cache.new_file('.vao') as tmp_vao:
+            with open(tmp_vao, 'wb') as f:
+                f.write(data)
+            cache.put(key, tmp_vao, '.vao')
+        stage.output_bytes = len(data)
+        return data
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_scheduler() -> AsyncRenderScheduler:
+    """
+    Gets the asyncio render scheduler shared by everything in this process, running a render for each CPU at once
+    """
+    return AsyncRenderScheduler()
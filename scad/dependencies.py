@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+from collections import deque
+from typing import List, Optional, Tuple
+
+from render_cache import MemoryCache
+
+# Where OpenSCAD looks for included files after the directory of the file including them: the directories in
+# OPENSCADPATH and then the user's library directory
+LIBRARY_PATH_ENV = 'OPENSCADPATH'
+USER_LIBRARY_DIR = os.path.join(os.path.expanduser('~'), '.local', 'share', 'OpenSCAD', 'libraries')
+
+# include <file> and use <file> statements, strings and comments are matched too so the statements in them are skipped
+STATEMENT_PATTERN = re.compile(rb'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/|\b(?:include|use)\s*<([^>]*)>', re.DOTALL)
+
+# The hash and includes of the files scanned recently by their path, size, and modified time, so a file is only read
+# again once it changes
+SCAN_MEMORY = MemoryCache(4096)
+
+
+def source_key(path: str) -> str:
+    """
+    Makes the cache key of a scad file, which covers the file and every file it includes or uses (and so on). It
+    changes when any of them change, but not when a library that isn't used changes or the files are somewhere else.
+    :param path: the scad file
+    :return: a hex string
+    """
+    key = hashlib.sha256()
+    for name, digest in find_dependencies(path):
+        key.update(f'{name}\0{digest or ""}\0'.encode())
+    return key.hexdigest()
+
+
+def find_dependencies(path: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Finds every file a scad file includes or uses, then every file they include or use, and so on
+    :param path: the scad file
+    :return: a list of the name each file is included by and a hash of its contents, starting with the scad file itself
+             (named ''), in the order they are found. Files that can't be found have a hash of None.
+    """
+    path = os.path.abspath(path)
+    digest, includes = scan_file(path)
+    dependencies = [('', digest)]
+    seen = {path}
+    to_scan = deque((name, os.path.dirname(path)) for name in includes)
+    while to_scan:
+        name, directory = to_scan.popleft()
+        dependency = resolve_include(name, directory)
+        if dependency is None:
+            dependencies.append((name, None))  # OpenSCAD renders without it, but adding it later changes the render
+        elif dependency not in seen:
+            seen.add(dependency)
+            digest, includes = scan_file(dependency)
+            dependencies.append((name, digest))
+            to_scan.extend((include, os.path.dirname(dependency)) for include in includes)
+    return dependencies
+
+
+def scan_file(path: str) -> Tuple[str, List[str]]:
+    """
+    Hashes a scad file and finds the files it includes or uses, remembering the result until the file changes
+    :param path: the absolute path of the scad file
+    :return: a hex string of the hash of the contents and the names of the included files
+    """
+    stat = os.stat(path)
+    memory_key = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    scanned = SCAN_MEMORY.get(memory_key)
+    if scanned is None:
+        with open(path, 'rb') as f:
+            source = f.read()
+        scanned = (hashlib.sha256(source).hexdigest(), find_includes(source))
+        SCAN_MEMORY.put(memory_key, scanned)
+    return scanned
+
+
+def find_includes(source: bytes) -> List[str]:
+    """
+    Finds the files in the include and use statements of a scad file (not the ones in comments or strings)
+    :param source: the contents of the scad file
+    :return: the names of the files, like 'lib/gears.scad'
+    """
+    return [match.group(1).decode().strip() for match in STATEMENT_PATTERN.finditer(source)
+            if match.group(1) is not None]
+
+
+def resolve_include(name: str, directory: str) -> Optional[str]:
+    """
+    Finds an included file the way OpenSCAD does
+    :param name: the name of the file in the include or use statement
+    :param directory: the directory of the file with the statement
+    :return: the absolute path of the file or None if it can't be found
+    """
+    library_dirs = [d for d in os.environ.get(LIBRARY_PATH_ENV, '').split(os.pathsep) if d]
+    for base in (directory, *library_dirs, USER_LIBRARY_DIR):
+        path = os.path.join(base, name)
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    return None
@@ -1,11 +1,27 @@
+import atexit
 import contextlib
+import functools
 import os
 import subprocess
 import json
+import threading
+from concurrent.futures import Future
 from tempfile import NamedTemporaryFile
-from urllib.request import urlretrieve
 from urllib.parse import urlparse, unquote
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, TextIO
+
+from .dependencies import source_key
+from .source_cache import SourceCache
+from .warm_pool import WARM_SLOTS, WarmPool
+from metrics import measure
+from render_cache import MemoryCache, RenderCache, render_key, vao_key
+from scheduler import (PRIORITY_EXPORT, PRIORITY_PREVIEW, RENDER_TIMEOUT, RenderScheduler, run_process,
+                        run_process_reading)
+from stl_to_raw import read_stl
+from vao import encode_vao
+
+# Customizer JSON (as text) of the scad files seen recently by the hash of their contents
+SCAD_JSON_MEMORY = MemoryCache(256)
 
 
 def is_onshape(url: str) -> bool:
@@ -16,47 +32,80 @@ def is_onshape(url: str) -> bool:
 def get_scad_file(url_or_path: str) -> str:
     url_parts = urlparse(url_or_path)
 
-    # Get the source file
-    input_file = None
-    try:
-        if url_parts.scheme.startswith('http'):
-            input_file = NamedTemporaryFile()
-            source = input_file.name
-            # todo: throw exception if url isn't good
-            urlretrieve(url_or_path, source)
-        elif url_parts.scheme in ('file', ''):
-            source = unquote(url_parts.path)
-            if not os.path.exists(source):
-                raise Exception("Source file does not exist")
-        else:
-            raise Exception("Unsupported source URL")
+    # Get the source file, remote files are downloaded into the source cache and reused until they change. Each caller
+    # gets its own link to the download, so a newer download or eviction can't change it until the caller is done.
+    if url_parts.scheme.startswith('http'):
+        source = get_source_cache().fetch_link(url_or_path)
+        try:
+            yield source
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(source)
+    elif url_parts.scheme in ('file', ''):
+        source = unquote(url_parts.path)
+        if not os.path.exists(source):
+            raise Exception("Source file does not exist")
         yield source
-    finally:
-        if input_file is not None:
-            input_file.close()
+    else:
+        raise Exception("Unsupported source URL")
 
 
-def get_variables(url: str) -> List[Dict[str, Any]]:
+def get_variables(url: str, cache: RenderCache = None) -> List[Dict[str, Any]]:
     """
     Generates our JSON format based on a url. Starts by getting the scad file, turning it into json, and then formatting
     it correctly for our database.
     :param url: the url of the scad file
+    :param cache: the cache to keep the scad json in on disk (see scad_to_scad_json)
     :return: the final json as a string
     """
     with get_scad_file(url) as source:
-        scad_json = scad_to_scad_json(source)
-        return scad_json_to_our_json(scad_json)
+        scad_json = scad_to_scad_json(source, cache)
+        with measure('parse'):
+            return scad_json_to_our_json(scad_json)
 
 
-def scad_to_scad_json(input_path: str) -> dict:
+def scad_to_scad_json(input_path: str, cache: RenderCache = None) -> dict:
     """
-    Takes a scad file and returns its customizer json as a string
+    Takes a scad file and returns its customizer json. The json only depends on the contents of the file and the files
+    it includes so it is cached by their key (see dependencies.source_key), in memory (SCAD_JSON_MEMORY) and on disk,
+    and OpenSCAD is only run for new files.
     :param input_path: the scad file
-    :return: the output json as a string
+    :param cache: the cache to keep the json in on disk, defaults to get_render_cache()
+    :return: the output json as a dict
+    """
+    key = source_key(input_path)
+
+    scad_json = SCAD_JSON_MEMORY.get(key)
+    if scad_json is None:
+        if cache is None:
+            cache = get_render_cache()
+        data = cache.read(key, '.param')
+        if data is None:
+            data = get_scheduler().submit(render_scad_json, input_path, key, cache,
+                                          key=(cache.directory, key, '.param'), priority=PRIORITY_PREVIEW).result()
+        scad_json = data.decode()
+        SCAD_JSON_MEMORY.put(key, scad_json)
+
+    # Parsed every time so callers can't change the cached json
+    return json.loads(scad_json)
+
+
+def render_scad_json(input_path: str, key: str, cache: RenderCache) -> bytes:
+    """
+    Runs OpenSCAD to get the customizer json of a scad file into the cache
+    :return: the contents of the json file
     """
-    with NamedTemporaryFile('r', suffix=".param") as tmp:
-        subprocess.run(['openscad-nightly', input_path, '-o', tmp.name]).check_returncode()
-        return json.load(tmp)
+    with measure('scad_json') as stage, cache.new_file('.param') as tmp:
+        pool = get_warm_pool()
+        if pool is not None:
+            pool.render(tmp, input_path)
+        else:
+            run_process(['openscad-nightly', input_path, '-o', tmp]).check_returncode()
+        with open(tmp, 'rb') as f:
+            data = f.read()
+        stage.output_bytes = len(data)
+        cache.put(key, tmp, '.param')
+        return data
 
 
 def scad_json_to_our_json(scad_json: dict):
@@ -109,36 +158,243 @@ def scad_json_to_our_json(scad_json: dict):
     return our_json
 
 
-def get_stl(url_or_path: str, variables: dict):
+def get_stl(url_or_path: str, variables: dict, cache: RenderCache = None, priority: int = PRIORITY_EXPORT,
+            timeout: float = RENDER_TIMEOUT) -> bytes:
     """
-    Creates an stl file with the variables in the dict
+    Creates an stl file with the variables in the dict. Renders are cached by the contents of the scad file, the
+    variables, and the version of OpenSCAD, so the same model with the same variables is only rendered once.
     :param url_or_path: the url or path of an openscad file
     :param variables: a dict of variable names and values
-    :return: idk
-    """
-    variable_json = {
-        "parameterSets": {
-            "variableSet": variables
-        },
-        "fileFormatVersion": "1"
-    }
-
-    with (get_scad_file(url_or_path) as scad_file,
-          NamedTemporaryFile('w', suffix=".json") as tmp_json,
-          NamedTemporaryFile('r', suffix='.stl', delete=False) as tmp_stl):
-        tmp_json.write(json.dumps(variable_json))
-        tmp_json.flush()
-
-        # openscad --enable=customizer -o model-2.stl -p parameters.json -P model-2 model.scad
-        subprocess.run([
-            'openscad-nightly', '--enable=customizer',
-            '-o', tmp_stl.name,
-            '-p', tmp_json.name,
-            '-P', 'variableSet',  # IDK why this is here
-            scad_file,
-        ])
-
-    return None  # The binary? the file path?
+    :param cache: the cache to use, defaults to get_render_cache()
+    :param priority: the priority of the render (see scheduler.PRIORITY_PREVIEW and scheduler.PRIORITY_EXPORT)
+    :param timeout: the seconds OpenSCAD can take before it is killed
+    :return: the contents of the stl file
+    """
+    return submit_stls(url_or_path, [variables], cache, priority, timeout)[0].result()
+
+
+def get_stls(url_or_path: str, variable_sets: List[dict], cache: RenderCache = None, priority: int = PRIORITY_EXPORT,
+             timeout: float = RENDER_TIMEOUT) -> List[bytes]:
+    """
+    Creates an stl file for each of many sets of variables of the same model, see submit_stls
+    :return: the contents of the stl files, in the same order as the variable sets
+    """
+    return [future.result() for future in submit_stls(url_or_path, variable_sets, cache, priority, timeout)]
+
+
+def submit_stls(url_or_path: str, variable_sets: List[dict], cache: RenderCache = None,
+                priority: int = PRIORITY_EXPORT, timeout: float = RENDER_TIMEOUT) -> List[Future]:
+    """
+    Starts creating an stl file for each set of variables on the render scheduler without waiting for them. The scad
+    file is only gotten once, and all of the sets that aren't cached go in one parameter file and are rendered in
+    parallel. The same render submitted while it is already waiting or running shares the same job. The contents of
+    the files are returned rather than their paths in the cache, since a batch bigger than the cache evicts its own
+    earlier files.
+    :param url_or_path: the url or path of an openscad file
+    :param variable_sets: a list of dicts of variable names and values
+    :param cache: the cache to use, defaults to get_render_cache()
+    :param priority: the priority of the renders (see scheduler.PRIORITY_PREVIEW and scheduler.PRIORITY_EXPORT)
+    :param timeout: the seconds OpenSCAD can take for each render before it is killed
+    :return: futures of the contents of the stl files (use asyncio.wrap_future to await them)
+    """
+    if cache is None:
+        cache = get_render_cache()
+
+    with contextlib.ExitStack() as stack:
+        scad_file = stack.enter_context(get_scad_file(url_or_path))
+        source = source_key(scad_file)
+        version = openscad_version()
+
+        keys = [render_key(source, variables, version) for variables in variable_sets]
+        futures = [Future() for _ in keys]
+        missing = {}  # the first index of each key that isn't cached
+        for index, key in enumerate(keys):
+            cached = cache.read(key) if key not in missing else None
+            if cached is not None:
+                futures[index].set_result(cached)
+            else:
+                missing.setdefault(key, index)
+        if not missing:
+            return futures
+
+        tmp_json = stack.enter_context(NamedTemporaryFile('w', suffix=".json"))
+        write_parameter_file(tmp_json, {f'variant{index}': variable_sets[index] for index in missing.values()})
+
+        submitted = {key: get_scheduler().submit(render_stl, scad_file, tmp_json.name, f'variant{index}', key, cache,
+                                                 timeout, key=(cache.directory, key), priority=priority)
+                     for key, index in missing.items()}
+        futures = [submitted.get(key, future) for key, future in zip(keys, futures)]
+
+        # A downloaded scad file and the parameter file have to last until the renders are done
+        close_when_done(list(submitted.values()), stack.pop_all())
+        return futures
+
+
+def get_vao(url_or_path: str, variables: dict, cache: RenderCache = None, priority: int = PRIORITY_PREVIEW,
+            timeout: float = RENDER_TIMEOUT, **options) -> bytes:
+    """
+    Renders a model with the variables in the dict straight into a vao file. OpenSCAD writes the stl to a pipe that is
+    converted as it comes in, so the stl never goes to disk. The vao files are cached like the stl files of get_stl.
+    :param url_or_path: the url or path of an openscad file
+    :param variables: a dict of variable names and values
+    :param cache: the cache to use, defaults to get_render_cache()
+    :param priority: the priority of the render (see scheduler.PRIORITY_PREVIEW and scheduler.PRIORITY_EXPORT)
+    :param timeout: the seconds OpenSCAD can take before it is killed
+    :param options: how to encode the vao file (see vao.write_vao)
+    :return: the contents of the vao file
+    """
+    if cache is None:
+        cache = get_render_cache()
+
+    with get_scad_file(url_or_path) as scad_file:
+        key = vao_key(render_key(source_key(scad_file), variables, openscad_version()), options)
+        data = cache.read(key, '.vao')
+        if data is not None:
+            return data
+
+        with NamedTemporaryFile('w', suffix=".json") as tmp_json:
+            write_parameter_file(tmp_json, {'variant0': variables})
+            return get_scheduler().submit(render_vao, scad_file, tmp_json.name, 'variant0', key, cache, timeout,
+                                          options, key=(cache.directory, key, '.vao'), priority=priority).result()
+
+
+def render_vao(scad_file: str, parameter_file: str, parameter_set: str, key: str, cache: RenderCache,
+               timeout: float, options: dict) -> bytes:
+    """
+    Runs OpenSCAD to render a scad file to a vao file in the cache, reading the stl from its output (see render_stl)
+    :param options: how to encode the vao file (see vao.write_vao)
+    :return: the contents of the vao file
+    """
+    with measure('render_vao') as stage:
+        command = stl_command(scad_file, parameter_file, parameter_set, '-', 'binstl')
+        data = encode_vao(*run_process_reading(command, read_stl, timeout), **options)
+        with cache.new_file('.vao') as tmp_vao:
+            with open(tmp_vao, 'wb') as f:
+                f.write(data)
+            cache.put(key, tmp_vao, '.vao')
+        stage.output_bytes = len(data)
+        return data
+
+
+def close_when_done(futures: List[Future], stack: contextlib.ExitStack):
+    """
+    Closes an exit stack once all of the futures are done
+    """
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            last = remaining == 0
+        if last:
+            stack.close()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def render_stl(scad_file: str, parameter_file: str, parameter_set: str, key: str, cache: RenderCache,
+               timeout: float) -> bytes:
+    """
+    Runs OpenSCAD to render a scad file into the cache
+    :param scad_file: the path of the scad file
+    :param parameter_file: the path of an OpenSCAD parameter file
+    :param parameter_set: the name of the set of variables in the parameter file to use
+    :param key: the key of the render from render_key
+    :param cache: the cache to put the stl file in
+    :param timeout: the seconds OpenSCAD can take before it is killed
+    :return: the contents of the stl file
+    """
+    with measure('render') as stage, cache.new_file('.stl') as tmp_stl:
+        pool = get_warm_pool()
+        if pool is not None:
+            pool.render(tmp_stl, scad_file, parameter_file, parameter_set, timeout)
+        else:
+            run_process(stl_command(scad_file, parameter_file, parameter_set, tmp_stl), timeout).check_returncode()
+        with open(tmp_stl, 'rb') as f:
+            data = f.read()
+        stage.output_bytes = len(data)
+        cache.put(key, tmp_stl)
+        return data
+
+
+def stl_command(scad_file: str, parameter_file: str, parameter_set: str, output: str,
+                export_format: str = None) -> List[str]:
+    """
+    Makes the OpenSCAD command to render one set of variables of a parameter file
+    :param output: the file to write, or '-' for stdout (which needs an export_format)
+    :param export_format: the type of file to write (like 'binstl'), by default it comes from the output's extension
+    """
+    # openscad --enable=customizer -o model-2.stl -p parameters.json -P model-2 model.scad
+    command = [
+        'openscad-nightly', '--enable=customizer',
+        '-o', output,
+        '-p', parameter_file,
+        '-P', parameter_set,  # the set of variables in the parameter file
+        scad_file,
+    ]
+    if export_format is not None:
+        command[2:2] = ['--export-format', export_format]
+    return command
+
+
+def write_parameter_file(file: TextIO, parameter_sets: Dict[str, dict]):
+    """
+    Writes an OpenSCAD parameter file
+    :param file: a file opened for writing text
+    :param parameter_sets: the dicts of variable names and values by the name of the set
+    """
+    json.dump({"parameterSets": parameter_sets, "fileFormatVersion": "1"}, file)
+    file.flush()
+
+
+@functools.lru_cache(maxsize=None)
+def get_scheduler() -> RenderScheduler:
+    """
+    Gets the render scheduler shared by everything in this process, with a worker for each CPU
+    """
+    return RenderScheduler()
+
+
+@functools.lru_cache(maxsize=None)
+def get_render_cache() -> RenderCache:
+    """
+    Gets the render cache shared by everything in this process (in render_cache.RENDER_CACHE_DIR)
+    """
+    return RenderCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_source_cache() -> SourceCache:
+    """
+    Gets the cache of downloaded scad files shared by everything in this process (in source_cache.SOURCE_CACHE_DIR)
+    """
+    return SourceCache()
+
+
+@functools.lru_cache(maxsize=None)
+def get_warm_pool() -> Optional[WarmPool]:
+    """
+    Gets the pool of started OpenSCAD processes shared by everything in this process, None if warm_pool.WARM_SLOTS is 0
+    """
+    if not WARM_SLOTS:
+        return None
+    pool = WarmPool()
+    atexit.register(pool.close)  # the processes waiting in it would never exit
+    return pool
+
+
+@functools.lru_cache(maxsize=None)
+def openscad_version() -> str:
+    """
+    Gets the version of OpenSCAD, only running it the first time
+    :return: the version line OpenSCAD prints
+    """
+    result = subprocess.run(['openscad-nightly', '--version'], capture_output=True, text=True)
+    result.check_returncode()
+    return (result.stdout + result.stderr).strip()  # some versions print it to stderr
 
 
 def main():
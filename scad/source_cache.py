@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import uuid
+
+import requests
+
+from metrics import measure
+from render_cache import TEMP_PREFIX, RenderCache
+
+# Where downloaded scad files are kept between runs and how much room they can take
+SOURCE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'model-customizer', 'sources')
+SOURCE_CACHE_MAX_BYTES = 256 << 20
+
+# Seconds to wait for the server (to connect and between bytes) and the largest scad file that is downloaded
+SOURCE_TIMEOUT = 30
+SOURCE_MAX_FILE_BYTES = 16 << 20
+
+# Size of the pieces downloads are written in
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+
+class SourceCache(RenderCache):
+    """
+    An on-disk cache of downloaded scad files by url. Every fetch asks the server if the file changed (with the ETag
+    and Last-Modified of the copy that is cached) and only downloads it again if it did. The headers of each file are
+    kept next to it in a .headers file.
+    """
+
+    def __init__(self, directory: str = SOURCE_CACHE_DIR, max_bytes: int = SOURCE_CACHE_MAX_BYTES,
+                 timeout: float = SOURCE_TIMEOUT, max_file_bytes: int = SOURCE_MAX_FILE_BYTES):
+        """
+        :param directory: the directory to keep the files in, made if it doesn't exist
+        :param max_bytes: the total size of the files to stay under
+        :param timeout: the seconds to wait for the server
+        :param max_file_bytes: the largest file to download
+        """
+        super().__init__(directory, max_bytes)
+        self.timeout = timeout
+        self.max_file_bytes = max_file_bytes
+        self.not_modified = 0
+
+    def fetch(self, url: str) -> str:
+        """
+        Gets a scad file, downloading it only if it isn't cached or changed
+        :param url: the http(s) url of the file
+        :return: the path of the file in the cache
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()
+        path = self.get(key, '.scad')
+        headers = self.read_headers(key) if path is not None else {}
+
+        request_headers = {}
+        if 'ETag' in headers:
+            request_headers['If-None-Match'] = headers['ETag']
+        if 'Last-Modified' in headers:
+            request_headers['If-Modified-Since'] = headers['Last-Modified']
+
+        with measure('fetch') as stage, \
+                requests.get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304 and path is not None:
+                self.not_modified += 1
+                return path
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length', 0)) > self.max_file_bytes:
+                raise Exception(f"Source file is too big: {url}")
+
+            with self.new_file('.scad') as tmp:
+                with open(tmp, 'wb') as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        if f.tell() > self.max_file_bytes:
+                            raise Exception(f"Source file is too big: {url}")
+                    stage.output_bytes = f.tell()
+                self.write_headers(key, {name: response.headers[name] for name in ('ETag', 'Last-Modified')
+                                         if name in response.headers})
+                return self.put(key, tmp, '.scad')
+
+    def fetch_link(self, url: str) -> str:
+        """
+        Gets a scad file like fetch, but as a new hard link to it in the cache directory, so it can't change or be
+        evicted while it is used. The caller removes the link when it is done with it.
+        :param url: the http(s) url of the file
+        :return: the path of the link
+        """
+        link = os.path.join(self.directory, f'{TEMP_PREFIX}{uuid.uuid4().hex}.scad')  # ignored by evict
+        while True:
+            try:
+                os.link(self.fetch(url), link)
+                return link
+            except FileNotFoundError:  # evicted before it was linked, the next fetch downloads it again
+                continue
+
+    def read_headers(self, key: str) -> dict:
+        """
+        Gets the saved headers of a file, empty if there aren't any
+        """
+        try:
+            with open(self.path(key, '.headers')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write_headers(self, key: str, headers: dict):
+        """
+        Saves the headers of a file
+        """
+        with self.new_file('.headers') as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(headers, f)
+            self.put(key, tmp, '.headers')
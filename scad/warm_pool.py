@@ -0,0 +1,203 @@
+import collections
+import contextlib
+import errno
+import json
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+from typing import List, Optional
+
+from scheduler import RENDER_TIMEOUT, kill_after, run_process, wait_process
+
+# The number of OpenSCAD processes to keep started for each type of render, 0 turns warm rendering off
+WARM_SLOTS = int(os.environ.get('OPENSCAD_WARM_SLOTS', 0))
+
+# A scad file in a directory with more entries than this is rendered cold, instead of linking them all into a slot
+WARM_MAX_LINKS = 256
+
+OPENSCAD_COMMAND = ['openscad-nightly']
+
+# The files in a slot, the scad file and parameter file are named pipes that OpenSCAD waits on
+SLOT_PREFIX = '.slot-'
+SLOT_SCAD = SLOT_PREFIX + 'input.scad'
+SLOT_PARAMETERS = SLOT_PREFIX + 'parameters.json'
+SLOT_OUTPUT = SLOT_PREFIX + 'output'
+SLOT_PARAMETER_SET = 'job'
+
+# Seconds between tries to open a named pipe that OpenSCAD hasn't opened yet
+FEED_RETRY = 0.005
+
+
+class WarmPool:
+    """
+    Keeps OpenSCAD processes started ahead of time so a render doesn't wait for OpenSCAD to start up and load its fonts
+    and libraries. Each slot is a directory with named pipes in place of the scad file and the parameter file: OpenSCAD
+    is started on them and blocks when it opens them until a job writes to them. The entries of the directory of the
+    job's scad file are linked into the slot so its includes, imports, and so on are found the same as a cold render.
+
+    If OpenSCAD exits before a job is given to it, it can't read from pipes and the pool only renders cold from then on.
+    A warm render that fails is done again cold, so a slot can never give a different result than a cold render.
+    """
+
+    def __init__(self, slots: int = None, command: List[str] = None, directory: str = None):
+        """
+        :param slots: the number of processes to keep started for each type of render, defaults to WARM_SLOTS (or 1)
+        :param command: the OpenSCAD command, defaults to OPENSCAD_COMMAND
+        :param directory: where to make the slots, defaults to a new temporary directory
+        """
+        self.slots = slots or WARM_SLOTS or 1
+        self.command = list(command or OPENSCAD_COMMAND)
+        self.directory = tempfile.mkdtemp(prefix='openscad-slots-') if directory is None else directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.broken = False
+        self.warm = 0
+        self.cold = 0
+        self._idle = collections.defaultdict(collections.deque)  # by (output suffix, has a parameter file)
+        self._lock = threading.Lock()
+
+    def render(self, output: str, scad_file: str, parameter_file: str = None, parameter_set: str = None,
+               timeout: float = RENDER_TIMEOUT):
+        """
+        Runs OpenSCAD on a scad file, in a warm slot if there is one
+        :param output: the file to write, OpenSCAD gets the type from its extension
+        :param scad_file: the path of the scad file
+        :param parameter_file: the path of an OpenSCAD parameter file, None for no variables
+        :param parameter_set: the name of the set of variables in the parameter file to use
+        :param timeout: the seconds OpenSCAD can take before it is killed
+        :raises subprocess.TimeoutExpired: if it was killed
+        :raises subprocess.CalledProcessError: if OpenSCAD failed
+        """
+        slot = self._take((os.path.splitext(output)[1], parameter_file is not None))
+        if slot is not None:
+            try:
+                if self._run(slot, output, scad_file, parameter_file, parameter_set, timeout):
+                    self.warm += 1
+                    return
+            finally:
+                slot.close()
+
+        self.cold += 1
+        command = self.command + ['-o', output]
+        if parameter_file is not None:
+            command += ['--enable=customizer', '-p', parameter_file, '-P', parameter_set]
+        run_process(command + [scad_file], timeout).check_returncode()
+
+    def close(self):
+        """
+        Stops the processes waiting in slots and removes the slots
+        """
+        with self._lock:
+            self.broken = True
+            slots = [slot for idle in self._idle.values() for slot in idle]
+            self._idle.clear()
+        for slot in slots:
+            slot.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _take(self, kind: tuple) -> Optional['_Slot']:
+        """
+        Takes a started slot and starts another to replace it, so it warms up while this job runs
+        """
+        with self._lock:
+            if self.broken:
+                return None
+            idle = self._idle[kind]
+            slot = idle.popleft() if idle else None
+            while len(idle) < self.slots:
+                idle.append(_Slot(self.command, tempfile.mkdtemp(dir=self.directory), *kind))
+        if slot is not None and slot.process.poll() is not None:
+            self.broken = True  # this OpenSCAD can't wait on pipes
+            return None
+        return slot
+
+    def _run(self, slot: '_Slot', output: str, scad_file: str, parameter_file: Optional[str],
+             parameter_set: Optional[str], timeout: float) -> bool:
+        """
+        Gives a job to the OpenSCAD in a slot
+        :return: True if it rendered, False if it has to be done cold
+        """
+        source_dir = os.path.dirname(os.path.abspath(scad_file))
+        with os.scandir(source_dir) as it:
+            entries = list(it)
+        if len(entries) > WARM_MAX_LINKS:
+            return False
+        for entry in entries:
+            if not entry.name.startswith(SLOT_PREFIX):
+                os.symlink(entry.path, os.path.join(slot.directory, entry.name))
+
+        with open(scad_file, 'rb') as f:
+            inputs = {SLOT_SCAD: f.read()}
+        if parameter_file is not None:
+            with open(parameter_file) as f:
+                parameters = json.load(f)
+            parameters['parameterSets'] = {SLOT_PARAMETER_SET: parameters['parameterSets'][parameter_set]}
+            inputs[SLOT_PARAMETERS] = json.dumps(parameters).encode()
+
+        exited = threading.Event()
+        writers = [threading.Thread(target=feed_pipe, args=(os.path.join(slot.directory, name), data, exited),
+                                    daemon=True)
+                   for name, data in inputs.items()]
+        for writer in writers:
+            writer.start()
+        try:
+            with kill_after(slot.process, timeout) as timed_out:
+                wait_process(slot.process)
+        finally:
+            exited.set()  # OpenSCAD may have exited without opening the pipes
+            for writer in writers:
+                writer.join()
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(slot.process.args, timeout)
+        if slot.process.returncode:
+            return False
+        shutil.move(slot.output, output)
+        return True
+
+
+class _Slot:
+    """
+    A directory with named pipes for the input and an OpenSCAD process started on them
+    """
+
+    def __init__(self, command: List[str], directory: str, suffix: str, has_parameters: bool):
+        self.directory = directory
+        self.output = os.path.join(directory, SLOT_OUTPUT + suffix)
+        scad_file = os.path.join(directory, SLOT_SCAD)
+        os.mkfifo(scad_file)
+        command = command + ['-o', self.output]
+        if has_parameters:
+            os.mkfifo(os.path.join(directory, SLOT_PARAMETERS))
+            command += ['--enable=customizer', '-p', os.path.join(directory, SLOT_PARAMETERS), '-P', SLOT_PARAMETER_SET]
+        self.process = subprocess.Popen(command + [scad_file], start_new_session=True)
+
+    def close(self):
+        """
+        Kills the process if it is still waiting and removes the directory
+        """
+        if self.process.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def feed_pipe(path: str, data: bytes, stop: threading.Event):
+    """
+    Writes to a named pipe once the other end is opened. It is opened without blocking and tried again until it works,
+    so it never waits forever on a reader that has gone away.
+    :param stop: set when the reader won't open the pipe anymore
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO or stop.wait(FEED_RETRY):  # ENXIO is no reader yet
+                return
+    os.set_blocking(fd, True)
+    with contextlib.suppress(BrokenPipeError), open(fd, 'wb') as f:
+        f.write(data)
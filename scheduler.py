@@ -0,0 +1,296 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import queue
+import resource
+import signal
+import subprocess
+import threading
+from concurrent.futures import Future
+from typing import Any, BinaryIO, Callable, Hashable, Iterator, List, Optional
+
+from metrics import current_stage
+
+# Lower numbers run first, so someone waiting on a preview doesn't wait behind exports
+PRIORITY_PREVIEW = 0
+PRIORITY_EXPORT = 10
+
+# Seconds an OpenSCAD process can run before it is killed
+RENDER_TIMEOUT = 300
+
+
+class RenderScheduler:
+    """
+    Runs render jobs on a fixed number of worker threads (each one waits on at most one OpenSCAD process, so the CPUs
+    aren't oversubscribed). Jobs run in order of priority and then in the order they were submitted. A job submitted
+    with the same key as one that is waiting or running isn't run again, it gets the future of the one already there.
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        :param max_workers: the number of jobs to run at once, defaults to the number of CPUs
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()  # breaks ties in priority, and futures can't be compared
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def submit(self, func: Callable, *args, key: Hashable = None, priority: int = PRIORITY_EXPORT, **kwargs) -> Future:
+        """
+        Schedules func(*args, **kwargs) to run on a worker. Use asyncio.wrap_future to await the result.
+        :param func: the job
+        :param key: jobs with the same key are the same job, None to never share the job
+        :param priority: PRIORITY_PREVIEW, PRIORITY_EXPORT, or any other number (lower runs first)
+        :return: a future of the result of the job (shared with every submit of the same key while it is in flight)
+        """
+        with self._lock:
+            if key is not None and key in self._in_flight:
+                job = self._in_flight[key]
+                if priority < job.priority and not job.started:
+                    # Queue it again so it runs sooner, the old entry is skipped since the job has started by then
+                    job.priority = priority
+                    self._queue.put((priority, next(self._order), job))
+                return job.future
+
+            job = _Job(func, args, kwargs, key, priority)
+            if key is not None:
+                self._in_flight[key] = job
+            self._queue.put((priority, next(self._order), job))
+            if len(self._workers) < self.max_workers:
+                self._start_worker()
+        return job.future
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the workers after the jobs already submitted are done
+        :param wait: wait for the workers to stop
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+            for _ in workers:
+                self._queue.put((float('inf'), next(self._order), None))
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._work, name=f'render-{len(self._workers)}', daemon=True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.started:
+                    continue  # it was queued again with a higher priority and already ran
+                job.started = True
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.func(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+            with self._lock:
+                if job.key is not None and self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+
+
+class AsyncRenderScheduler:
+    """
+    The asyncio version of RenderScheduler: at most max_workers jobs run at once, waiting jobs start in order of
+    priority, and a job with the same key as one in flight shares its result. The jobs are coroutines run on the
+    caller's event loop.
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        :param max_workers: the number of jobs to run at once, defaults to the number of CPUs
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._running = 0
+        self._waiting = []  # heap of (priority, order, future to set when it can start)
+        self._order = itertools.count()
+        self._in_flight = {}
+
+    async def run(self, func: Callable, *args, key: Hashable = None, priority: int = PRIORITY_EXPORT, **kwargs):
+        """
+        Runs await func(*args, **kwargs) once there is room
+        :param func: a coroutine function
+        :param key: jobs with the same key are the same job, None to never share the job
+        :param priority: PRIORITY_PREVIEW, PRIORITY_EXPORT, or any other number (lower runs first)
+        :return: the result of the job
+        """
+        if key is None:
+            return await self._run(func, args, kwargs, priority)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(func, args, kwargs, priority))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)  # one caller giving up doesn't cancel it for the others
+
+    async def _run(self, func: Callable, args: tuple, kwargs: dict, priority: int):
+        if self._running < self.max_workers and not self._waiting:
+            self._running += 1
+        else:
+            start = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (priority, next(self._order), start))
+            try:
+                await start  # the job that finishes hands over its spot
+            except asyncio.CancelledError:
+                if start.done() and not start.cancelled():
+                    self._release()  # it was handed the spot just as it was cancelled
+                raise
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiting:
+            _, _, start = heapq.heappop(self._waiting)
+            if not start.done():
+                start.set_result(None)
+                return
+        self._running -= 1
+
+
+class _Job:
+    def __init__(self, func: Callable, args: tuple, kwargs: dict, key: Hashable, priority: int):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.priority = priority
+        self.started = False
+        self.future = Future()
+
+
+def run_process(args: List[str], timeout: float = RENDER_TIMEOUT) -> subprocess.CompletedProcess:
+    """
+    Runs a process like subprocess.run, but in its own process group so everything it started is killed if it takes
+    too long. What it used is added to the stage being measured (see metrics.measure).
+    :param args: the command
+    :param timeout: the seconds to wait before killing it, None to wait forever
+    :return: the completed process, call check_returncode() on it
+    :raises subprocess.TimeoutExpired: if it was killed
+    """
+    with subprocess.Popen(args, start_new_session=True) as process, kill_after(process, timeout) as timed_out:
+        wait_process(process)
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(args, timeout)
+    return subprocess.CompletedProcess(args, process.returncode)
+
+
+def run_process_reading(args: List[str], read: Callable[[BinaryIO], Any], timeout: float = RENDER_TIMEOUT) -> Any:
+    """
+    Runs a process like run_process and reads what it writes to stdout while it runs, so the output never goes through
+    a file
+    :param args: the command
+    :param read: called with the stdout of the process (a pipe opened in binary mode), returns the result
+    :param timeout: the seconds to wait before killing it, None to wait forever
+    :return: what read returned
+    :raises subprocess.TimeoutExpired: if it was killed
+    :raises subprocess.CalledProcessError: if the process failed
+    """
+    with subprocess.Popen(args, stdout=subprocess.PIPE, start_new_session=True) as process, \
+            kill_after(process, timeout) as timed_out:
+        try:
+            result = read(process.stdout)
+            process.stdout.read()  # anything read didn't need, so the process can finish
+        except BaseException:
+            # The output was wrong or the process was killed part way through, either way it has to stop
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+            if not timed_out.is_set():
+                raise
+        wait_process(process)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(args, timeout)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return result
+
+
+@contextlib.contextmanager
+def kill_after(process: subprocess.Popen, timeout: Optional[float]) -> Iterator[threading.Event]:
+    """
+    Kills the process group of a process if it is still running after a timeout
+    :param process: a process started with start_new_session=True
+    :param timeout: the seconds to wait, None to wait forever
+    :return: an event that is set if the process was killed
+    """
+    timed_out = threading.Event()
+
+    def kill():
+        if process.returncode is None:
+            timed_out.set()
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    if timer is not None:
+        timer.start()
+    try:
+        yield timed_out
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+
+def wait_process(process: subprocess.Popen):
+    """
+    Waits for a process to finish and adds the CPU time and memory it used to the stage being measured
+    """
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stage = current_stage()
+    if stage is not None:
+        stage.add_process(usage)
+
+
+async def run_process_async(args: List[str], timeout: float = RENDER_TIMEOUT,
+                            capture_output: bool = False) -> subprocess.CompletedProcess:
+    """
+    The asyncio version of run_process, the process group is also killed if the caller is cancelled
+    :param args: the command
+    :param timeout: the seconds to wait before killing it, None to wait forever
+    :param capture_output: keep what the process writes to stdout (in memory) in the stdout of the result
+    :return: the completed process, call check_returncode() on it
+    :raises subprocess.TimeoutExpired: if it was killed
+    """
+    # asyncio reaps the process itself so only the CPU time of all children is known, which is only exact when one
+    # process runs at a time
+    start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE if capture_output else None,
+                                                   start_new_session=True)
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        with contextlib.suppress(ProcessLookupError):  # it may have exited already
+            os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+        if isinstance(e, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(args, timeout) from None
+        raise
+    finally:
+        stage = current_stage()
+        if stage is not None:
+            stage.add_process(child_usage_since(start_usage), max_rss=False)
+    return subprocess.CompletedProcess(args, process.returncode, stdout)
+
+
+def child_usage_since(start: resource.struct_rusage) -> resource.struct_rusage:
+    """
+    Gets the CPU time used by the children of this process that finished since getrusage returned start
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return resource.struct_rusage((usage.ru_utime - start.ru_utime, usage.ru_stime - start.ru_stime) + tuple(usage)[2:])
@@ -1,7 +1,15 @@
 from tokenizer import Tokenizer
+from ascii_stl import ASCII_CHUNK_SIZE, read_ascii_facets
+from mesh_stats import extents
+from vao import VAO_VERSION, Output, Vao, VaoStreamWriter, open_output, read_vao, write_vao
+from dedup import VertexTable, dedup_vertices
+from normals import crease_normals
 import _io
+import contextlib
+import mmap
+import os
 import struct
-from typing import List, Tuple, Dict
+from typing import BinaryIO, List, Tuple, Dict, Iterable, Iterator
 import numpy as np
 from itertools import chain
 
@@ -9,36 +17,142 @@ from itertools import chain
 BINARY_HEADER_SIZE = 80
 SOLID = b'solid '
 
+# A single triangle record of a binary STL file (50 bytes, little-endian)
+BINARY_TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('v', '<f4', (3, 3)), ('attr', '<u2')])
 
-def write_raw_file(vertices, indices):
-    with open('moravian_star_2.vao', 'wb') as f:
-        f.write(struct.pack('>I', len(vertices)))  # number of vertices
-        f.write(struct.pack('>I', len(indices)))  # number of indices
+# Number of triangles deduped from a memory-mapped STL file at a time (about 12 MB of the file)
+MMAP_CHUNK_TRIANGLES = 1 << 18
 
-        # Gets the
-        np_vertices = np.fromiter(chain.from_iterable(vertices.keys()), '>f4', len(vertices) * 3)
+# Number of triangles converted at a time by stream_stl2raw
+STREAM_CHUNK_TRIANGLES = 1 << 18
 
-        f.write(np_vertices.tobytes())
-        f.write(np.array(indices, '>u2').tobytes())
 
+def write_raw_file(vertices, indices, output: Output, version: int = VAO_VERSION, normals: np.ndarray = None):
+    """
+    Writes a vao file, see vao.write_vao
+    :param vertices: a dict of vertices to their index (from the reference readers) or an (N,3) array of vertices
+    :param indices: a list or array of indices
+    :param output: the path of the file to write or a file object opened for binary writing
+    :param version: the version of the vao format to write
+    :param normals: an (N,3) array of a normal for each vertex to include in the file
+    """
+    # Gets the vertices as a flat array, either from the dict of the reference readers or an (N,3) array
+    if isinstance(vertices, dict):
+        vertices = np.fromiter(chain.from_iterable(vertices.keys()), np.float32, len(vertices) * 3)
+
+    write_vao(output, vertices, indices, version, normals=normals)
 
-def stl2raw(path: str) -> (Dict, List):
+
+def read_raw_file(path: str) -> Vao:
+    """
+    Reads a vao file written by write_raw_file, see vao.read_vao
+    :param path: the path of the vao file
+    :return: the header, an (N,3) array of the vertices (N,6 with normals), and an array of the indices
+    """
+    return read_vao(path)
+
+
+def stl2raw(path: str, use_mmap: bool = False, output: Output = None, crease_angle: float = None,
+            weld_tolerance: float = None) -> (np.ndarray, np.ndarray):
     """
     Takes a path to an STL file, either ascii or binary, and create a vao file
     :param path: the path to a stl file
-    :return: a numpy array of vertices
+    :param use_mmap: memory-map binary STL files instead of reading them into memory
+    :param output: the path or file object to write the vao file to, defaults to the STL path with a .vao extension
+    :param crease_angle: if given, per-vertex normals are added to the vao file, smoothing across edges where the faces
+                         are within this many degrees (0 is flat shading, see normals.crease_normals)
+    :param weld_tolerance: if given, vertices within this distance of each other are merged (see weld.weld_vertices)
+    :return: a numpy array of vertices and a numpy array of indices
     """
     with open(path, 'rb') as file:
         header, header_pos, is_binary = process_header(file)
 
-        if is_binary:
-            vertices, indices = read_binary_stl(file, header_pos)  # Raw File with a binary STL doesn't need the header
+        if is_binary and use_mmap:
+            vertices, indices = read_binary_stl_mmap(file)
+        elif is_binary:
+            vertices, indices = read_binary_stl_np(file, header_pos)  # Raw File with a binary STL doesn't need the header
         else:
-            vertices, indices = read_ascii_stl(file, header, header_pos)
+            vertices, indices = read_ascii_stl_np(file, header, header_pos)
+
+    if weld_tolerance is not None:
+        from weld import weld_vertices  # only needed once a mesh is welded
+        vertices, indices, _ = weld_vertices(vertices, indices, weld_tolerance)
+
+    normals = None
+    if crease_angle is not None:
+        vertices, normals, indices = crease_normals(vertices, indices, crease_angle)
+
+    write_raw_file(vertices, indices, os.path.splitext(path)[0] + '.vao' if output is None else output,
+                   normals=normals)
 
-        write_raw_file(vertices, indices)
+    return vertices, indices
+
+
+def stream_stl2raw(path: str, output: Output, chunk_triangles: int = STREAM_CHUNK_TRIANGLES) -> (int, int):
+    """
+    Takes a path to an STL file, either ascii or binary, and creates a vao file without ever having the whole mesh in
+    memory (see vao.VaoStreamWriter)
+    :param path: the path to a stl file
+    :param output: the path of the vao file to write or a seekable file object opened for binary writing
+    :param chunk_triangles: the number of triangles to read at a time from a binary STL file
+    :return: the number of vertices and the number of indices written
+    """
+    with open(path, 'rb') as file, open_output(output) as f, VaoStreamWriter(f) as writer:
+        for vertices, indices in iter_vao_chunks(iter_stl_triangles(file, chunk_triangles)):
+            writer.write(vertices, indices)
 
-        return vertices, indices
+    return writer.num_vertices, writer.num_indices
+
+
+def read_stl(file: BinaryIO) -> (np.ndarray, np.ndarray):
+    """
+    Makes arrays of vertices and indices from an STL file, either ascii or binary, that is read from start to end
+    without seeking, so it can be a pipe (like the output of OpenSCAD)
+    :param file: an STL file opened in binary mode
+    :return: an (N,3) array of unique vertices in the order they are first seen and an array of indices into it
+    """
+    triangles = [chunk.reshape(-1, 3) for chunk in iter_stl_triangles(file)]
+    return dedup_vertices(np.concatenate(triangles) if triangles else np.empty((0, 3), np.float32))
+
+
+def iter_stl_triangles(file: _io.BufferedReader, chunk_triangles: int = STREAM_CHUNK_TRIANGLES) -> Iterator[np.ndarray]:
+    """
+    Reads the triangles of an STL file, either ascii or binary, a chunk at a time
+    :param file: an STL file opened in binary mode
+    :param chunk_triangles: the number of triangles to read at a time from a binary STL file (ASCII files are read
+                            ASCII_CHUNK_SIZE bytes at a time)
+    :return: an iterator of (T,3,3) arrays of the vertices of each triangle
+    """
+    header, header_pos, is_binary = process_header(file)
+    if not is_binary:
+        yield from read_ascii_facets(file, get_solid_name(header, header_pos))
+        return
+
+    # Read the rest of the header
+    to_read = BINARY_HEADER_SIZE - header_pos + 4
+    data = file.read(to_read)
+    if len(data) != to_read:
+        raise Exception("Binary STL file too short")
+    num_tris = struct.unpack('<I', data[-4:])[0]
+
+    for start in range(0, num_tris, chunk_triangles):
+        to_read = min(chunk_triangles, num_tris - start) * BINARY_TRIANGLE_DTYPE.itemsize
+        data = file.read(to_read)
+        if len(data) != to_read:
+            raise Exception("Binary STL file too short")
+        yield np.frombuffer(data, BINARY_TRIANGLE_DTYPE)['v']
+
+
+def iter_vao_chunks(triangles: Iterable[np.ndarray]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Dedups chunks of triangles as they come in
+    :param triangles: an iterable of (T,3,3) arrays of the vertices of each triangle (or (N,3) arrays of vertices)
+    :return: an iterator of the new vertices and the indices for each chunk, the indices refer to all of the vertices
+             given so far
+    """
+    table = VertexTable()
+    for chunk in triangles:
+        yield table.add(chunk)
 
 
 def read_binary_stl(file: _io.BufferedReader, header_pos: int) -> (Dict, List):
@@ -71,6 +185,98 @@ def read_binary_stl(file: _io.BufferedReader, header_pos: int) -> (Dict, List):
     return vertices, indices
 
 
+def read_binary_stl_np(file: _io.BufferedReader, header_pos: int) -> (np.ndarray, np.ndarray):
+    """
+    Makes arrays of vertices and indices from a binary STL file, reading all of the triangles in a single call. This
+    gives the same result as read_binary_stl (which is kept as the reference implementation) but as numpy arrays.
+    :param file: the binary STL file
+    :param header_pos: The length of the header
+    :return: an (N,3) array of unique vertices in the order they are first seen and an array of indices into it
+    """
+    # Read the rest of the header
+    to_read = BINARY_HEADER_SIZE - header_pos
+    if len(file.read(to_read)) != to_read:
+        raise Exception("Binary STL file too short")
+
+    count = file.read(4)
+    if len(count) != 4:
+        raise Exception("Binary STL file too short")
+    num_tris = struct.unpack('<I', count)[0]
+
+    # Read every triangle at once (normal, 3 vertices, and the attribute byte count that we don't use)
+    to_read = num_tris * BINARY_TRIANGLE_DTYPE.itemsize
+    data = file.read(to_read)
+    if len(data) != to_read:
+        raise Exception("Binary STL file too short")
+    triangles = np.frombuffer(data, BINARY_TRIANGLE_DTYPE)
+
+    return dedup_vertices(triangles['v'].reshape(-1, 3))
+
+
+def read_binary_stl_mmap(file: _io.BufferedReader) -> (np.ndarray, np.ndarray):
+    """
+    Makes arrays of vertices and indices from a binary STL file by memory-mapping it. Each chunk of the mapping is
+    deduped straight into a VertexTable (like stream_stl2raw) and the pages already read are given back, so only the
+    unique vertices are ever copied out of the file.
+    :param file: the binary STL file, opened in binary mode
+    :return: an (N,3) array of unique vertices in the order they are first seen and an array of indices into it
+    """
+    table = VertexTable()
+    with map_binary_triangles(file) as triangles:
+        vertices = []
+        indices = np.empty(len(triangles) * 3, np.uint32)
+        for start in range(0, len(triangles), MMAP_CHUNK_TRIANGLES):
+            stop = start + MMAP_CHUNK_TRIANGLES
+            new, indices[start * 3:stop * 3] = table.add(triangles['v'][start:stop])
+            vertices.append(new)
+            release_mapped_pages(triangles, stop)
+        del triangles  # drop the view so the mapping can be closed
+    return np.concatenate(vertices) if vertices else np.empty((0, 3), np.float32), indices
+
+
+def release_mapped_pages(triangles: np.ndarray, stop: int):
+    """
+    Tells the OS that the pages of a memory-mapped triangle array before a triangle are no longer needed
+    :param triangles: an array from map_binary_triangles
+    :param stop: the index of the first triangle that is still needed
+    """
+    mapped = triangles.base
+    if not isinstance(mapped, mmap.mmap) or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    offset = BINARY_HEADER_SIZE + 4 + min(stop, len(triangles)) * BINARY_TRIANGLE_DTYPE.itemsize
+    length = offset - offset % mmap.PAGESIZE
+    if length:
+        mapped.madvise(mmap.MADV_DONTNEED, 0, length)
+
+
+@contextlib.contextmanager
+def map_binary_triangles(file: _io.BufferedReader) -> Iterator[np.ndarray]:
+    """
+    Memory-maps the triangles of a binary STL file. The array given is a view of the mapping so it (and any views of it)
+    must not be used after the with block ends.
+    :param file: the binary STL file, opened in binary mode
+    :return: a context manager giving an array of BINARY_TRIANGLE_DTYPE
+    """
+    start = BINARY_HEADER_SIZE + 4
+    size = os.fstat(file.fileno()).st_size
+    if size < start:
+        raise Exception("Binary STL file too short")
+
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        num_tris = struct.unpack_from('<I', mapped, BINARY_HEADER_SIZE)[0]
+        if size < start + num_tris * BINARY_TRIANGLE_DTYPE.itemsize:
+            raise Exception("Binary STL file too short")
+
+        triangles = np.frombuffer(mapped, BINARY_TRIANGLE_DTYPE, num_tris, start)
+        try:
+            yield triangles
+        finally:
+            del triangles  # the view has to be gone before the mapping can be closed
+    finally:
+        mapped.close()
+
+
 def read_ascii_stl(file: _io.BufferedReader, header: bytearray, header_pos: int) -> (Dict, List):
     """
     Makes an array of vertices from an ASCII STL file
@@ -115,6 +321,33 @@ def read_ascii_stl(file: _io.BufferedReader, header: bytearray, header_pos: int)
     return vertices, indices
 
 
+def read_ascii_stl_np(file: _io.BufferedReader, header: bytearray, header_pos: int,
+                      chunk_size: int = ASCII_CHUNK_SIZE) -> (np.ndarray, np.ndarray):
+    """
+    Makes arrays of vertices and indices from an ASCII STL file. Checks the same format as read_ascii_stl (which is kept
+    as the reference implementation) but reads the file in large blocks and converts each block with numpy.
+    :param file: a ASCII STL file
+    :param header: the header of the file
+    :param header_pos: the length of the header
+    :param chunk_size: the number of bytes to read at a time
+    :return: an (N,3) array of unique vertices in the order they are first seen and an array of indices into it
+    """
+    triangles = list(read_ascii_facets(file, get_solid_name(header, header_pos), chunk_size))
+    return dedup_vertices(np.concatenate(triangles) if triangles else np.empty((0, 3), np.float32))
+
+
+def get_solid_name(header: bytearray, header_pos: int) -> bytes:
+    """
+    Gets the name of the solid from the header of an ASCII STL file
+    :param header: the header of the file
+    :param header_pos: the length of the header
+    :return: the name of the solid (that must also come after endsolid)
+    """
+    solid_line = header[len(SOLID):header_pos]
+    is_space = solid_line.find(b' ')
+    return solid_line if is_space == -1 else solid_line[0:is_space]
+
+
 def process_header(file: _io.BufferedReader) -> tuple[bytearray, int, bool]:
     """
     Figures out if a STL file is ASCII or Binary by reading the header
@@ -177,6 +410,17 @@ def add_vertex_to_ibo(indices: dict, vertex: Tuple[float, float, float]) -> int:
     return index
 
 
+def ibo_to_arrays(vertices: Dict, indices: List) -> (np.ndarray, np.ndarray):
+    """
+    Converts the dict of vertices and list of indices made by the reference readers to numpy arrays
+    :param vertices: a dict of vertices to their index
+    :param indices: a list of indices
+    :return: an (M,3) array of vertices and an array of indices
+    """
+    np_vertices = np.fromiter(chain.from_iterable(vertices.keys()), np.float32, len(vertices) * 3).reshape(-1, 3)
+    return np_vertices, np.array(indices, np.uint32)
+
+
 # HELPER FUNCTIONS
 
 def check_next_token(tokenizer: Tokenizer, correct_token: bytes):
@@ -224,39 +468,15 @@ def read_number(tokenizer: Tokenizer) -> float:
         raise Exception(f"Incorrect number in STL: {token}")
 
 
-def gen_bounding_box(vertices):
-    # all_vertices = vertices.keys
-    # first_vertex = all_vertices.pop()
-    #
-    # x_min = first_vertex[0]; x_max = first_vertex[0]
-    # y_min = first_vertex[1]; y_max = first_vertex[1]
-    # z_min = first_vertex[2]; z_max = first_vertex[2]
-    #
-    # for vertex in all_vertices
-    #     x_min = max
-
-    x, y, z = next(iter(vertices))
-    max_x = min_x = x
-    max_y = min_y = y
-    max_z = min_z = z
-
-    for x, y, z in vertices:
-        if x < min_x:
-            min_x = x
-        elif x > max_x:
-            max_x = x
-
-        if y < min_y:
-            min_y = y
-        elif y > max_y:
-            max_y = y
-
-        if z < min_z:
-            min_z = z
-        elif z > max_z:
-            max_z = z
-
-    return max_x - min_x, max_y - min_y, max_z - min_z
+def gen_bounding_box(vertices) -> tuple:
+    """
+    Gets the size of the bounding box of a mesh (see mesh_stats for the rest of the statistics)
+    :param vertices: a dict of vertices to their index (from the reference readers) or an (N,3) array of vertices
+    :return: the size in x, y, and z
+    """
+    if isinstance(vertices, dict):
+        vertices = np.fromiter(chain.from_iterable(vertices.keys()), np.float64, len(vertices) * 3)
+    return extents(vertices)
 
 
 def main():
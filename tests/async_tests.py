@@ -0,0 +1,183 @@
+import asyncio
+import functools
+import http.server
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import scad.async_functions
+import scad.functions
+import stl_to_raw
+import vao
+from render_cache import RenderCache
+from scad.source_cache import SourceCache
+from scheduler import PRIORITY_EXPORT, PRIORITY_PREVIEW, AsyncRenderScheduler, run_process_async
+
+from stl_to_raw_tests import TRIANGLES, make_binary_stl
+
+PARAMETERS = {"parameters": [{"name": "size", "initial": 1, "group": "Parameters", "type": "number"}]}
+
+
+async def fake_openscad(args, *rest):
+    # Writes the customizer json, or an stl of the variables of the set it was asked for
+    output = args[args.index('-o') + 1]
+    with open(output, 'w') as f:
+        if output.endswith('.param'):
+            json.dump(PARAMETERS, f)
+        else:
+            with open(args[args.index('-p') + 1]) as parameters:
+                json.dump(json.load(parameters)['parameterSets'][args[args.index('-P') + 1]], f)
+    await asyncio.sleep(0.2)  # long enough for the same render from somewhere else to share it
+    return mock.Mock()
+
+
+class TestAsyncRenderScheduler(unittest.TestCase):
+
+    def test_priority_and_sharing(self):
+        ran = []
+
+        async def job(name):
+            ran.append(name)
+            await asyncio.sleep(0.01)
+            return name
+
+        async def run():
+            scheduler = AsyncRenderScheduler(max_workers=1)
+            return await asyncio.gather(
+                scheduler.run(job, 'first'),
+                scheduler.run(job, 'export', priority=PRIORITY_EXPORT),
+                scheduler.run(job, 'preview', key='preview', priority=PRIORITY_PREVIEW),
+                scheduler.run(job, 'preview again', key='preview', priority=PRIORITY_PREVIEW))
+
+        self.assertEqual(asyncio.run(run()), ['first', 'export', 'preview', 'preview'])
+        self.assertEqual(ran, ['first', 'preview', 'export'])
+
+    def test_limit(self):
+        running = []
+
+        async def job():
+            running.append(1)
+            await asyncio.sleep(0.01)
+            peak = sum(running)
+            running.append(-1)
+            return peak
+
+        async def run():
+            scheduler = AsyncRenderScheduler(max_workers=3)
+            return await asyncio.gather(*(scheduler.run(job) for _ in range(10)))
+
+        self.assertEqual(max(asyncio.run(run())), 3)
+
+    def test_run_process_async(self):
+        async def run():
+            result = await run_process_async([sys.executable, '-c', 'import sys; sys.exit(2)'])
+            self.assertEqual(result.returncode, 2)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                await run_process_async([sys.executable, '-c', 'import time; time.sleep(60)'], timeout=0.5)
+
+        asyncio.run(run())
+
+    def test_timeout_after_process_exited(self):
+        killpg = os.killpg
+
+        def already_gone(pid, sig):
+            killpg(pid, sig)
+            raise ProcessLookupError  # as if the group had exited and been reaped first
+
+        with mock.patch('scheduler.os.killpg', side_effect=already_gone), self.assertRaises(subprocess.TimeoutExpired):
+            asyncio.run(run_process_async([sys.executable, '-c', 'import time; time.sleep(60)'], timeout=0.5))
+
+
+class TestAsyncFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RenderCache(os.path.join(self.tmp.name, 'cache'))
+        with open(os.path.join(self.tmp.name, 'model.scad'), 'w') as f:
+            f.write('size = 1;\ncube(size);\n')
+        scad.functions.SCAD_JSON_MEMORY.clear()
+
+        # Serves the scad file over HTTP
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=self.tmp.name)
+        handler.log_message = lambda *args: None
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/model.scad'
+        sources = SourceCache(os.path.join(self.tmp.name, 'sources'))
+        self.patch = mock.patch('scad.async_functions.get_source_cache', return_value=sources)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        scad.functions.SCAD_JSON_MEMORY.clear()
+        self.tmp.cleanup()
+
+    def test_get_variables(self):
+        with mock.patch('scad.async_functions.run_process_async', side_effect=fake_openscad) as run:
+            variables = asyncio.run(scad.async_functions.get_variables_async(self.url, self.cache))
+        self.assertEqual(variables, scad.functions.scad_json_to_our_json(PARAMETERS))
+        self.assertEqual(run.call_count, 1)
+
+    def test_get_stls(self):
+        variable_sets = [{'size': size} for size in (1, 2, 1, 3)]
+
+        async def get_both():
+            return await asyncio.gather(scad.async_functions.get_stls_async(self.url, variable_sets, self.cache),
+                                        scad.async_functions.get_stl_async(self.url, {'size': 2}, self.cache))
+
+        with mock.patch('scad.async_functions.openscad_version', return_value='test'), \
+                mock.patch('scad.async_functions.run_process_async', side_effect=fake_openscad) as run:
+            stls, stl = asyncio.run(get_both())
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(stl, stls[1])
+        self.assertEqual([json.loads(stl) for stl in stls], variable_sets)
+
+    def test_cancelled_caller_of_shared_render(self):
+        async def slow_openscad(args, *rest):
+            await asyncio.sleep(0.3)  # the first caller is cancelled meanwhile
+            return await fake_openscad(args)
+
+        async def get_twice():
+            path = os.path.join(self.tmp.name, 'model.scad')
+            first = asyncio.ensure_future(scad.async_functions.get_stl_async(path, {'size': 4}, self.cache))
+            second = asyncio.ensure_future(scad.async_functions.get_stl_async(path, {'size': 4}, self.cache))
+            await asyncio.sleep(0.1)
+            first.cancel()
+            return await second
+
+        with mock.patch('scad.async_functions.openscad_version', return_value='test'), \
+                mock.patch('scad.async_functions.run_process_async', side_effect=slow_openscad) as run:
+            self.assertEqual(json.loads(asyncio.run(get_twice())), {'size': 4})
+        self.assertEqual(run.call_count, 1)
+
+    def test_get_vao(self):
+        stl = make_binary_stl(TRIANGLES)
+
+        async def render(args, timeout, capture_output):
+            self.assertEqual(args[args.index('-o') + 1], '-')
+            return subprocess.CompletedProcess(args, 0, stl)
+
+        async def get_both():
+            return await asyncio.gather(*(scad.async_functions.get_vao_async(self.url, {'size': 2}, self.cache,
+                                                                             quantize=True) for _ in range(2)))
+
+        with mock.patch('scad.async_functions.openscad_version', return_value='test'), \
+                mock.patch('scad.async_functions.run_process_async', side_effect=render) as run:
+            first, second = asyncio.run(get_both())
+            third = asyncio.run(scad.async_functions.get_vao_async(self.url, {'size': 2}, self.cache, quantize=True))
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first, third)
+        self.assertEqual(first, vao.encode_vao(*stl_to_raw.read_stl(io.BytesIO(stl)), quantize=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
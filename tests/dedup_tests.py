@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import dedup
+import stl_to_raw
+
+
+class TestDedupVertices(unittest.TestCase):
+
+    def test_first_seen_order(self):
+        points = np.array([[2, 2, 2], [1, 1, 1], [2, 2, 2], [0, 0, 0], [1, 1, 1]], np.float32)
+        vertices, indices = dedup.dedup_vertices(points)
+        np.testing.assert_array_equal(vertices, [[2, 2, 2], [1, 1, 1], [0, 0, 0]])
+        np.testing.assert_array_equal(indices, [0, 1, 0, 2, 1])
+
+    def test_matches_add_vertex_to_ibo(self):
+        rng = np.random.default_rng(2)
+        points = rng.integers(-5, 5, (5000, 3)).astype(np.float32) / 4
+        ibo = {}
+        expected_indices = [stl_to_raw.add_vertex_to_ibo(ibo, tuple(map(float, p))) for p in points]
+        vertices, indices = dedup.dedup_vertices(points)
+        np.testing.assert_array_equal(vertices, list(ibo.keys()))
+        np.testing.assert_array_equal(indices, expected_indices)
+
+    def test_negative_zero(self):
+        points = np.array([[0.0, 1.0, 0.0], [-0.0, 1.0, 0.0]], np.float32)
+        vertices, indices = dedup.dedup_vertices(points)
+        self.assertEqual(len(vertices), 1)
+        np.testing.assert_array_equal(indices, [0, 0])
+
+    def test_empty(self):
+        vertices, indices = dedup.dedup_vertices(np.empty((0, 3), np.float32))
+        self.assertEqual(vertices.shape, (0, 3))
+        self.assertEqual(len(indices), 0)
+
+
+class TestVertexTable(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.points = rng.integers(0, 12, (400, 3)).astype(np.float32)
+
+    def test_vertex_table_matches_dedup(self):
+        points = self.points
+        expected_vertices, expected_indices = dedup.dedup_vertices(points)
+        for chunk in (1, 7, 50, 1000):
+            table = dedup.VertexTable()
+            chunks = [table.add(points[i:i + chunk]) for i in range(0, len(points), chunk)]
+            np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]), expected_vertices)
+            np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks]), expected_indices)
+            self.assertEqual(len(table), len(expected_vertices))
+            self.assertLessEqual(len(table.runs), int(np.log2(len(table))) + 1)  # runs are merged as they grow
+
+    def test_vertex_table_hash_collisions(self):
+        points = self.points
+        expected = dedup.dedup_vertices(points)
+        with mock.patch.object(dedup, 'hash_vertex_bits', lambda bits: np.zeros(len(bits), np.uint64)):
+            table = dedup.VertexTable()
+            chunks = [table.add(points[i:i + 100]) for i in range(0, len(points), 100)]
+        np.testing.assert_array_equal(np.concatenate([c[0] for c in chunks]), expected[0])
+        np.testing.assert_array_equal(np.concatenate([c[1] for c in chunks]), expected[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import scad.functions
+from scad import dependencies
+from scad.dependencies import find_dependencies, find_includes, source_key
+from render_cache import RenderCache
+
+
+class TestDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.library = os.path.join(self.tmp.name, 'library')
+        self.environ = mock.patch.dict(os.environ, {dependencies.LIBRARY_PATH_ENV: self.library})
+        self.environ.start()
+        self.write('library/gears.scad', 'include <teeth.scad>\nmodule gear() {}\n')
+        self.write('library/teeth.scad', 'use <gears.scad>\nmodule tooth() {}\n')  # a cycle
+        self.write('project/shapes.scad', 'module shape() {}\n')
+        self.write('project/a.scad', 'use <gears.scad>\ninclude <shapes.scad>\ngear();\n')
+        self.write('project/b.scad', 'include <shapes.scad>\nshape();\n')
+        dependencies.SCAN_MEMORY.clear()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_find_includes(self):
+        source = (b'include <a.scad>\nuse<lib/b.scad>; // include <c.scad>\n/* use <d.scad>\n*/\n'
+                  b'echo("include <e.scad>");\ninclude\t< f.scad >\n')
+        self.assertEqual(find_includes(source), ['a.scad', 'lib/b.scad', 'f.scad'])
+
+    def test_find_dependencies(self):
+        names = [name for name, _ in find_dependencies(self.path('project/a.scad'))]
+        self.assertEqual(names, ['', 'gears.scad', 'shapes.scad', 'teeth.scad'])
+
+        self.write('project/c.scad', 'include <missing.scad>\n')
+        self.assertEqual(find_dependencies(self.path('project/c.scad'))[1], ('missing.scad', None))
+
+    def test_only_dependents_change(self):
+        a, b = source_key(self.path('project/a.scad')), source_key(self.path('project/b.scad'))
+        self.write('library/teeth.scad', 'use <gears.scad>\nmodule tooth() { cube(1); }\n')
+        self.assertNotEqual(source_key(self.path('project/a.scad')), a)
+        self.assertEqual(source_key(self.path('project/b.scad')), b)
+
+        self.write('project/shapes.scad', 'module shape() { sphere(1); }\n')
+        self.assertNotEqual(source_key(self.path('project/b.scad')), b)
+
+    def test_same_project_somewhere_else(self):
+        key = source_key(self.path('project/b.scad'))
+        self.write('copy/b.scad', 'include <shapes.scad>\nshape();\n')
+        self.write('copy/shapes.scad', 'module shape() {}\n')
+        self.assertEqual(source_key(self.path('copy/b.scad')), key)
+
+    def test_files_are_only_read_again_when_they_change(self):
+        source_key(self.path('project/a.scad'))
+        with mock.patch('builtins.open', side_effect=AssertionError):
+            source_key(self.path('project/a.scad'))
+
+    def test_renders_depend_on_includes(self):
+        def fake_openscad(args, *rest):
+            with open(args[args.index('-o') + 1], 'w') as f:
+                f.write('solid fake\nendsolid fake\n')
+            return mock.Mock()
+
+        cache = RenderCache(self.path('cache'))
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.run_process', side_effect=fake_openscad) as run:
+            scad.functions.get_stl(self.path('project/a.scad'), {}, cache)
+            scad.functions.get_stl(self.path('project/b.scad'), {}, cache)
+            self.write('library/gears.scad', 'include <teeth.scad>\nmodule gear() { tooth(); }\n')
+            scad.functions.get_stl(self.path('project/a.scad'), {}, cache)
+            scad.functions.get_stl(self.path('project/b.scad'), {}, cache)
+        self.assertEqual(run.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
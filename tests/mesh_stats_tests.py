@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+import mesh_stats
+import stl_to_raw
+
+# A closed unit cube with the triangles counter-clockwise from outside
+CUBE_VERTICES = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], np.float32)
+CUBE_INDICES = np.array([
+    0, 1, 3, 0, 3, 2,  # x = 0
+    4, 6, 7, 4, 7, 5,  # x = 1
+    0, 4, 5, 0, 5, 1,  # y = 0
+    2, 3, 7, 2, 7, 6,  # y = 1
+    0, 2, 6, 0, 6, 4,  # z = 0
+    1, 5, 7, 1, 7, 3,  # z = 1
+])
+
+
+class TestMeshStats(unittest.TestCase):
+
+    def test_cube(self):
+        vertices = CUBE_VERTICES * [2, 3, 4] + [-1, 5, 0]
+        stats = mesh_stats.mesh_stats(vertices, CUBE_INDICES)
+        np.testing.assert_array_equal(stats.bbox_min, [-1, 5, 0])
+        np.testing.assert_array_equal(stats.bbox_max, [1, 8, 4])
+        self.assertAlmostEqual(stats.surface_area, 2 * (6 + 8 + 12))
+        self.assertAlmostEqual(stats.volume, 24)
+        self.assertEqual(stats.num_triangles, 12)
+        self.assertEqual(stats.num_degenerate, 0)
+
+    def test_inside_out_and_degenerate(self):
+        indices = np.concatenate((CUBE_INDICES.reshape(-1, 3)[:, ::-1].ravel(), [0, 0, 1, 0, 1, 3]))
+        vertices = np.concatenate((CUBE_VERTICES, [[0, 0, 2]]))
+        indices[-1] = 8  # (0,0,0) (0,0,1) (0,0,2) is on a line
+        stats = mesh_stats.mesh_stats(vertices, indices)
+        self.assertAlmostEqual(stats.volume, -1)
+        self.assertEqual(stats.num_degenerate, 2)
+
+    def test_chunks(self):
+        rng = np.random.default_rng(5)
+        vertices = rng.random((50, 3))
+        indices = rng.integers(0, 50, 300)
+        expected = mesh_stats.mesh_stats(vertices, indices)
+        original = mesh_stats.STATS_CHUNK_TRIANGLES
+        try:
+            mesh_stats.STATS_CHUNK_TRIANGLES = 7
+            stats = mesh_stats.mesh_stats(vertices, indices)
+        finally:
+            mesh_stats.STATS_CHUNK_TRIANGLES = original
+        self.assertAlmostEqual(stats.surface_area, expected.surface_area)
+        self.assertAlmostEqual(stats.volume, expected.volume)
+
+    def test_gen_bounding_box(self):
+        # The first vertex is both the min and max of x, the second sets a new min and a new max of other coordinates
+        vertices = {(0.0, 0.0, 0.0): 0, (0.0, -1.0, 2.0): 1, (0.0, 3.0, -2.0): 2}
+        self.assertEqual(stl_to_raw.gen_bounding_box(vertices), (0.0, 4.0, 4.0))
+        self.assertEqual(stl_to_raw.gen_bounding_box(np.array(list(vertices))), (0.0, 4.0, 4.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import scad.functions
+from metrics import MetricsRegistry, add_metrics_hook, measure, remove_metrics_hook
+from render_cache import RenderCache
+from scheduler import run_process, run_process_async, run_process_reading
+
+# Uses about 0.2 seconds of CPU and 64 MiB of memory
+BUSY_SCRIPT = ('import time\n'
+               'data = bytearray(64 << 20)\n'
+               'start = time.process_time()\n'
+               'while time.process_time() - start < 0.2: pass\n')
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.reported = []
+        add_metrics_hook(self.reported.append)
+
+    def tearDown(self):
+        remove_metrics_hook(self.reported.append)
+
+    def test_measure(self):
+        with measure('parse') as stage:
+            stage.output_bytes = 10
+        with self.assertRaises(RuntimeError):
+            with measure('fetch'):
+                raise RuntimeError
+        self.assertEqual([(m.stage, m.output_bytes, m.failed, m.max_rss) for m in self.reported],
+                         [('parse', 10, False, None), ('fetch', 0, True, None)])
+        self.assertGreaterEqual(self.reported[0].wall_time, 0)
+
+    def test_processes(self):
+        with measure('render'):
+            run_process([sys.executable, '-c', BUSY_SCRIPT]).check_returncode()
+            run_process_reading([sys.executable, '-c', 'print("done")'], lambda f: f.read())
+        run_process([sys.executable, '-c', 'pass'])  # not in a stage
+        metrics, = self.reported
+        self.assertGreaterEqual(metrics.child_cpu_time, 0.15)
+        self.assertGreaterEqual(metrics.max_rss, 64 << 20)
+        self.assertLess(metrics.cpu_time, metrics.child_cpu_time)
+
+    def test_async_process(self):
+        async def run():
+            with measure('render'):
+                (await run_process_async([sys.executable, '-c', BUSY_SCRIPT])).check_returncode()
+
+        asyncio.run(run())
+        metrics, = self.reported
+        self.assertGreaterEqual(metrics.child_cpu_time, 0.15)
+        self.assertIsNone(metrics.max_rss)
+
+    def test_get_stl_stages(self):
+        def fake_openscad(args, *rest):
+            with open(args[args.index('-o') + 1], 'w') as f:
+                f.write('solid fake\nendsolid fake\n')
+            return mock.Mock()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.scad')
+            with open(path, 'w') as f:
+                f.write('cube(1);\n')
+            with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                    mock.patch('scad.functions.run_process', side_effect=fake_openscad):
+                scad.functions.get_stl(path, {}, RenderCache(os.path.join(tmp, 'cache')))
+        self.assertEqual([(m.stage, m.output_bytes) for m in self.reported], [('render', 25)])
+
+    def test_registry(self):
+        registry = MetricsRegistry()
+        add_metrics_hook(registry)
+        try:
+            for size in (10, 20):
+                with measure('render') as stage:
+                    stage.output_bytes = size
+        finally:
+            remove_metrics_hook(registry)
+        text = registry.text()
+        self.assertIn('# TYPE model_customizer_stage_runs_total counter\n', text)
+        self.assertIn('model_customizer_stage_runs_total{stage="render"} 2\n', text)
+        self.assertIn('model_customizer_stage_output_bytes_total{stage="render"} 30\n', text)
+        self.assertIn('model_customizer_stage_failures_total{stage="render"} 0\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import normals
+import stl_to_raw
+import vao
+from mesh_stats_tests import CUBE_INDICES, CUBE_VERTICES
+from stl_to_raw_tests import make_binary_stl
+
+
+class TestCreaseNormals(unittest.TestCase):
+
+    def test_cube_hard_edges(self):
+        vertices, vertex_normals, indices = normals.crease_normals(CUBE_VERTICES, CUBE_INDICES, 30)
+        self.assertEqual(len(vertices), 24)  # each corner of the cube is split for its 3 faces
+        np.testing.assert_array_equal(np.abs(vertex_normals).sum(axis=1), 1)
+
+        # Every vertex of a triangle has the face normal
+        triangles = indices.reshape(-1, 3)
+        for triangle in triangles:
+            np.testing.assert_array_equal(vertex_normals[triangle], vertex_normals[triangle[[0, 0, 0]]])
+        np.testing.assert_array_equal(vertices[indices], CUBE_VERTICES[CUBE_INDICES])
+
+    def test_cube_smooth(self):
+        vertices, vertex_normals, indices = normals.crease_normals(CUBE_VERTICES, CUBE_INDICES, 180)
+        self.assertEqual(len(vertices), 8)
+        # Each corner is the area-weighted average of the triangles around it, pointing away from the center
+        np.testing.assert_allclose(np.linalg.norm(vertex_normals, axis=1), 1, rtol=1e-6)
+        self.assertTrue(np.all(np.einsum('ij,ij->i', vertex_normals, vertices - 0.5) > 0))
+        # The corners at (0,0,0) and (1,1,1) have both triangles of all 3 sides so they point straight out
+        corners = [np.flatnonzero((vertices == corner).all(axis=1))[0] for corner in ([0, 0, 0], [1, 1, 1])]
+        np.testing.assert_allclose(vertex_normals[corners], np.array([[-1, -1, -1], [1, 1, 1]]) / np.sqrt(3), rtol=1e-6)
+
+    def test_flat_welds_coplanar(self):
+        # With a crease angle of 0 the two triangles of each side still share their diagonal
+        vertices, _, indices = normals.crease_normals(CUBE_VERTICES, CUBE_INDICES, 0)
+        self.assertEqual(len(vertices), 24)
+        self.assertEqual(len(indices), 36)
+
+    def test_chunks(self):
+        expected = normals.crease_normals(CUBE_VERTICES, CUBE_INDICES, 30)
+        original = normals.PAIR_CHUNK
+        try:
+            normals.PAIR_CHUNK = 5
+            result = normals.crease_normals(CUBE_VERTICES, CUBE_INDICES, 30)
+        finally:
+            normals.PAIR_CHUNK = original
+        for a, b in zip(expected, result):
+            np.testing.assert_array_equal(a, b)
+
+    def test_degenerate(self):
+        vertices = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0]], np.float32)
+        _, vertex_normals, _ = normals.crease_normals(vertices, [0, 1, 2])
+        np.testing.assert_array_equal(vertex_normals, 0)
+
+    def test_stl2raw(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cube.stl')
+            with open(path, 'wb') as f:
+                triangles = CUBE_VERTICES[CUBE_INDICES].reshape(-1, 3, 3)
+                f.write(make_binary_stl(np.concatenate((np.zeros((12, 1, 3)), triangles), axis=1)))
+            vertices, indices = stl_to_raw.stl2raw(path, crease_angle=30)
+            header, read_vertices, read_indices = vao.read_vao(os.path.join(tmp, 'cube.vao'))
+            self.assertTrue(header.flags & vao.FLAG_NORMALS)
+            self.assertEqual(read_vertices.shape, (24, 6))
+            np.testing.assert_array_equal(read_vertices[:, :3], vertices)
+            np.testing.assert_array_equal(read_indices, indices)
+
+
+if __name__ == '__main__':
+    unittest.main()
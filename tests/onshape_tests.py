@@ -0,0 +1,352 @@
+import asyncio
+import base64
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from onshape.cache import MetadataCache
+from onshape.client import OnShapeClient
+from onshape.get_doc_names import get_doc_names, get_doc_names_async
+from onshape.get_stl import MICROVERSIONS, encode_configuration, get_stl, get_stl_async, get_vao, get_vao_async
+from onshape.get_variables import get_variables, get_variables_async
+from render_cache import MemoryCache, RenderCache
+from scheduler import AsyncRenderScheduler, RenderScheduler
+from stl_to_raw_tests import TRIANGLES, make_binary_stl
+from vao import decode_vao
+
+DID, WVID, EID, MICROVERSION = 'd' * 24, 'a' * 24, 'e' * 24, 'b' * 24
+DOCUMENT_URL = f'https://cad.onshape.com/documents/{DID}/w/{WVID}/e/{EID}'
+
+STL = make_binary_stl(TRIANGLES)
+TRANSLATION = f'/api/v5/translations/{"t" * 24}'
+DONE = (200, {'id': 't' * 24, 'requestState': 'DONE', 'resultExternalDataIds': ['f' * 24]})
+
+CONFIGURATION = {'configurationParameters': [{
+    'btType': 'BTMConfigurationParameterBoolean-2550', 'parameterId': 'hollow', 'parameterName': 'Hollow',
+    'defaultValue': True,
+}]}
+
+
+class FakeOnShape(http.server.ThreadingHTTPServer):
+    """
+    A stand-in for the OnShape API. routes has the response for each path as (status, body), where the body is
+    JSON or bytes; a list of them is answered in order, the last one for every request after that. Every response has
+    an ETag and conditional requests for one that didn't change get a 304.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeOnShapeHandler)
+        self.url = f'http://127.0.0.1:{self.server_port}'
+        self.delays = {}  # seconds to wait before answering a path
+        self.routes = {
+            f'/api/v5/documents/{DID}': (200, {'name': 'Box'}),
+            f'/api/v5/documents/d/{DID}/w/{WVID}/elements': (200, [{'name': 'Part Studio 1'}]),
+            f'/api/v5/variables/d/{DID}/w/{WVID}/e/{EID}/variables': (200, [{'variables': []}]),
+            f'/api/v5/elements/d/{DID}/w/{WVID}/e/{EID}/configuration': (200, CONFIGURATION),
+            f'/api/v5/documents/d/{DID}/w/{WVID}/currentmicroversion': (200, {'microversion': MICROVERSION}),
+            f'/api/v5/partstudios/d/{DID}/m/{MICROVERSION}/e/{EID}/translations': (200, {
+                'id': 't' * 24, 'requestState': 'ACTIVE'}),
+            TRANSLATION: DONE,
+            f'/api/v5/documents/d/{DID}/externaldata/{"f" * 24}': (200, STL),
+        }
+        self.requests = []  # (method, path, query, body, auth)
+        self.connections = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeOnShapeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keeps connections open
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        auth = self.headers.get('Authorization', '')
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests.append((method, url.path, parse_qs(url.query), json.loads(body) if body else None,
+                                    base64.b64decode(auth.split()[1]).decode() if auth else None))
+            route = server.routes.get(url.path, (404, {'message': 'not found'}))
+            if isinstance(route, list):
+                route = route.pop(0) if len(route) > 1 else route[0]
+        time.sleep(self.server.delays.get(url.path, 0))
+        status, data = route
+        data = data if isinstance(data, bytes) else json.dumps(data).encode()
+        etag = '"' + hashlib.sha256(data).hexdigest() + '"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, data = 304, b''
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestOnShapeClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeOnShape()
+        self.client = OnShapeClient('access', 'secret', self.server.url, backoff=0.01)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = MetadataCache(os.path.join(self.tmp.name, 'metadata'), ttl=60)
+        self.exports = RenderCache(os.path.join(self.tmp.name, 'exports'))
+        patcher = mock.patch('onshape.get_stl.get_export_cache', return_value=self.exports)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        MICROVERSIONS.clear()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        self.tmp.cleanup()
+
+    def test_get_doc_names(self):
+        self.assertEqual(get_doc_names(DOCUMENT_URL, self.client, None), ['Box', 'Part Studio 1'])
+        self.assertEqual(asyncio.run(get_doc_names_async(DOCUMENT_URL, self.client, None)), ['Box', 'Part Studio 1'])
+        elements = [request for request in self.server.requests if request[1].endswith('/elements')]
+        self.assertEqual([request[2] for request in elements], [{'elementId': [EID]}] * 2)
+        self.assertEqual({request[4] for request in self.server.requests}, {'access:secret'})
+
+    def test_doc_names_requests_are_concurrent(self):
+        self.server.delays = {f'/api/v5/documents/{DID}': 0.5, f'/api/v5/documents/d/{DID}/w/{WVID}/elements': 0.5}
+        start = time.monotonic()
+        get_doc_names(DOCUMENT_URL, self.client, None)
+        self.assertLess(time.monotonic() - start, 0.9)
+        start = time.monotonic()
+        asyncio.run(get_doc_names_async(DOCUMENT_URL, self.client, None))
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_async_requests_use_the_client_threads(self):
+        threads = []
+        get_json = self.client.get_json
+
+        def record_thread(*args):
+            threads.append(threading.current_thread().name)
+            return get_json(*args)
+
+        with mock.patch.object(self.client, 'get_json', side_effect=record_thread):
+            asyncio.run(get_doc_names_async(DOCUMENT_URL, self.client, None))
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('onshape') for name in threads))
+
+    def test_doc_names_cache(self):
+        cache = MemoryCache(10)
+        names = get_doc_names(DOCUMENT_URL, self.client, cache)
+        names.append('changed by the caller')
+        self.assertEqual(get_doc_names(DOCUMENT_URL, self.client, cache), ['Box', 'Part Studio 1'])
+        self.assertEqual(asyncio.run(get_doc_names_async(DOCUMENT_URL, self.client, cache)), ['Box', 'Part Studio 1'])
+        self.assertEqual(len(self.server.requests), 2)
+
+        # workspaces expire, versions don't
+        version_url = DOCUMENT_URL.replace('/w/', '/v/')
+        self.server.routes[f'/api/v5/documents/d/{DID}/v/{WVID}/elements'] = (200, [{'name': 'Part Studio 1'}])
+        get_doc_names(version_url, self.client, cache)
+        with mock.patch('render_cache.time.monotonic', return_value=time.monotonic() + 3600):
+            get_doc_names(DOCUMENT_URL, self.client, cache)
+            get_doc_names(version_url, self.client, cache)
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_get_variables(self):
+        expected = [{'id': 'hollow', 'name': 'Hollow', 'style': 'checkbox', 'default': True}]
+        self.assertEqual(get_variables(DOCUMENT_URL, self.client, self.cache), expected)
+        self.cache.clear()
+        self.assertEqual(asyncio.run(get_variables_async(DOCUMENT_URL, self.client, self.cache)), expected)
+
+    def test_variables_cache(self):
+        expected = [{'id': 'hollow', 'name': 'Hollow', 'style': 'checkbox', 'default': True}]
+        get_variables(DOCUMENT_URL, self.client, self.cache)[0]['default'] = 'changed by the caller'
+        self.assertEqual(get_variables(DOCUMENT_URL, self.client, self.cache), expected)
+        self.assertEqual(asyncio.run(get_variables_async(DOCUMENT_URL, self.client, self.cache)), expected)
+        self.assertEqual(len(self.server.requests), 2)
+
+        # after the ttl workspaces are checked, and only downloaded again if they changed
+        with mock.patch('onshape.cache.time.time', return_value=time.time() + 120):
+            self.assertEqual(get_variables(DOCUMENT_URL, self.client, self.cache), expected)
+            self.assertEqual(self.cache.not_modified, 2)
+            self.server.routes[f'/api/v5/elements/d/{DID}/w/{WVID}/e/{EID}/configuration'] = (200, {
+                'configurationParameters': []})
+        with mock.patch('onshape.cache.time.time', return_value=time.time() + 240):
+            self.assertEqual(get_variables(DOCUMENT_URL, self.client, self.cache), [])
+        self.assertEqual(len(self.server.requests), 6)
+
+        # versions are never checked, even by a new process
+        version = f'/api/v5/elements/d/{DID}/v/{WVID}/e/{EID}/configuration'
+        self.server.routes[version] = (200, CONFIGURATION)
+        self.server.routes[f'/api/v5/variables/d/{DID}/v/{WVID}/e/{EID}/variables'] = (200, [{'variables': []}])
+        get_variables(DOCUMENT_URL.replace('/w/', '/v/'), self.client, self.cache)
+        cache = MetadataCache(os.path.join(self.tmp.name, 'metadata'))
+        with mock.patch('onshape.cache.time.time', return_value=time.time() + 10 ** 9):
+            self.assertEqual(get_variables(DOCUMENT_URL.replace('/w/', '/v/'), self.client, cache), expected)
+        self.assertEqual(len(self.server.requests), 8)
+        self.assertEqual(cache.hits, 2)
+
+    def test_errors_are_not_cached(self):
+        version_url = DOCUMENT_URL.replace('/w/', '/v/')
+        with self.assertRaises(requests.HTTPError):
+            get_variables(version_url, self.client, self.cache)
+        variables = f'/api/v5/variables/d/{DID}/v/{WVID}/e/{EID}/variables'
+        self.server.routes[variables] = (200, {'message': 'not a list of variables'})
+        with self.assertRaises(ValueError):
+            get_variables(version_url, self.client, self.cache)
+
+        self.server.routes[variables] = (200, [{'variables': []}])
+        self.server.routes[f'/api/v5/elements/d/{DID}/v/{WVID}/e/{EID}/configuration'] = (200, CONFIGURATION)
+        self.assertEqual(len(get_variables(version_url, self.client, self.cache)), 1)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_get_stl(self):
+        self.assertEqual(get_stl(DOCUMENT_URL, client=self.client), STL)
+        self.assertEqual(asyncio.run(get_stl_async(DOCUMENT_URL, {'hollow': False}, self.client)), STL)
+        posts = [request[3] for request in self.server.requests if request[0] == 'POST']
+        self.assertEqual([(body['formatName'], body['configuration']) for body in posts],
+                         [('STL', ''), ('STL', 'hollow=false')])
+
+    def test_get_vao(self):
+        vao = decode_vao(get_vao(DOCUMENT_URL, {'hollow': True}, self.client))
+        self.assertEqual(len(vao.indices), 3 * len(TRIANGLES))
+        self.assertEqual(asyncio.run(get_vao_async(DOCUMENT_URL, {'hollow': True}, self.client)),
+                         get_vao(DOCUMENT_URL, {'hollow': True}, self.client))
+
+    def test_export_polling(self):
+        active = (200, {'id': 't' * 24, 'requestState': 'ACTIVE'})
+        self.server.routes[TRANSLATION] = [active, active, DONE]
+        self.assertEqual(get_stl(DOCUMENT_URL, client=self.client), STL)
+        self.assertEqual([request[1] for request in self.server.requests].count(TRANSLATION), 3)
+
+        self.server.routes[TRANSLATION] = (200, {'id': 't' * 24, 'requestState': 'FAILED', 'failureReason': 'bad'})
+        with self.assertRaisesRegex(ValueError, 'bad'):
+            get_stl(DOCUMENT_URL, {'size': 1}, client=self.client)
+        with self.assertRaisesRegex(ValueError, 'bad'):
+            asyncio.run(get_stl_async(DOCUMENT_URL, {'size': 1}, client=self.client))
+
+        self.server.routes[TRANSLATION] = active
+        with self.assertRaises(TimeoutError):
+            get_stl(DOCUMENT_URL, {'size': 1}, client=self.client, timeout=0.5)
+
+    def test_export_limit(self):
+        self.server.delays[TRANSLATION] = 0.2
+        download = f'/api/v5/documents/d/{DID}/externaldata/{"f" * 24}'
+
+        def most_running():
+            running = most = 0
+            for method, path, _, _, _ in self.server.requests:
+                running += method == 'POST'
+                running -= path == download
+                most = max(most, running)
+            return most
+
+        with mock.patch('onshape.get_stl.get_export_scheduler', return_value=RenderScheduler(2)):
+            futures = [self.client.submit(get_stl, DOCUMENT_URL, {'size': size}, self.client) for size in range(6)]
+            self.assertEqual([future.result() for future in futures], [STL] * 6)
+        self.assertEqual(most_running(), 2)
+
+        async def export_all():
+            return await asyncio.gather(*(get_stl_async(DOCUMENT_URL, {'size': size}, self.client)
+                                          for size in range(6, 12)))
+
+        self.server.requests.clear()
+        with mock.patch('onshape.get_stl.get_async_export_scheduler', return_value=AsyncRenderScheduler(3)):
+            self.assertEqual(asyncio.run(export_all()), [STL] * 6)
+        self.assertEqual(most_running(), 3)
+
+    def test_export_cache(self):
+        def exports():
+            return [request[3] for request in self.server.requests if request[0] == 'POST']
+
+        get_stl(DOCUMENT_URL, {'size': 1}, self.client)
+        get_stl(DOCUMENT_URL, {'size': 1}, self.client)
+        asyncio.run(get_stl_async(DOCUMENT_URL, {'size': 1}, self.client))
+        self.assertEqual(len(exports()), 1)
+
+        # the tiers, configurations, and vao files are cached separately
+        get_stl(DOCUMENT_URL, {'size': 1}, self.client, tier='preview')
+        get_stl(DOCUMENT_URL, {'size': 2}, self.client, tier='preview')
+        get_vao(DOCUMENT_URL, {'size': 1}, self.client, tier='preview')
+        asyncio.run(get_vao_async(DOCUMENT_URL, {'size': 1}, self.client, tier='preview'))
+        self.assertEqual([(body['configuration'], body['chordTolerance']) for body in exports()[1:]],
+                         [('size=1', '0.5'), ('size=2', '0.5'), ('size=1', '0.5')])
+        with self.assertRaises(ValueError):
+            get_stl(DOCUMENT_URL, {'size': 1}, self.client, tier='draft')
+
+        # a change to the workspace is exported again once its microversion is looked up again
+        MICROVERSIONS.clear()
+        microversion = f'/api/v5/documents/d/{DID}/w/{WVID}/currentmicroversion'
+        self.server.routes[microversion] = (200, {'microversion': 'c' * 24})
+        self.server.routes[f'/api/v5/partstudios/d/{DID}/m/{"c" * 24}/e/{EID}/translations'] = DONE
+        get_stl(DOCUMENT_URL, {'size': 1}, self.client)
+        self.assertEqual(len(exports()), 5)
+
+        # versions are exported as they are
+        self.server.routes[f'/api/v5/partstudios/d/{DID}/v/{WVID}/e/{EID}/translations'] = DONE
+        get_stl(DOCUMENT_URL.replace('/w/', '/v/'), {'size': 1}, self.client)
+        get_stl(DOCUMENT_URL.replace('/w/', '/v/'), {'size': 1}, self.client)
+        self.assertEqual(len(exports()), 6)
+
+        cache = RenderCache(os.path.join(self.tmp.name, 'small'), max_bytes=2 * len(STL))
+        for size in range(4):
+            get_stl(DOCUMENT_URL, {'size': size}, self.client, cache=cache)
+        self.assertEqual(cache.stats().entries, 2)
+
+    def test_encode_configuration(self):
+        self.assertEqual(encode_configuration(None), '')
+        self.assertEqual(encode_configuration({'size': '10 mm', 'hollow': True, 'name': 'a;b'}),
+                         'hollow=true;name=a%3Bb;size=10+mm')
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            get_doc_names(DOCUMENT_URL, self.client, None)
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertLessEqual(len(self.server.connections), 2)  # the two requests for the names are made at once
+
+    def test_retries(self):
+        path = f'/api/v5/documents/{DID}'
+        self.server.routes[path] = [(429, {}), (503, {}), (200, {'name': 'Box'})]
+        self.assertEqual(self.client.get_json(path), {'name': 'Box'})
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.server.routes[path] = [(500, {'message': 'broken'})]
+        client = OnShapeClient('access', 'secret', self.server.url, retries=2, backoff=0.01)
+        self.assertEqual(client.request('GET', path).status_code, 500)
+        self.assertEqual(len(self.server.requests), 6)
+        with self.assertRaises(Exception):
+            client.get_json(path, raise_for_status=True)
+        client.close()
+
+    def test_posts_are_only_retried_when_rate_limited(self):
+        path = f'/api/v5/partstudios/d/{DID}/w/{WVID}/e/{EID}/translations'
+        self.server.routes[path] = [(429, {}), (200, {'id': 't' * 24})]
+        self.assertEqual(self.client.post_json(path, {}), {'id': 't' * 24})
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.server.routes[path] = [(502, {'message': 'bad gateway'}), (200, {'id': 't' * 24})]
+        self.assertEqual(self.client.request('POST', path, json={}).status_code, 502)
+        self.assertEqual(len(self.server.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
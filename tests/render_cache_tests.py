@@ -0,0 +1,238 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import scad.functions
+import stl_to_raw
+import vao
+from render_cache import MemoryCache, RenderCache, render_key
+from stl_to_raw_tests import TRIANGLES, make_binary_stl
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RenderCache(os.path.join(self.tmp.name, 'cache'), max_bytes=250)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, key, size):
+        with self.cache.new_file() as path:
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+            return self.cache.put(key, path)
+
+    def test_render_key(self):
+        key = render_key('cube', {'size': 1, 'center': True}, 'OpenSCAD version 2023.02.15')
+        self.assertEqual(key, render_key('cube', {'center': True, 'size': 1}, 'OpenSCAD version 2023.02.15'))
+        self.assertNotEqual(key, render_key('sphere', {'size': 1, 'center': True}, 'OpenSCAD version 2023.02.15'))
+        self.assertNotEqual(key, render_key('cube', {'size': 2, 'center': True}, 'OpenSCAD version 2023.02.15'))
+        self.assertNotEqual(key, render_key('cube', {'size': 1, 'center': True}, 'OpenSCAD version 2024.01.01'))
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get('a'))
+        path = self.add('a', 10)
+        self.assertEqual(self.cache.get('a'), path)
+        self.assertIsNone(self.cache.get('a', '.vao'))
+        self.assertEqual(self.cache.stats(), (1, 2, 1, 10))
+
+    def test_evicts_least_recently_used(self):
+        for i, key in enumerate('abc'):
+            self.add(key, 100)
+            os.utime(self.cache.path(key), (i, i))
+        self.assertIsNone(self.cache.get('a'))  # a, b, and c don't fit
+        os.utime(self.cache.get('b'), (10, 10))  # b is used after c
+        self.add('d', 100)
+        self.assertEqual(sorted(entry.name for entry in self.cache.entries()), ['b.stl', 'd.stl'])
+
+    def test_new_file_cleans_up(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.new_file() as path:
+                raise RuntimeError
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class TestGetStl(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RenderCache(os.path.join(self.tmp.name, 'cache'))
+        self.scad = os.path.join(self.tmp.name, 'model.scad')
+        with open(self.scad, 'w') as f:
+            f.write('size = 1;\ncube(size);\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def fake_openscad(args, *rest):
+        with open(args[args.index('-o') + 1], 'w') as f:
+            f.write('solid fake\nendsolid fake\n')
+        return mock.Mock()
+
+    def test_only_renders_once(self):
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.run_process', side_effect=self.fake_openscad) as run:
+            first = scad.functions.get_stl(self.scad, {'size': 2}, self.cache)
+            second = scad.functions.get_stl(self.scad, {'size': 2}, self.cache)
+            scad.functions.get_stl(self.scad, {'size': 3}, self.cache)
+        self.assertEqual(first, b'solid fake\nendsolid fake\n')
+        self.assertEqual(second, first)
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_batch(self):
+        def render_variables(args, *rest):
+            # The stl is the variables of the set it was asked for
+            with open(args[args.index('-p') + 1]) as f:
+                parameter_sets = json.load(f)['parameterSets']
+            with open(args[args.index('-o') + 1], 'w') as f:
+                json.dump(parameter_sets[args[args.index('-P') + 1]], f)
+            return mock.Mock()
+
+        variable_sets = [{'size': size} for size in (1, 2, 3, 2)]
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.get_scad_file', wraps=scad.functions.get_scad_file) as get_scad_file, \
+                mock.patch('scad.functions.run_process', side_effect=render_variables) as run:
+            scad.functions.get_stl(self.scad, {'size': 3}, self.cache)
+            stls = scad.functions.get_stls(self.scad, variable_sets, self.cache)
+        self.assertEqual(get_scad_file.call_count, 2)
+        self.assertEqual(run.call_count, 3)  # size 3 was already cached
+        self.assertEqual([json.loads(stl) for stl in stls], variable_sets)
+
+        # a batch bigger than the cache still gets all of its files
+        variable_sets = [{'size': size, 'padding': 'x' * 100} for size in range(8)]
+        cache = RenderCache(os.path.join(self.tmp.name, 'small'), max_bytes=300)
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.run_process', side_effect=render_variables):
+            stls = scad.functions.get_stls(self.scad, variable_sets, cache)
+        self.assertEqual([json.loads(stl) for stl in stls], variable_sets)
+        self.assertLess(cache.stats().entries, len(variable_sets))
+
+    def test_failed_render_is_not_cached(self):
+        def fail(*args):
+            result = mock.Mock()
+            result.check_returncode.side_effect = RuntimeError
+            return result
+
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.run_process', side_effect=fail):
+            with self.assertRaises(RuntimeError):
+                scad.functions.get_stl(self.scad, {}, self.cache)
+        self.assertEqual(self.cache.stats().entries, 0)
+
+    def test_vao(self):
+        stl = make_binary_stl(TRIANGLES)
+
+        def render(args, read, *rest):
+            self.assertEqual(args[args.index('--export-format') + 1], 'binstl')
+            self.assertEqual(args[args.index('-o') + 1], '-')
+            return read(io.BytesIO(stl))
+
+        with mock.patch('scad.functions.openscad_version', return_value='test'), \
+                mock.patch('scad.functions.run_process_reading', side_effect=render) as run:
+            first = scad.functions.get_vao(self.scad, {'size': 2}, self.cache)
+            second = scad.functions.get_vao(self.scad, {'size': 2}, self.cache)
+            compressed = scad.functions.get_vao(self.scad, {'size': 2}, self.cache, compression='zlib')
+        self.assertEqual(first, second)
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(first, vao.encode_vao(*stl_to_raw.read_stl(io.BytesIO(stl))))
+        np.testing.assert_array_equal(vao.decode_vao(compressed).vertices, vao.decode_vao(first).vertices)
+        self.assertEqual([entry.name.endswith('.vao') for entry in self.cache.entries()], [True, True])
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_least_recently_used(self):
+        cache = MemoryCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)  # b is forgotten since a was used after it
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_ttl(self):
+        cache = MemoryCache(2)
+        cache.put('a', 1, ttl=60)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        with mock.patch('render_cache.time.monotonic', return_value=time.monotonic() + 120):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+
+
+class TestScadJson(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RenderCache(os.path.join(self.tmp.name, 'cache'))
+        self.scad = os.path.join(self.tmp.name, 'model.scad')
+        with open(self.scad, 'w') as f:
+            f.write('size = 1; // [1:10]\ncube(size);\n')
+        scad.functions.SCAD_JSON_MEMORY.clear()
+
+    def tearDown(self):
+        scad.functions.SCAD_JSON_MEMORY.clear()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def fake_openscad(args, *rest):
+        with open(args[args.index('-o') + 1], 'w') as f:
+            f.write('{"parameters": [{"name": "size", "initial": 1, "group": "Parameters", "type": "number", '
+                    '"min": 1, "max": 10, "step": 1}]}')
+        return mock.Mock()
+
+    def test_only_runs_openscad_once(self):
+        with mock.patch('scad.functions.run_process', side_effect=self.fake_openscad) as run:
+            first = scad.functions.get_variables(self.scad, self.cache)
+            first[0]['name'] = 'changed'
+            second = scad.functions.get_variables(self.scad, self.cache)
+
+            # A new process only has the copy on disk
+            scad.functions.SCAD_JSON_MEMORY.clear()
+            third = scad.functions.get_variables(self.scad, self.cache)
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(second, third)
+        self.assertEqual(second[0]['name'], 'size')
+        self.assertEqual(second[0]['style'], 'slider')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_new_contents(self):
+        with mock.patch('scad.functions.run_process', side_effect=self.fake_openscad) as run:
+            scad.functions.scad_to_scad_json(self.scad, self.cache)
+            with open(self.scad, 'a') as f:
+                f.write('sphere(size);\n')
+            scad.functions.scad_to_scad_json(self.scad, self.cache)
+        self.assertEqual(run.call_count, 2)
+
+    def test_evicted_while_reading(self):
+        get = self.cache.get
+
+        def evict_after_get(*args):
+            path = get(*args)
+            if path is not None:
+                os.remove(path)  # as if another process evicted it before it was opened
+            return path
+
+        with mock.patch('scad.functions.run_process', side_effect=self.fake_openscad) as run:
+            scad.functions.scad_to_scad_json(self.scad, self.cache)
+            scad.functions.SCAD_JSON_MEMORY.clear()
+            with mock.patch.object(self.cache, 'get', side_effect=evict_after_get):
+                scad_json = scad.functions.scad_to_scad_json(self.scad, self.cache)
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(scad_json['parameters'][0]['name'], 'size')
+
+
+if __name__ == '__main__':
+    unittest.main()
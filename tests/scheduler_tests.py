@@ -0,0 +1,110 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from scheduler import (PRIORITY_EXPORT, PRIORITY_PREVIEW, RenderScheduler, run_process,
+                           run_process_reading)
+
+
+class TestRenderScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RenderScheduler(max_workers=1)
+        self.release = threading.Event()
+        self.blocker = self.scheduler.submit(self.release.wait)  # keeps the only worker busy
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.shutdown()
+
+    def test_priority(self):
+        ran = []
+        for name, priority in (('export 1', PRIORITY_EXPORT), ('preview', PRIORITY_PREVIEW),
+                               ('export 2', PRIORITY_EXPORT)):
+            self.scheduler.submit(ran.append, name, priority=priority)
+        self.release.set()
+        self.scheduler.shutdown()
+        self.assertEqual(ran, ['preview', 'export 1', 'export 2'])
+
+    def test_in_flight_jobs_are_shared(self):
+        ran = []
+        first = self.scheduler.submit(ran.append, 'a', key='a')
+        self.assertIs(self.scheduler.submit(ran.append, 'a again', key='a'), first)
+        other = self.scheduler.submit(ran.append, 'b', key='b')
+        self.release.set()
+        first.result()
+        other.result()
+        self.assertEqual(ran, ['a', 'b'])
+
+        # Once it is done it runs again
+        self.scheduler.submit(ran.append, 'a later', key='a').result()
+        self.assertEqual(ran, ['a', 'b', 'a later'])
+
+    def test_shared_job_gets_higher_priority(self):
+        ran = []
+        self.scheduler.submit(ran.append, 'export', priority=PRIORITY_EXPORT)
+        self.scheduler.submit(ran.append, 'shared', key='shared', priority=PRIORITY_EXPORT)
+        self.scheduler.submit(ran.append, 'not this one', key='shared', priority=PRIORITY_PREVIEW)
+        self.release.set()
+        self.scheduler.shutdown()
+        self.assertEqual(ran, ['shared', 'export'])
+
+    def test_exceptions_and_asyncio(self):
+        future = self.scheduler.submit(int, 'not a number')
+        self.release.set()
+        with self.assertRaises(ValueError):
+            future.result()
+
+        async def wait():
+            return await asyncio.wrap_future(self.scheduler.submit(int, '5'))
+        self.assertEqual(asyncio.run(wait()), 5)
+
+
+class TestRunProcess(unittest.TestCase):
+
+    def test_return_code(self):
+        self.assertEqual(run_process([sys.executable, '-c', 'import sys; sys.exit(3)']).returncode, 3)
+
+    def test_timeout_kills_process_group(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pid_file = os.path.join(tmp, 'pid')
+            # The child starts a grandchild that would outlive it if only the child was killed
+            script = ('import subprocess, sys, time\n'
+                      'p = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+                      f'open({pid_file!r}, "w").write(str(p.pid))\n'
+                      'time.sleep(60)\n')
+            start = time.monotonic()
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_process([sys.executable, '-c', script], timeout=2)
+            self.assertLess(time.monotonic() - start, 30)
+
+            with open(pid_file) as f:
+                grandchild = int(f.read())
+            for _ in range(100):
+                try:
+                    os.kill(grandchild, 0)
+                except ProcessLookupError:
+                    break
+                time.sleep(0.05)
+            else:
+                self.fail('the grandchild process is still running')
+
+
+    def test_reading(self):
+        script = 'import sys; sys.stdout.buffer.write(b"x" * 1000000); sys.exit(int(sys.argv[1]))'
+        self.assertEqual(run_process_reading([sys.executable, '-c', script, '0'], lambda f: f.read(10)), b'x' * 10)
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_process_reading([sys.executable, '-c', script, '1'], lambda f: f.read())
+
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_process_reading([sys.executable, '-c', 'import time; time.sleep(60)'], lambda f: f.read(), timeout=1)
+        self.assertLess(time.monotonic() - start, 30)
+
+if __name__ == '__main__':
+    unittest.main()
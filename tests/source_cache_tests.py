@@ -0,0 +1,149 @@
+import http.server
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import scad.functions
+from scad.source_cache import SourceCache
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    """
+    Serves files from a dict with ETag or Last-Modified headers and answers conditional requests
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.files = {}  # path to (body, etag, last modified)
+        self.requests = []
+        self.delay = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        time.sleep(server.delay)
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+
+        body, etag, last_modified = server.files[self.path]
+        if (etag is not None and self.headers.get('If-None-Match') == etag) or \
+                (last_modified is not None and self.headers.get('If-Modified-Since') == last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if last_modified is not None:
+            self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SourceCache(self.tmp.name, timeout=5)
+        self.server = FakeServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_etag(self):
+        self.server.files['/a.scad'] = (b'cube(1);', '"v1"', None)
+        path = self.cache.fetch(self.server.url('/a.scad'))
+        self.assertEqual(self.read(path), b'cube(1);')
+        self.assertEqual(self.cache.fetch(self.server.url('/a.scad')), path)
+        self.assertEqual(self.cache.not_modified, 1)
+        self.assertEqual(self.server.requests[1][1].get('If-None-Match'), '"v1"')
+
+        self.server.files['/a.scad'] = (b'cube(2);', '"v2"', None)
+        self.assertEqual(self.read(self.cache.fetch(self.server.url('/a.scad'))), b'cube(2);')
+        self.assertEqual(self.cache.not_modified, 1)
+
+    def test_last_modified(self):
+        self.server.files['/b.scad'] = (b'sphere(1);', None, 'Wed, 21 Oct 2015 07:28:00 GMT')
+        self.cache.fetch(self.server.url('/b.scad'))
+        self.assertEqual(self.read(self.cache.fetch(self.server.url('/b.scad'))), b'sphere(1);')
+        self.assertEqual(self.cache.not_modified, 1)
+        self.assertEqual(self.server.requests[1][1].get('If-Modified-Since'), 'Wed, 21 Oct 2015 07:28:00 GMT')
+
+    def test_no_validators(self):
+        # Without an ETag or Last-Modified the file is downloaded every time
+        self.server.files['/c.scad'] = (b'cylinder(1);', None, None)
+        self.cache.fetch(self.server.url('/c.scad'))
+        self.cache.fetch(self.server.url('/c.scad'))
+        self.assertEqual(self.cache.not_modified, 0)
+        self.assertNotIn('If-None-Match', self.server.requests[1][1])
+
+    def test_limits(self):
+        self.server.files['/big.scad'] = (b'x' * 1000, '"big"', None)
+        with self.assertRaises(Exception):
+            SourceCache(self.tmp.name, max_file_bytes=999).fetch(self.server.url('/big.scad'))
+        self.assertEqual(self.cache.stats().entries, 0)
+
+        with self.assertRaises(requests.HTTPError):
+            self.cache.fetch(self.server.url('/missing.scad'))
+
+        self.server.delay = 1
+        with self.assertRaises(requests.Timeout):
+            SourceCache(self.tmp.name, timeout=0.2).fetch(self.server.url('/big.scad'))
+
+    def test_evicts_by_size(self):
+        cache = SourceCache(self.tmp.name, max_bytes=2500)
+        for name in 'abc':
+            self.server.files[f'/{name}.scad'] = (b'x' * 1000, f'"{name}"', None)
+            cache.fetch(self.server.url(f'/{name}.scad'))
+            time.sleep(0.01)
+        self.assertLessEqual(cache.stats().size, 2500)
+        self.assertTrue(os.path.exists(cache.fetch(self.server.url('/c.scad'))))
+
+    def test_get_scad_file(self):
+        self.server.files['/d.scad'] = (b'cube(3);', '"d"', None)
+        with mock.patch('scad.functions.get_source_cache', return_value=self.cache):
+            for _ in range(2):
+                with scad.functions.get_scad_file(self.server.url('/d.scad')) as path:
+                    self.assertEqual(self.read(path), b'cube(3);')
+        self.assertEqual(self.cache.not_modified, 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_scad_file_lasts_until_done(self):
+        self.server.files['/e.scad'] = (b'cube(1);', '"e1"', None)
+        with mock.patch('scad.functions.get_source_cache', return_value=self.cache):
+            with scad.functions.get_scad_file(self.server.url('/e.scad')) as path:
+                # a newer download and eviction don't touch the file being used
+                self.server.files['/e.scad'] = (b'cube(2);', '"e2"', None)
+                self.assertEqual(self.read(self.cache.fetch(self.server.url('/e.scad'))), b'cube(2);')
+                for entry in self.cache.entries():
+                    os.remove(entry.path)
+                self.assertEqual(self.read(path), b'cube(1);')
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
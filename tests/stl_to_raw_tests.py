@@ -0,0 +1,195 @@
+import io
+import os
+import struct
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+import stl_to_raw
+
+
+# A small mesh with shared vertices (two triangles of a square, plus a tetrahedron's worth of faces)
+TRIANGLES = [
+    ((0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 1.0, 0.0)),
+    ((0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (1.0, 1.0, 0.0), (0.0, 1.0, 0.0)),
+    ((0.0, -1.0, 0.0), (0.0, 0.0, 0.0), (0.5, 0.5, 2.0), (1.0, 0.0, 0.0)),
+    ((1.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.5, 0.5, 2.0), (1.0, 1.0, 0.0)),
+    ((0.0, 1.0, 0.0), (1.0, 1.0, 0.0), (0.5, 0.5, 2.0), (0.0, 1.0, 0.0)),
+    ((-1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.5, 0.5, 2.0), (0.0, 0.0, 0.0)),
+]
+
+
+def make_binary_stl(triangles) -> bytes:
+    data = bytearray(b'binary header'.ljust(stl_to_raw.BINARY_HEADER_SIZE, b'\0'))
+    data += struct.pack('<I', len(triangles))
+    for tri in triangles:
+        data += struct.pack('<12fxx', *(c for v in tri for c in v))
+    return bytes(data)
+
+
+def make_ascii_stl(triangles, name=b'test') -> bytes:
+    lines = [b'solid ' + name]
+    for normal, *vertices in triangles:
+        lines.append(b'facet normal %f %f %f' % normal)
+        lines.append(b'  outer loop')
+        for vertex in vertices:
+            lines.append(b'    vertex %f %f %f' % vertex)
+        lines.append(b'  endloop')
+        lines.append(b'endfacet')
+    lines.append(b'endsolid ' + name)
+    return b'\n'.join(lines) + b'\n'
+
+
+def read_reference(data: bytes):
+    """Reads an STL with the original dict/list based readers and converts the result to arrays"""
+    file = io.BufferedReader(io.BytesIO(data))
+    header, header_pos, is_binary = stl_to_raw.process_header(file)
+    if is_binary:
+        result = stl_to_raw.read_binary_stl(file, header_pos)
+    else:
+        result = stl_to_raw.read_ascii_stl(file, header, header_pos)
+    return stl_to_raw.ibo_to_arrays(*result)
+
+
+class TestBinaryStl(unittest.TestCase):
+
+    def assertMeshEqual(self, actual, expected):
+        np.testing.assert_array_equal(actual[0], expected[0])
+        np.testing.assert_array_equal(actual[1], expected[1])
+
+    def test_read_binary_stl_np_matches_reference(self):
+        data = make_binary_stl(TRIANGLES)
+        file = io.BufferedReader(io.BytesIO(data))
+        _, header_pos, is_binary = stl_to_raw.process_header(file)
+        self.assertTrue(is_binary)
+        vertices, indices = stl_to_raw.read_binary_stl_np(file, header_pos)
+        self.assertMeshEqual((vertices, indices), read_reference(data))
+        self.assertEqual(vertices.shape, (5, 3))
+        self.assertEqual(len(indices), 3 * len(TRIANGLES))
+
+    def test_read_binary_stl_np_random_mesh(self):
+        rng = np.random.default_rng(1)
+        points = rng.integers(0, 20, (3000, 3)).astype(float)  # lots of repeats
+        triangles = [((0.0, 0.0, 0.0), *map(tuple, points[i:i + 3])) for i in range(0, len(points), 3)]
+        data = make_binary_stl(triangles)
+        file = io.BufferedReader(io.BytesIO(data))
+        _, header_pos, _ = stl_to_raw.process_header(file)
+        self.assertMeshEqual(stl_to_raw.read_binary_stl_np(file, header_pos), read_reference(data))
+
+    def test_read_binary_stl_np_too_short(self):
+        data = make_binary_stl(TRIANGLES)[:-10]
+        file = io.BufferedReader(io.BytesIO(data))
+        _, header_pos, _ = stl_to_raw.process_header(file)
+        with self.assertRaises(Exception):
+            stl_to_raw.read_binary_stl_np(file, header_pos)
+
+    def test_read_binary_stl_mmap_matches_reference(self):
+        data = make_binary_stl(TRIANGLES)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'mesh.stl')
+            with open(path, 'wb') as f:
+                f.write(data)
+            with open(path, 'rb') as file:
+                _, _, is_binary = stl_to_raw.process_header(file)
+                self.assertTrue(is_binary)
+                vertices, indices = stl_to_raw.read_binary_stl_mmap(file)
+        np.testing.assert_array_equal(vertices, read_reference(data)[0])
+        np.testing.assert_array_equal(indices, read_reference(data)[1])
+
+    def test_read_binary_stl_mmap_too_short(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'mesh.stl')
+            with open(path, 'wb') as f:
+                f.write(make_binary_stl(TRIANGLES)[:-10])
+            with open(path, 'rb') as file, self.assertRaises(Exception):
+                stl_to_raw.read_binary_stl_mmap(file)
+
+
+class TestAsciiStl(unittest.TestCase):
+
+    def test_read_ascii_stl_np_matches_reference(self):
+        data = make_ascii_stl(TRIANGLES)
+        file = io.BufferedReader(io.BytesIO(data))
+        header, header_pos, is_binary = stl_to_raw.process_header(file)
+        self.assertFalse(is_binary)
+        vertices, indices = stl_to_raw.read_ascii_stl_np(file, header, header_pos)
+        expected = read_reference(data)
+        np.testing.assert_array_equal(vertices, expected[0])
+        np.testing.assert_array_equal(indices, expected[1])
+
+    def test_read_ascii_stl_np_small_chunks(self):
+        data = make_ascii_stl(TRIANGLES).replace(b'\n', b' \r\n  ')
+        expected = read_reference(data)
+        for chunk_size in (1, 5, 7, 64, 1000):
+            file = io.BufferedReader(io.BytesIO(data))
+            header, header_pos, _ = stl_to_raw.process_header(file)
+            vertices, indices = stl_to_raw.read_ascii_stl_np(file, header, header_pos, chunk_size)
+            np.testing.assert_array_equal(vertices, expected[0])
+            np.testing.assert_array_equal(indices, expected[1])
+
+    def test_read_ascii_stl_np_unusual_numbers(self):
+        data = make_ascii_stl(TRIANGLES).replace(b'1.000000', b'1_0.0', 2).replace(b'0.500000', b'+5E-1')
+        data = data.replace(b'2.000000', b'2.').replace(b' 0.000000', b'\t-0', 4)
+        expected = read_reference(data)
+        file = io.BufferedReader(io.BytesIO(data))
+        header, header_pos, _ = stl_to_raw.process_header(file)
+        vertices, indices = stl_to_raw.read_ascii_stl_np(file, header, header_pos)
+        np.testing.assert_array_equal(vertices, expected[0])
+        np.testing.assert_array_equal(indices, expected[1])
+
+    def test_read_ascii_stl_np_errors(self):
+        good = make_ascii_stl(TRIANGLES)
+        bad_files = [
+            good.replace(b'endsolid test', b'endsolid other'),
+            good.replace(b'endsolid test', b''),
+            good.replace(b'0.500000', b'0.5x', 1),
+            good.replace(b'endloop', b'endlop', 3),
+            good.replace(b'outer loop', b'outer', 1),
+            good.replace(b'facet normal', b'fac normal', 2),
+            good[:len(good) // 2],
+        ]
+        for data in bad_files:
+            for chunk_size in (16, stl_to_raw.ASCII_CHUNK_SIZE):
+                file = io.BufferedReader(io.BytesIO(data))
+                header, header_pos, _ = stl_to_raw.process_header(file)
+                with self.assertRaises(Exception):
+                    stl_to_raw.read_ascii_stl_np(file, header, header_pos, chunk_size)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        points = rng.integers(0, 12, (600, 3)).astype(float)
+        self.triangles = [((0.0, 0.0, 0.0), *map(tuple, points[i:i + 3])) for i in range(0, len(points), 3)]
+
+    def test_stream_stl2raw(self):
+        for data in (make_binary_stl(self.triangles), make_ascii_stl(self.triangles)):
+            expected_vertices, expected_indices = read_reference(data)
+            with tempfile.TemporaryDirectory() as tmp:
+                path, output_path = os.path.join(tmp, 'mesh.stl'), os.path.join(tmp, 'mesh.vao')
+                with open(path, 'wb') as f:
+                    f.write(data)
+                counts = stl_to_raw.stream_stl2raw(path, output_path, chunk_triangles=16)
+                _, vertices, indices = stl_to_raw.read_raw_file(output_path)
+            self.assertEqual(counts, (len(expected_vertices), len(expected_indices)))
+            np.testing.assert_array_equal(vertices, expected_vertices)
+            np.testing.assert_array_equal(indices, expected_indices)
+
+
+    def test_read_stl_from_pipe(self):
+        for data in (make_binary_stl(self.triangles), make_ascii_stl(self.triangles)):
+            expected_vertices, expected_indices = read_reference(data)
+            read_fd, write_fd = os.pipe()
+            writer = threading.Thread(target=lambda: (os.write(write_fd, data), os.close(write_fd)))
+            writer.start()
+            with open(read_fd, 'rb') as file:
+                vertices, indices = stl_to_raw.read_stl(file)
+            writer.join()
+            np.testing.assert_array_equal(vertices, expected_vertices)
+            np.testing.assert_array_equal(indices, expected_indices)
+
+if __name__ == '__main__':
+    unittest.main()
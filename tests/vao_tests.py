@@ -0,0 +1,125 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import vao
+
+
+class TestVao(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'mesh.vao')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_mesh(self, num_vertices):
+        rng = np.random.default_rng(4)
+        vertices = rng.random((num_vertices, 3), np.float32) * 10 - 5
+        indices = rng.integers(0, num_vertices, 3 * num_vertices)
+        return vertices, indices
+
+    def test_round_trip_16_bit(self):
+        vertices, indices = self.make_mesh(100)
+        vao.write_vao(self.path, vertices, indices)
+        header, read_vertices, read_indices = vao.read_vao(self.path)
+        self.assertEqual(header.version, 2)
+        self.assertEqual(header.flags & vao.FLAG_INDEX_32, 0)
+        self.assertEqual(read_indices.dtype, np.dtype('>u2'))
+        np.testing.assert_array_equal(read_vertices, vertices)
+        np.testing.assert_array_equal(read_indices, indices)
+        np.testing.assert_array_equal(header.bbox_min, vertices.min(axis=0))
+        np.testing.assert_array_equal(header.bbox_max, vertices.max(axis=0))
+
+    def test_round_trip_32_bit(self):
+        vertices, indices = self.make_mesh(70000)
+        vao.write_vao(self.path, vertices, indices)
+        header, read_vertices, read_indices = vao.read_vao(self.path)
+        self.assertTrue(header.flags & vao.FLAG_INDEX_32)
+        np.testing.assert_array_equal(read_vertices, vertices)
+        np.testing.assert_array_equal(read_indices, indices)
+
+    def test_version_1(self):
+        vertices, indices = self.make_mesh(100)
+        vao.write_vao(self.path, vertices, indices, version=1)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(8), b'\0\0\0\x64\0\0\x01\x2c')
+        header, read_vertices, read_indices = vao.read_vao(self.path)
+        self.assertEqual(header.version, 1)
+        np.testing.assert_array_equal(read_vertices, vertices)
+        np.testing.assert_array_equal(read_indices, indices)
+
+        with self.assertRaises(ValueError):
+            vao.write_vao(self.path, *self.make_mesh(70000), version=1)
+
+    def test_file_object_and_empty(self):
+        output = io.BytesIO()
+        vao.write_vao(output, np.empty((0, 3)), [])
+        with open(self.path, 'wb') as f:
+            f.write(output.getvalue())
+        header, vertices, indices = vao.read_vao(self.path)
+        self.assertEqual((header.num_vertices, header.num_indices), (0, 0))
+        self.assertEqual(vertices.shape, (0, 3))
+
+    def test_stream_writer_matches_write_vao(self):
+        for num_vertices in (100, 70000):
+            vertices, indices = self.make_mesh(num_vertices)
+            expected = io.BytesIO()
+            vao.write_vao(expected, vertices, indices)
+
+            output = io.BytesIO()
+            with vao.VaoStreamWriter(output) as writer:
+                for start in range(0, num_vertices, 300):
+                    writer.write(vertices[start:start + 300], indices[3 * start:3 * start + 900])
+            self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_compact_encodings(self):
+        for num_vertices in (100, 40000, 70000):
+            vertices, indices = self.make_mesh(num_vertices)
+            step = (vertices.max(axis=0) - vertices.min(axis=0)) / 0xFFFF
+            for options in ({'quantize': True}, {'delta_indices': True}, {'compression': 'zlib'},
+                            {'compression': 'lzma', 'quantize': True, 'delta_indices': True}):
+                data = vao.encode_vao(vertices, indices, **options)
+                header, read_vertices, read_indices = vao.decode_vao(data)
+                np.testing.assert_array_equal(read_indices, indices)
+                if options.get('quantize'):
+                    self.assertTrue(np.all(np.abs(read_vertices - vertices) <= step))
+                else:
+                    np.testing.assert_array_equal(read_vertices, vertices)
+
+                # read_vao decodes instead of mapping
+                with open(self.path, 'wb') as f:
+                    f.write(data)
+                np.testing.assert_array_equal(vao.read_vao(self.path).indices, indices)
+
+    def test_quantize_flat_mesh(self):
+        vertices = np.array([[0, 0, 1], [1, 0, 1], [0, 1, 1]], np.float32)
+        _, read_vertices, _ = vao.decode_vao(vao.encode_vao(vertices, [0, 1, 2], quantize=True))
+        np.testing.assert_array_equal(read_vertices, vertices)
+
+    def test_normals(self):
+        vertices, indices = self.make_mesh(100)
+        normals = vertices / np.linalg.norm(vertices, axis=1)[:, None]
+        vao.write_vao(self.path, vertices, indices, normals=normals)
+        header, read_vertices, _ = vao.read_vao(self.path)
+        self.assertTrue(header.flags & vao.FLAG_NORMALS)
+        np.testing.assert_array_equal(read_vertices, np.hstack((vertices, normals)))
+
+        _, read_vertices, _ = vao.decode_vao(vao.encode_vao(vertices, indices, normals=normals, quantize=True))
+        self.assertEqual(read_vertices.shape, (100, 6))
+        self.assertTrue(np.all(np.abs(read_vertices[:, 3:] - normals) <= 2 / 0xFFFF))
+
+    def test_wrong_size(self):
+        vao.write_vao(self.path, *self.make_mesh(10))
+        with open(self.path, 'ab') as f:
+            f.write(b'\0')
+        with self.assertRaises(ValueError):
+            vao.read_vao(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
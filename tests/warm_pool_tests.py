@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from scad.warm_pool import WarmPool, feed_pipe
+
+# Acts like OpenSCAD: takes a while to start, then writes the scad file, the variables, and an included file to the
+# output as json
+FAKE_OPENSCAD = '''
+import json, os, sys, time
+time.sleep(float(os.environ.get('FAKE_STARTUP', 0)))
+args = sys.argv[1:]
+output = args[args.index('-o') + 1]
+scad_file = args[-1]
+if os.environ.get('FAKE_NO_PIPES') and not os.path.isfile(scad_file):
+    sys.exit(1)
+variables = None
+if '-p' in args:
+    with open(args[args.index('-p') + 1]) as f:
+        variables = json.load(f)['parameterSets'][args[args.index('-P') + 1]]
+with open(scad_file) as f:
+    source = f.read()
+if 'fail' in source:
+    sys.exit(2)
+with open(os.path.join(os.path.dirname(scad_file), 'lib.scad')) as f:
+    library = f.read()
+with open(output, 'w') as f:
+    json.dump([source, variables, library], f)
+'''
+
+
+class TestWarmPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fake = self.write('fake_openscad.py', FAKE_OPENSCAD)
+        self.scad = self.write('project/model.scad', 'include <lib.scad>\ncube(size);\n')
+        self.write('project/lib.scad', 'size = 1;\n')
+        self.parameters = self.write('parameters.json', json.dumps(
+            {'parameterSets': {'a': {'size': 2}, 'b': {'size': 3}}, 'fileFormatVersion': '1'}))
+        os.environ['FAKE_STARTUP'] = '1.5'
+        self.pool = WarmPool(1, [sys.executable, self.fake], os.path.join(self.tmp.name, 'slots'))
+
+    def tearDown(self):
+        self.pool.close()
+        os.environ.pop('FAKE_STARTUP', None)
+        os.environ.pop('FAKE_NO_PIPES', None)
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def render(self, parameter_set='a', source=None):
+        output = os.path.join(self.tmp.name, 'output.stl')
+        start = time.monotonic()
+        if source is not None:
+            self.write('project/model.scad', source)
+        self.pool.render(output, self.scad, self.parameters, parameter_set)
+        with open(output) as f:
+            return json.load(f), time.monotonic() - start
+
+    def test_warm_render(self):
+        cold, _ = self.render('a')
+        time.sleep(2.5)  # the slot started by the first render warms up
+        warm, elapsed = self.render('b')
+        self.assertEqual(cold, ['include <lib.scad>\ncube(size);\n', {'size': 2}, 'size = 1;\n'])
+        self.assertEqual(warm, ['include <lib.scad>\ncube(size);\n', {'size': 3}, 'size = 1;\n'])
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual((self.pool.cold, self.pool.warm), (1, 1))
+
+    def test_failures(self):
+        self.render()
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.render(source='fail')
+        self.assertEqual((self.pool.cold, self.pool.warm), (2, 0))  # the failed warm render was done again cold
+
+    def test_openscad_without_pipes(self):
+        os.environ['FAKE_STARTUP'] = '0'
+        os.environ['FAKE_NO_PIPES'] = '1'
+        self.render()
+        time.sleep(1)
+        result, _ = self.render('b')
+        self.assertEqual(result[1], {'size': 3})
+        self.assertTrue(self.pool.broken)
+        self.assertEqual((self.pool.cold, self.pool.warm), (2, 0))
+
+    def test_feed_pipe_without_reader(self):
+        path = os.path.join(self.tmp.name, 'pipe')
+        os.mkfifo(path)
+        stop = threading.Event()
+        writer = threading.Thread(target=feed_pipe, args=(path, b'data', stop), daemon=True)
+        writer.start()
+        time.sleep(0.1)
+        stop.set()  # the reader exited without opening it
+        writer.join(1)
+        self.assertFalse(writer.is_alive())
+
+        stop.clear()
+        writer = threading.Thread(target=feed_pipe, args=(path, b'data', stop), daemon=True)
+        writer.start()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        writer.join(1)
+        self.assertFalse(writer.is_alive())
+
+    def test_close(self):
+        self.render()
+        self.pool.close()
+        self.assertFalse(os.path.exists(self.pool.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import mesh_stats
+import stl_to_raw
+import weld
+from mesh_stats_tests import CUBE_INDICES, CUBE_VERTICES
+from stl_to_raw_tests import make_binary_stl
+
+
+class TestWeldVertices(unittest.TestCase):
+
+    def split_cube(self, noise):
+        # Every triangle gets its own copies of its vertices, moved a little
+        rng = np.random.default_rng(6)
+        vertices = CUBE_VERTICES[CUBE_INDICES] + rng.uniform(-noise, noise, (len(CUBE_INDICES), 3))
+        return vertices, np.arange(len(CUBE_INDICES))
+
+    def test_near_duplicates(self):
+        vertices, indices = self.split_cube(1e-6)
+        welded, welded_indices, num_merged = weld.weld_vertices(vertices, indices, 1e-5)
+        self.assertEqual(len(welded), 8)
+        self.assertEqual(num_merged, 36 - 8)
+        np.testing.assert_allclose(welded[welded_indices], CUBE_VERTICES[CUBE_INDICES], atol=1e-6)
+        # The first copy of each vertex is kept
+        _, first = np.unique(CUBE_INDICES, return_index=True)
+        np.testing.assert_array_equal(welded, vertices[np.sort(first)])
+        self.assertAlmostEqual(mesh_stats.mesh_stats(welded, welded_indices).volume, 1, 4)
+
+    def test_tolerance_too_small(self):
+        vertices, indices = self.split_cube(1e-3)
+        welded, welded_indices, num_merged = weld.weld_vertices(vertices, indices, 1e-6)
+        self.assertEqual(num_merged, 0)
+        np.testing.assert_array_equal(welded, vertices)
+        np.testing.assert_array_equal(welded_indices, indices)
+
+    def test_across_cells_and_chains(self):
+        # The first two are in different cells, and the last is only close to the one before it
+        vertices = np.array([[0.999, 0, 0], [1.001, 0, 0], [1.009, 0, 0], [5, 5, 5]])
+        welded, welded_indices, num_merged = weld.weld_vertices(vertices, [3, 2, 1, 0], 0.01)
+        self.assertEqual(num_merged, 2)
+        np.testing.assert_array_equal(welded, vertices[[0, 3]])
+        np.testing.assert_array_equal(welded_indices, [1, 0, 0, 0])
+
+    def test_chunks(self):
+        rng = np.random.default_rng(7)
+        vertices = np.round(rng.random((2000, 3)), 2) + rng.uniform(-1e-4, 1e-4, (2000, 3))
+        indices = rng.integers(0, 2000, 600)
+        expected = weld.weld_vertices(vertices, indices, 1e-3)
+        original = weld.WELD_CHUNK
+        try:
+            weld.WELD_CHUNK = 100
+            result = weld.weld_vertices(vertices, indices, 1e-3)
+        finally:
+            weld.WELD_CHUNK = original
+        np.testing.assert_array_equal(result[0], expected[0])
+        np.testing.assert_array_equal(result[1], expected[1])
+        self.assertEqual(result[2], expected[2])
+        self.assertGreater(expected[2], 0)
+
+    def test_bad_tolerance(self):
+        with self.assertRaises(ValueError):
+            weld.weld_vertices(CUBE_VERTICES, CUBE_INDICES, 0)
+
+    def test_empty(self):
+        vertices, indices, num_merged = weld.weld_vertices(np.empty((0, 3)), [], 1)
+        self.assertEqual((len(vertices), len(indices), num_merged), (0, 0, 0))
+
+    def test_stl2raw(self):
+        vertices, _ = self.split_cube(1e-6)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cube.stl')
+            with open(path, 'wb') as f:
+                f.write(make_binary_stl(np.concatenate((np.zeros((12, 1, 3)), vertices.reshape(-1, 3, 3)), axis=1)))
+            self.assertEqual(len(stl_to_raw.stl2raw(path)[0]), 36)
+            vertices, indices = stl_to_raw.stl2raw(path, weld_tolerance=1e-5)
+            self.assertEqual(len(vertices), 8)
+            self.assertAlmostEqual(mesh_stats.mesh_stats(vertices, indices).volume, 1, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
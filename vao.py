@@ -0,0 +1,348 @@
+import contextlib
+import io
+import lzma
+import os
+import struct
+import zlib
+from collections import namedtuple
+from tempfile import TemporaryFile
+from typing import BinaryIO, Iterator, Union
+
+import numpy as np
+
+from mesh_stats import bounding_box
+
+# Version 1 is just the number of vertices and indices (big-endian uint32s) followed by the vertices (big-endian float32s)
+# and the indices (big-endian uint16s). Version 2 starts with a magic number and version, has flags for the format of
+# the rest of the file, and stores the bounding box of the vertices.
+VAO_MAGIC = b'MVAO'
+VAO_VERSION = 2
+VAO_HEADER = struct.Struct('>4sHHII6f')  # magic, version, flags, number of vertices, number of indices, min xyz, max xyz
+VAO_V1_HEADER = struct.Struct('>II')
+
+# Flags in a version 2 header
+FLAG_INDEX_32 = 0x1  # indices are uint32 instead of uint16
+FLAG_QUANTIZED = 0x2  # vertices are uint16s, 0 to 65535 across the bounding box
+FLAG_INDEX_DELTA = 0x4  # indices are the zigzag-encoded difference from the index before
+FLAG_ZLIB = 0x8  # everything after the header is compressed with zlib
+FLAG_LZMA = 0x10  # everything after the header is compressed with lzma (xz)
+FLAG_NORMALS = 0x20  # each vertex is followed by its normal (x, y, z, nx, ny, nz), quantized normals go -1 to 1
+ENCODING_FLAGS = FLAG_QUANTIZED | FLAG_INDEX_DELTA | FLAG_ZLIB | FLAG_LZMA
+
+COMPRESSION_FLAGS = {None: 0, 'zlib': FLAG_ZLIB, 'lzma': FLAG_LZMA}
+QUANTIZED_DTYPE = np.dtype('>u2')
+QUANTIZED_MAX = 0xFFFF
+
+VERTEX_DTYPE = np.dtype('>f4')
+INDEX_DTYPES = {False: np.dtype('>u2'), True: np.dtype('>u4')}
+
+# Number of indices converted at a time when copying them out of the temporary file
+COPY_CHUNK_INDICES = 1 << 20
+
+VaoHeader = namedtuple('VaoHeader', ('version', 'flags', 'num_vertices', 'num_indices', 'bbox_min', 'bbox_max'))
+Vao = namedtuple('Vao', ('header', 'vertices', 'indices'))
+
+Output = Union[str, os.PathLike, BinaryIO]
+
+
+def write_vao(output: Output, vertices: np.ndarray, indices: np.ndarray, version: int = VAO_VERSION,
+              quantize: bool = False, delta_indices: bool = False, compression: str = None,
+              normals: np.ndarray = None):
+    """
+    Writes a vao file, using 32-bit indices only if there are too many vertices for 16-bit indices. The compact
+    encodings are only in version 2 and files that use them can't be memory-mapped by read_vao.
+    :param output: the path of the file to write or a file object opened for binary writing
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices
+    :param version: the version of the format to write, version 1 can only have 16-bit indices
+    :param quantize: store the vertices as 16-bit numbers across the bounding box
+    :param delta_indices: store the indices as zigzag-encoded differences (so they compress better)
+    :param compression: None, 'zlib', or 'lzma' to compress everything after the header
+    :param normals: an (N,3) array of a normal for each vertex to interleave with the vertices
+    """
+    vertices = np.asarray(vertices, np.float32).reshape(-1, 3)
+    index_32 = needs_index_32(len(vertices))
+
+    with open_output(output) as f:
+        if version == 1:
+            if index_32:
+                raise ValueError(f'too many vertices for a version 1 vao file: {len(vertices)}')
+            if quantize or delta_indices or compression or normals is not None:
+                raise ValueError('version 1 vao files can only be plain')
+            f.write(VAO_V1_HEADER.pack(len(vertices), len(indices)))
+            f.write(vertices.astype(VERTEX_DTYPE).tobytes())
+            f.write(np.asarray(indices, INDEX_DTYPES[False]).tobytes())
+        elif version == 2:
+            if compression not in COMPRESSION_FLAGS:
+                raise ValueError(f'unknown compression: {compression}')
+            bbox_min, bbox_max = bounding_box(vertices)
+            flags = COMPRESSION_FLAGS[compression]
+
+            if quantize:
+                flags |= FLAG_QUANTIZED
+                vertex_data = quantize_vertices(vertices, bbox_min, bbox_max)
+            else:
+                vertex_data = vertices.astype(VERTEX_DTYPE)
+
+            if normals is not None:
+                flags |= FLAG_NORMALS
+                normals = np.asarray(normals, np.float32).reshape(-1, 3)
+                if len(normals) != len(vertices):
+                    raise ValueError('there must be a normal for each vertex')
+                normal_data = quantize_vertices(normals, (-1, -1, -1), (1, 1, 1)) if quantize else normals
+                vertex_data = np.hstack((vertex_data, normal_data)).astype(vertex_data.dtype)  # hstack is native-endian
+
+            if delta_indices:
+                flags |= FLAG_INDEX_DELTA
+                indices = zigzag_delta(indices)
+                index_32 = len(indices) and indices.max() > 0xFFFF
+            if index_32:
+                flags |= FLAG_INDEX_32
+
+            f.write(pack_header(flags, len(vertices), len(indices), bbox_min, bbox_max))
+            compressor = make_compressor(flags)
+            for data in (vertex_data.tobytes(), np.asarray(indices, INDEX_DTYPES[bool(index_32)]).tobytes()):
+                f.write(compressor.compress(data) if compressor else data)
+            if compressor:
+                f.write(compressor.flush())
+        else:
+            raise ValueError(f'unknown vao version: {version}')
+
+
+def encode_vao(vertices: np.ndarray, indices: np.ndarray, **options) -> bytes:
+    """
+    Makes the contents of a vao file, see write_vao for the options
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices
+    :return: the vao file as bytes
+    """
+    output = io.BytesIO()
+    write_vao(output, vertices, indices, **options)
+    return output.getvalue()
+
+
+def decode_vao(data: bytes) -> Vao:
+    """
+    Reads the contents of a vao file with any encoding
+    :param data: the vao file as bytes
+    :return: the header, an (N,3) float32 array of the vertices (N,6 with the normals after them), and a uint32 array
+             of the indices
+    """
+    header, offset = parse_header(data)
+    body = data[offset:]
+    if header.flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    elif header.flags & FLAG_LZMA:
+        body = lzma.decompress(body)
+
+    vertex_dtype = QUANTIZED_DTYPE if header.flags & FLAG_QUANTIZED else VERTEX_DTYPE
+    index_dtype = INDEX_DTYPES[bool(header.flags & FLAG_INDEX_32)]
+    columns = vertex_columns(header)
+    index_offset = header.num_vertices * columns * vertex_dtype.itemsize
+    if len(body) != index_offset + header.num_indices * index_dtype.itemsize:
+        raise ValueError('vao file has the wrong size')
+
+    vertices = np.frombuffer(body, vertex_dtype, header.num_vertices * columns).reshape(-1, columns)
+    indices = np.frombuffer(body, index_dtype, header.num_indices, index_offset)
+    if header.flags & FLAG_QUANTIZED:
+        positions = dequantize_vertices(vertices[:, :3], header.bbox_min, header.bbox_max)
+        if header.flags & FLAG_NORMALS:
+            positions = np.hstack((positions, dequantize_vertices(vertices[:, 3:], (-1, -1, -1), (1, 1, 1))))
+        vertices = positions
+    if header.flags & FLAG_INDEX_DELTA:
+        indices = undo_zigzag_delta(indices)
+    return Vao(header, vertices.astype(np.float32), indices.astype(np.uint32))
+
+
+def quantize_vertices(vertices: np.ndarray, bbox_min, bbox_max) -> np.ndarray:
+    """
+    Converts vertices to 16-bit numbers where 0 is the min of the bounding box and 65535 is the max
+    """
+    bbox_min = np.asarray(bbox_min, np.float64)
+    extent = np.asarray(bbox_max, np.float64) - bbox_min
+    scale = np.divide(QUANTIZED_MAX, extent, out=np.zeros(3), where=extent > 0)
+    return np.rint((vertices - bbox_min) * scale).clip(0, QUANTIZED_MAX).astype(QUANTIZED_DTYPE)
+
+
+def dequantize_vertices(quantized: np.ndarray, bbox_min, bbox_max) -> np.ndarray:
+    """
+    Converts vertices from quantize_vertices back to floats
+    """
+    bbox_min = np.asarray(bbox_min, np.float64)
+    extent = np.asarray(bbox_max, np.float64) - bbox_min
+    return (bbox_min + quantized * (extent / QUANTIZED_MAX)).astype(np.float32)
+
+
+def zigzag_delta(indices: np.ndarray) -> np.ndarray:
+    """
+    Converts indices to the difference from the previous index, zigzag-encoded so small negative numbers are small
+    """
+    deltas = np.diff(np.asarray(indices, np.int64), prepend=0)
+    return (deltas << 1) ^ (deltas >> 63)
+
+
+def undo_zigzag_delta(encoded: np.ndarray) -> np.ndarray:
+    """
+    Converts indices from zigzag_delta back to indices
+    """
+    encoded = encoded.astype(np.int64)
+    return np.cumsum((encoded >> 1) ^ -(encoded & 1))
+
+
+def make_compressor(flags: int):
+    if flags & FLAG_ZLIB:
+        return zlib.compressobj(6)
+    if flags & FLAG_LZMA:
+        return lzma.LZMACompressor()
+    return None
+
+
+class VaoStreamWriter:
+    """
+    Writes a version 2 vao file a chunk of vertices and indices at a time. The vertices are written as they come, the
+    indices are kept in a temporary file until the end (since they go after all of the vertices), and the header is
+    filled in last so the output must be seekable.
+    """
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.start = output.tell()
+        self.num_vertices = 0
+        self.num_indices = 0
+        self.bbox_min = np.full(3, np.inf, np.float32)
+        self.bbox_max = np.full(3, -np.inf, np.float32)
+        self.index_file = TemporaryFile()
+        output.write(bytes(VAO_HEADER.size))  # filled in at the end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.index_file.close()
+
+    def write(self, vertices: np.ndarray, indices: np.ndarray):
+        """
+        Adds vertices and indices to the file
+        :param vertices: an (N,3) array of vertices that come after all of the vertices already written
+        :param indices: an array of indices into all of the vertices written so far
+        """
+        vertices = np.asarray(vertices, np.float32).reshape(-1, 3)
+        if len(vertices):
+            np.minimum(self.bbox_min, vertices.min(axis=0), out=self.bbox_min)
+            np.maximum(self.bbox_max, vertices.max(axis=0), out=self.bbox_max)
+        self.output.write(vertices.astype(VERTEX_DTYPE).tobytes())
+        self.index_file.write(np.asarray(indices, '>u4').tobytes())
+        self.num_vertices += len(vertices)
+        self.num_indices += len(indices)
+
+    def close(self):
+        """
+        Writes the indices and fills in the header
+        """
+        index_32 = needs_index_32(self.num_vertices)
+        index_dtype = INDEX_DTYPES[index_32]
+        with self.index_file:
+            self.index_file.seek(0)
+            while chunk := self.index_file.read(COPY_CHUNK_INDICES * 4):
+                self.output.write(np.frombuffer(chunk, '>u4').astype(index_dtype).tobytes())
+
+        if self.num_vertices:
+            bbox_min, bbox_max = self.bbox_min, self.bbox_max
+        else:
+            bbox_min = bbox_max = np.zeros(3, np.float32)
+
+        end = self.output.tell()
+        self.output.seek(self.start)
+        self.output.write(pack_header(FLAG_INDEX_32 if index_32 else 0, self.num_vertices, self.num_indices,
+                                      bbox_min, bbox_max))
+        self.output.seek(end)
+
+
+def read_vao(path: Union[str, os.PathLike]) -> Vao:
+    """
+    Memory-maps a vao file (version 1 or 2). The arrays are big-endian and can be sent as they are with tobytes(). Files
+    with a compact encoding are read with decode_vao instead.
+    :param path: the path of the vao file
+    :return: the header, an (N,3) array of the vertices (N,6 with normals), and an array of the indices
+    """
+    with open(path, 'rb') as f:
+        data = f.read(VAO_HEADER.size)
+        size = os.fstat(f.fileno()).st_size
+        header, offset = parse_header(data)
+
+        # The compact encodings have to be decoded
+        if header.flags & ENCODING_FLAGS:
+            f.seek(0)
+            return decode_vao(f.read())
+
+    index_dtype = INDEX_DTYPES[bool(header.flags & FLAG_INDEX_32)]
+    index_offset = offset + header.num_vertices * vertex_columns(header) * VERTEX_DTYPE.itemsize
+    if size != index_offset + header.num_indices * index_dtype.itemsize:
+        raise ValueError('vao file has the wrong size')
+
+    vertices = map_array(path, VERTEX_DTYPE, offset, (header.num_vertices, vertex_columns(header)))
+    indices = map_array(path, index_dtype, index_offset, (header.num_indices,))
+    return Vao(header, vertices, indices)
+
+
+def parse_header(data: bytes) -> (VaoHeader, int):
+    """
+    Reads the header of a version 1 or 2 vao file
+    :param data: the start of the file
+    :return: the header and its size
+    """
+    if data[:len(VAO_MAGIC)] == VAO_MAGIC and len(data) >= VAO_HEADER.size:
+        header = unpack_header(data[:VAO_HEADER.size])
+        if header.version != VAO_VERSION:
+            raise ValueError(f'unknown vao version: {header.version}')
+        return header, VAO_HEADER.size
+    elif len(data) >= VAO_V1_HEADER.size:
+        return VaoHeader(1, 0, *VAO_V1_HEADER.unpack_from(data), None, None), VAO_V1_HEADER.size
+    raise ValueError('vao file too short')
+
+
+def pack_header(flags: int, num_vertices: int, num_indices: int, bbox_min, bbox_max) -> bytes:
+    return VAO_HEADER.pack(VAO_MAGIC, VAO_VERSION, flags, num_vertices, num_indices, *bbox_min, *bbox_max)
+
+
+def unpack_header(data: bytes) -> VaoHeader:
+    _, version, flags, num_vertices, num_indices, *bbox = VAO_HEADER.unpack(data)
+    return VaoHeader(version, flags, num_vertices, num_indices, tuple(bbox[:3]), tuple(bbox[3:]))
+
+
+def vertex_columns(header: VaoHeader) -> int:
+    """
+    Gets the number of numbers stored for each vertex
+    """
+    return 6 if header.flags & FLAG_NORMALS else 3
+
+
+def needs_index_32(num_vertices: int) -> bool:
+    """
+    Checks if the indices of a mesh don't fit in 16 bits
+    """
+    return num_vertices > 0x10000
+
+
+def map_array(path: Union[str, os.PathLike], dtype: np.dtype, offset: int, shape: tuple) -> np.ndarray:
+    """
+    Memory-maps part of a file as a read-only array (numpy can't map zero bytes so empty arrays are just made)
+    """
+    if 0 in shape:
+        return np.empty(shape, dtype)
+    return np.memmap(path, dtype, 'r', offset, shape)
+
+
+@contextlib.contextmanager
+def open_output(output: Output) -> Iterator[BinaryIO]:
+    """
+    Opens a path for binary writing, or passes through an already open file object (which is left open)
+    """
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'wb') as f:
+            yield f
+    else:
+        yield output
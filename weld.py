@@ -0,0 +1,127 @@
+from itertools import product
+
+import numpy as np
+
+# Number of cells whose neighboring cells are looked at a time
+WELD_CHUNK = 1 << 20
+
+# Large odd numbers the integer coordinates of a cell are multiplied by to make its key
+CELL_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], np.uint64)
+
+# The cell itself and half of the 26 cells around it (the other half are found from the other side)
+NEIGHBOR_OFFSETS = np.array([offset for offset in product((-1, 0, 1), repeat=3) if offset >= (0, 0, 0)])
+
+
+def weld_vertices(vertices: np.ndarray, indices: np.ndarray, tolerance: float) -> (np.ndarray, np.ndarray, int):
+    """
+    Merges vertices that are within a distance of each other (like the near-duplicates tessellators make that only
+    differ in the last bit). Vertices are put into a grid of cells the size of the tolerance so only vertices in
+    neighboring cells are compared. Merging is transitive: a chain of vertices that are each close to the next is
+    merged into one vertex even if the ends of the chain are further apart than the tolerance. Each group of merged
+    vertices becomes the vertex of the group that was seen first, and the vertices stay in the order they are first
+    seen. Triangles that end up with two of the same vertex are kept.
+    :param vertices: an (N,3) array of vertices
+    :param indices: an array of indices into the vertices
+    :param tolerance: the largest distance between vertices that are merged, must be positive
+    :return: an (M,3) array of vertices, an array of uint32 indices into them, and the number of vertices merged (N-M)
+    """
+    if not tolerance > 0:
+        raise ValueError(f'the weld tolerance must be positive: {tolerance}')
+    vertices = np.asarray(vertices).reshape(-1, 3)
+    indices = np.asarray(indices, np.intp)
+    pair_i, pair_j = close_pairs(vertices, tolerance)
+    groups = connect(len(vertices), pair_i, pair_j)
+
+    # Groups are numbered by their first vertex, so the kept vertices are the ones that are their own group
+    kept = np.flatnonzero(groups == np.arange(len(vertices)))
+    new_index = np.empty(len(vertices), np.uint32)
+    new_index[kept] = np.arange(len(kept), dtype=np.uint32)
+    return vertices[kept], new_index[groups[indices]], len(vertices) - len(kept)
+
+
+def close_pairs(vertices: np.ndarray, tolerance: float) -> (np.ndarray, np.ndarray):
+    """
+    Finds all of the pairs of vertices that are within a distance of each other
+    :param vertices: an (N,3) array of vertices
+    :param tolerance: the largest distance between vertices in a pair
+    :return: arrays of the first and second vertex of each pair (a pair can show up more than once)
+    """
+    points = vertices.astype(np.float64)
+    if len(points) == 0:
+        return np.empty(0, np.intp), np.empty(0, np.intp)
+
+    # Cells are found by a key made from their coordinates, two cells with the same key only means extra vertices
+    # compared. Since the key is linear, the key of the next cell over is the key plus a constant so the keys of the
+    # neighbors of sorted cells are still sorted (except where they wrap around).
+    keys = np.floor(points / tolerance).astype(np.int64).view(np.uint64) @ CELL_MULTIPLIERS
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    del keys
+    cell_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    cell_keys = sorted_keys[cell_starts]
+    cell_sizes = np.diff(cell_starts, append=len(points))
+    del sorted_keys
+    points = points[order]  # so the vertices of a cell are next to each other
+
+    found_i, found_j = [np.empty(0, np.intp)], [np.empty(0, np.intp)]
+    for start in range(0, len(cell_keys), WELD_CHUNK):
+        cells = np.arange(start, min(start + WELD_CHUNK, len(cell_keys)))
+        for offset in NEIGHBOR_OFFSETS:
+            neighbors, found = find_cells(cell_keys, cell_keys[cells] + (offset.view(np.uint64) @ CELL_MULTIPLIERS))
+            cell_a, cell_b = cells[found], neighbors[found]
+
+            # Every vertex in one cell paired with every vertex in the other
+            sizes_a, sizes_b = cell_sizes[cell_a], cell_sizes[cell_b]
+            counts = sizes_a * sizes_b
+            pair = np.repeat(np.arange(len(counts)), counts)
+            within = np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts)
+            pair_i = cell_starts[cell_a][pair] + within // sizes_b[pair]
+            pair_j = cell_starts[cell_b][pair] + within % sizes_b[pair]
+            if not offset.any():
+                keep = pair_i < pair_j  # pairs in the same cell are found from both vertices
+                pair_i, pair_j = pair_i[keep], pair_j[keep]
+
+            diff = points[pair_i] - points[pair_j]
+            close = np.einsum('ij,ij->i', diff, diff) <= tolerance * tolerance
+            found_i.append(order[pair_i[close]])
+            found_j.append(order[pair_j[close]])
+
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+
+def find_cells(cell_keys: np.ndarray, keys: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Looks up keys in the sorted array of unique cell keys
+    :param cell_keys: a sorted array of unique keys, not empty
+    :param keys: the keys to look up, sorted except that they can wrap around once (a sorted array plus a constant)
+    :return: the position of each key in cell_keys (0 if it isn't there) and whether it is there
+    """
+    # Searching the sorted parts separately is several times faster than jumping all over cell_keys
+    wrap = np.flatnonzero(keys[1:] < keys[:-1])
+    split = wrap[0] + 1 if len(wrap) else len(keys)
+    positions = np.concatenate((np.searchsorted(cell_keys, keys[:split]), np.searchsorted(cell_keys, keys[split:])))
+    positions[positions == len(cell_keys)] = 0
+    found = cell_keys[positions] == keys
+    positions[~found] = 0
+    return positions, found
+
+
+def connect(n: int, pair_i: np.ndarray, pair_j: np.ndarray) -> np.ndarray:
+    """
+    Finds the groups of items that are connected by pairs
+    :param n: the number of items
+    :param pair_i: the first item of each pair
+    :param pair_j: the second item of each pair
+    :return: an array of the smallest item in the group of each item
+    """
+    groups = np.arange(n)
+    while True:
+        # Pull the smaller group of each pair to both ends, then jump to the group of the group until nothing changes
+        smaller = np.minimum(groups[pair_i], groups[pair_j])
+        new_groups = groups.copy()
+        np.minimum.at(new_groups, pair_i, smaller)
+        np.minimum.at(new_groups, pair_j, smaller)
+        new_groups = new_groups[new_groups]
+        if np.array_equal(new_groups, groups):
+            return groups
+        groups = new_groups